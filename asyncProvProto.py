@@ -0,0 +1,225 @@
+import Queue
+import threading
+
+from provProto import ProvProto
+
+
+class ProvFuture(object):
+    """
+    Result of a call queued in AsyncProvProto. It can be passed as an argument
+    to calls queued after it (e.g. the id of a data block that is not
+    registered yet), they get its result.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._error = None
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waits until the call is executed, and returns its result, or raises the
+        error it failed with.
+        """
+        if not self._event.wait(timeout):
+            raise RuntimeError('provenance call not executed in time')
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Waits until the call is executed, and returns the error it failed with,
+        or None.
+        """
+        if not self._event.wait(timeout):
+            raise RuntimeError('provenance call not executed in time')
+        return self._error
+
+    def _set(self, result, error):
+        (self._result, self._error) = (result, error)
+        self._event.set()
+
+    def __str__(self):
+        return str(self._result) if self.done() else 'pending'
+
+
+class AsyncProvProto(object):
+    """
+    Asynchronous flavor of the provenance writing API of ProvProto: calls return
+    a ProvFuture right away, and are executed in the order they were made by a
+    writer thread, with its own connection and ProvProto. The caller can go on
+    processing (e.g. the next data block) while provenance is written; many
+    calls can be outstanding. (Python 2 has no asyncio; the thread plays the
+    role of the event loop and of the async connection.)
+
+    Calls are grouped into transactions by commit(): all calls made since the
+    previous commit() (e.g. everything registered for one data block) are
+    handed to the writer together, and executed and committed in one
+    transaction. If one of them fails, the group is rolled back, its remaining
+    calls are not executed, and the error is reported by their futures and by
+    the future returned by commit(). Groups committed after it are dropped the
+    same way, so that what is written is always what was committed up to the
+    first error (error). Because a group is only started once it is
+    complete, the writer never holds a transaction open while waiting for the
+    caller (with SQLite, which has one writer at a time, the caller could
+    otherwise block on it).
+
+    Methods take the same arguments as those of ProvProto, including the cursor,
+    which is ignored, so that this class can be used in place of ProvProto for
+    writing provenance of data blocks. Times of the calls are taken from clock
+    (a ProvProto) when they are made. Other statements that belong in the
+    transaction of a group (e.g. saving how far processing got) can be queued
+    with execute().
+    """
+    def __init__(self, backend, clock, bufferSize=1000, maxPending=0):
+        """
+        @param backend     Storage backend (see provBackend)
+        @param clock       ProvProto that keeps the current time
+        @param bufferSize  Buffer size of the ProvProto used by the writer
+        @param maxPending  Max number of committed groups waiting for the writer,
+                           after which commit() blocks (0: no limit)
+        """
+        self._backend = backend
+        self._clock = clock
+        self._pp = ProvProto(bufferSize)
+        self._group = []   # (future, name, args, theTime) since the last commit
+        self._queue = Queue.Queue(maxPending)
+        self.error = None  # error of the first group that failed
+        self._thread = threading.Thread(target=self._run,
+                                        name='AsyncProvProto writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def registerDataBlock(self, cursor, tableName):
+        return self._call('registerDataBlock', tableName)
+
+    def registerRowIdInBlock(self, cursor, blockId, theId):
+        return self._call('registerRowIdInBlock', blockId, theId)
+
+    def registerRowIdRangeInBlock(self, cursor, blockId, idBegin, idEnd):
+        return self._call('registerRowIdRangeInBlock', blockId, idBegin, idEnd)
+
+    def closeDataBlock(self, cursor, blockId):
+        return self._call('closeDataBlock', blockId)
+
+    def registerTaskExecution(self, cursor, taskName, nodeId, blockId,
+                              outputBlockId=None):
+        return self._call('registerTaskExecution', taskName, nodeId, blockId,
+                          outputBlockId)
+
+    def registerExposureLineage(self, cursor, blockId):
+        return self._call('registerExposureLineage', blockId)
+
+    def flush(self, cursor):
+        return self._call('flush')
+
+    def execute(self, function, *args):
+        """
+        Queues function(cursor, *args), executed by the writer in the
+        transaction of the current group, e.g. stream.saveHighWaterMark, so
+        that it is committed if and only if the provenance of the group is.
+        """
+        return self._call(function, *args)
+
+    def commit(self):
+        """
+        Hands all calls made since the previous commit() or rollback() to the
+        writer, to be executed and committed in one transaction. Returns a
+        ProvFuture, which reports the error if they were rolled back.
+        """
+        future = ProvFuture()
+        self._queue.put((self._group, future))
+        self._group = []
+        return future
+
+    def rollback(self):
+        """
+        Drops all calls made since the previous commit() or rollback(), their
+        futures report an error.
+        """
+        error = self._backend.Error('rolled back before commit')
+        for call in self._group:
+            call[0]._set(None, error)
+        self._group = []
+
+    def join(self):
+        """
+        Waits until all committed groups are written.
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Writes all committed groups, drops calls that were not committed, and
+        stops the writer thread.
+        """
+        self.rollback()
+        self._queue.put((None, None))
+        self._thread.join()
+
+    def _call(self, name, *args):
+        future = ProvFuture()
+        self._group.append((future, name, args, self._clock.getCurrentTime()))
+        return future
+
+    def _run(self):
+        (conn, cursor) = (None, None)
+        while True:
+            (group, future) = self._queue.get()
+            try:
+                if group is None:
+                    if conn is not None:
+                        conn.close()
+                    return
+                try:
+                    if conn is None and self.error is None:
+                        conn = self._backend.connect()
+                        cursor = conn.cursor()
+                    error = self._write(conn, cursor, self._pp, group)
+                except Exception as e:
+                    # e.g. no connection, or it broke while rolling back
+                    error = e
+                if error is not None and self.error is None:
+                    self.error = error
+                for call in group:
+                    if not call[0].done():
+                        call[0]._set(None, error)
+                future._set(None, error)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, conn, cursor, pp, group):
+        """
+        Executes and commits one group of calls, returns the error, if any.
+        """
+        if self.error is not None:
+            # a group that follows one that failed is dropped
+            return self.error
+        error = None
+        for (future, name, args, theTime) in group:
+            if error is not None:
+                future._set(None, error)
+                continue
+            try:
+                pp.setCurrentTime(theTime)
+                args = [a.result() if isinstance(a, ProvFuture) else a
+                        for a in args]
+                function = getattr(pp, name) if isinstance(name, str) else name
+                future._set(function(cursor, *args), None)
+            except Exception as e:
+                future._set(None, e)
+                error = e
+        if error is None:
+            try:
+                pp.flush(cursor)
+                conn.commit()
+                return None
+            except Exception as e:
+                error = e
+        pp.clearBuffers()
+        pp.invalidateCaches()
+        conn.rollback()
+        return error
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+"""
+Provenance capture benchmark with synthetic workloads of scalable size. Each
+workload is a combination of the number of exposures, nodes, data block policy
+(see blockPolicy) and configuration change frequency; for each of them the
+database is recreated and prepared like in testProvProto.py, and DRP is run
+through Orchestration.
+
+Measured per workload:
+ - capture throughput: exposures processed by DRP per second, with provenance
+ - size of provenance tables (bytes per exposure), and of catalog tables
+ - rows in provenance tables that grow with data blocks
+ - latency of ProvDetective queries: single objects, and batches of objects
+
+Results are written as JSON; given results of a previous run, workloads that
+got slower or bigger are reported. Runs against a local SQLite database by
+default, or against MySQL (credentials from testProvProto.py).
+
+Example:
+  ./benchCapture.py --exposures 1000 10000 --block-size 10 100 \\
+      --block-policy adaptive:10:10000 --output results.json \\
+      --compare baseline.json
+"""
+
+import argparse
+import itertools
+import json
+import platform
+import random
+import sys
+import time
+
+from blockPolicy import makeBlockPolicy
+from orchestration import Orchestration
+from provBackend import MySQLBackend, SQLiteBackend
+from provDetective import ProvDetective
+from testProvProto import mysqlCredentials, prepareIt
+
+# Results compared between runs: name, and whether higher is better.
+_compared = (('exposuresPerSecond', True),
+             ('provBytesPerExposure', False),
+             ('taskExecutionsPerExposure', False),
+             ('queryObjectMedianSeconds', False),
+             ('queryBatchMedianSeconds', False))
+
+# ----------------------------------------------------------------------------------
+
+def benchWorkload(backend, nExposures, nNodes, blockPolicy, cnfChangeEvery,
+                  nWorkers=None, nQueries=100, batchSize=1000):
+    """
+    Recreates the database, runs the workload, and returns a dict with the
+    parameters of the workload and results.
+
+    @param backend         Storage backend (see provBackend)
+    @param nExposures      Number of exposures
+    @param nNodes          Number of processing nodes
+    @param blockPolicy     Data block policy, as accepted by makeBlockPolicy
+    @param cnfChangeEvery  Number of exposures between configuration changes,
+                           0 for no changes
+    @param nWorkers        Number of worker processes, or None to run serially
+    @param nQueries        Number of queries of each kind
+    @param batchSize       Number of objects per batch query
+    """
+    result = dict(exposures=nExposures, nodes=nNodes, blockPolicy=blockPolicy,
+                  cnfChangeEvery=cnfChangeEvery, workers=nWorkers)
+    backend.createSchema()
+    start = time.time()
+    pp = prepareIt(backend, nExposures, nNodes=nNodes)
+    result['prepareSeconds'] = time.time() - start
+
+    orch = Orchestration(pp, backend, cnfChangeEvery=cnfChangeEvery,
+                         blockPolicy=makeBlockPolicy(blockPolicy))
+    start = time.time()
+    if nWorkers is None:
+        orch.runDRP()
+    else:
+        orch.runDRPParallel(nWorkers)
+    elapsed = time.time() - start
+    del orch
+    result['captureSeconds'] = elapsed
+    result['exposuresPerSecond'] = nExposures / elapsed
+
+    conn = backend.connect()
+    cursor = conn.cursor()
+    sizes = backend.tableSizes(cursor)
+    provBytes = sum(s for (t, s) in sizes.items() if t.startswith('prv_'))
+    result['provBytes'] = provBytes
+    result['catalogBytes'] = sum(sizes.values()) - provBytes
+    result['provBytesPerExposure'] = float(provBytes) / nExposures
+    result['tableBytes'] = sizes
+    cursor.execute('SELECT MIN(objectId), MAX(objectId) FROM Object')
+    (firstId, lastId) = cursor.fetchone()
+    conn.close()
+
+    provDet = ProvDetective(backend)
+    result['provRows'] = dict((table, rows) for (table, rows, size)
+                              in provDet.provenanceVolume())
+    result['taskExecutionsPerExposure'] = \
+        float(result['provRows']['prv_TaskExecution']) / nExposures
+    del provDet
+
+    result.update(benchQueries(backend, firstId, lastId, nQueries, batchSize))
+    return result
+
+def benchQueries(backend, firstId, lastId, nQueries, batchSize):
+    """
+    Times ProvDetective queries for randomly selected objects: nQueries queries
+    for one object each, and nQueries/10 (at least one) queries for batchSize
+    objects each. Returns a dict with median and 95th percentile latencies.
+    """
+    provDet = ProvDetective(backend)
+    rand = random.Random(123)
+    single = []
+    for i in xrange(nQueries):
+        objectId = rand.randint(firstId, lastId)
+        start = time.time()
+        list(provDet.taskVersionsForObjects('WCS Determination', [objectId]))
+        single.append(time.time() - start)
+    batches = []
+    for i in xrange(max(1, nQueries / 10)):
+        objectIds = [rand.randint(firstId, lastId) for j in xrange(batchSize)]
+        start = time.time()
+        list(provDet.taskVersionsForObjects('WCS Determination', objectIds,
+                                            batchSize))
+        batches.append(time.time() - start)
+    return dict(queryObjectMedianSeconds=_percentile(single, 50),
+                queryObjectP95Seconds=_percentile(single, 95),
+                queryBatchMedianSeconds=_percentile(batches, 50),
+                queryBatchP95Seconds=_percentile(batches, 95))
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values)-1, int(len(values) * p / 100.0))]
+
+# ----------------------------------------------------------------------------------
+
+def compareResults(baseline, results, tolerance):
+    """
+    Compares results with baseline results of the same workloads. Returns a
+    list of messages, one for each result that is worse than the baseline by
+    more than tolerance (fraction).
+    """
+    def key(r):
+        return (r['exposures'], r['nodes'], r['blockPolicy'], r['cnfChangeEvery'],
+                r['workers'])
+    old = dict((key(r), r) for r in baseline)
+    regressions = []
+    for r in results:
+        if key(r) not in old:
+            continue
+        for (name, higherIsBetter) in _compared:
+            (was, now) = (old[key(r)][name], r[name])
+            if was <= 0:
+                continue
+            change = (now - was) / float(was)
+            if (-change if higherIsBetter else change) > tolerance:
+                regressions.append(
+                    '%s: %s %.4g -> %.4g (%+.0f%%)' %
+                    (_describe(r), name, was, now, change * 100))
+    return regressions
+
+def _describe(r):
+    return 'exposures=%(exposures)s nodes=%(nodes)s blockPolicy=%(blockPolicy)s ' \
+        'cnfChangeEvery=%(cnfChangeEvery)s workers=%(workers)s' % r
+
+# ----------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark provenance capture with synthetic workloads.')
+    parser.add_argument('--sqlite', metavar='FILE', default='benchCapture.db',
+                        help='SQLite database file, recreated for each workload '
+                        '(default: %(default)s)')
+    parser.add_argument('--mysql', action='store_true',
+                        help='run against MySQL instead of SQLite')
+    parser.add_argument('--exposures', type=int, nargs='+', default=[1000],
+                        metavar='N', help='numbers of exposures')
+    parser.add_argument('--nodes', type=int, nargs='+', default=[6],
+                        metavar='N', help='numbers of processing nodes (>= 2)')
+    parser.add_argument('--block-size', type=int, nargs='+', default=[],
+                        metavar='N', help='max numbers of exposures per block '
+                        '(same as --block-policy fixed:N)')
+    parser.add_argument('--block-policy', nargs='+', default=[], metavar='SPEC',
+                        help='data block policies, e.g. fixed:100, time:3600, '
+                        'capacity:2:1, adaptive:10:1000 (default: fixed:10)')
+    parser.add_argument('--cnf-change-every', type=int, nargs='+', default=[0],
+                        metavar='N', help='numbers of exposures between '
+                        'configuration changes, 0 for no changes')
+    parser.add_argument('--workers', type=int, metavar='N',
+                        help='process data blocks in parallel, using N workers')
+    parser.add_argument('--queries', type=int, default=100, metavar='N',
+                        help='number of queries timed per workload')
+    parser.add_argument('--output', metavar='FILE',
+                        help='write results to FILE as JSON')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='report regressions against results in FILE')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='fraction by which a result may be worse than in '
+                        'the compared results (default: %(default)s)')
+    args = parser.parse_args()
+    if min(args.nodes) < 2:
+        parser.error('orchestration needs at least 2 nodes')
+    policies = ['fixed:%d' % n for n in args.block_size] + args.block_policy
+    for spec in policies:
+        try:
+            makeBlockPolicy(spec)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.mysql:
+        backend = MySQLBackend(**mysqlCredentials)
+    else:
+        backend = SQLiteBackend(args.sqlite)
+
+    results = []
+    for (nExposures, nNodes, blockPolicy, cnfChangeEvery) in itertools.product(
+            args.exposures, args.nodes, policies or ['fixed:10'],
+            args.cnf_change_every):
+        r = benchWorkload(backend, nExposures, nNodes, blockPolicy, cnfChangeEvery,
+                          args.workers, args.queries)
+        results.append(r)
+        print >> sys.stderr, \
+            '%s: %8.1f exposures/s  %7.1f provenance bytes/exposure  ' \
+            '%.3f task executions/exposure  query %.2f ms, batch %.1f ms' % \
+            (_describe(r), r['exposuresPerSecond'], r['provBytesPerExposure'],
+             r['taskExecutionsPerExposure'],
+             r['queryObjectMedianSeconds'] * 1e3,
+             r['queryBatchMedianSeconds'] * 1e3)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'backend': backend.name,
+                       'python': platform.python_version(),
+                       'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'results': results}, f, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compareResults(baseline, results, args.tolerance)
+        for msg in regressions:
+            print >> sys.stderr, 'regression:', msg
+        if regressions:
+            sys.exit(1)
+
+# ----------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
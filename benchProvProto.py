@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks for the provenance prototype. The provenance writer benchmarks expect
+the database prepared by testProvProto.py (tasks and nodes must be registered).
+Everything they write is rolled back, so they can be rerun on the same database.
+The orchestration and transfer benchmarks recreate the database for each run.
+
+The memory benchmark compares provenance records held in memory as tuples (as
+fetched from the database) with compact record arrays (see provRecords).
+
+Runs against MySQL, or against the SQLite database file given as argument.
+"""
+
+import gc
+import os
+import sys
+import time
+import zlib
+
+from orchestration import Orchestration
+from provBackend import MySQLBackend, SQLiteBackend
+from provExport import ProvExporter, ProvImporter
+from provProto import ProvProto
+from provRecords import LineageArray, MembershipArray, TaskExecutionArray
+from testProvProto import mysqlCredentials, prepareIt
+
+# ----------------------------------------------------------------------------------
+
+def benchRowIdInBlock(conn, nRows, bufferSize):
+    """
+    Registers nRows row ids in one data block, returns rows per second. Every
+    other id is used, so that no ids can be coalesced into ranges.
+    """
+    cursor = conn.cursor()
+    pp = ProvProto(bufferSize)
+    blockId = pp.registerDataBlock(cursor, 'ScienceCalibratedExposure')
+    start = time.time()
+    for theId in xrange(1, 2*nRows, 2):
+        pp.registerRowIdInBlock(cursor, blockId, theId)
+    pp.flush(cursor)
+    elapsed = time.time() - start
+    conn.rollback()
+    return nRows / elapsed
+
+def benchTaskExecution(conn, nBlocks, bufferSize):
+    """
+    Registers nBlocks data blocks, each processed by one task execution,
+    returns task executions per second.
+    """
+    cursor = conn.cursor()
+    pp = ProvProto(bufferSize)
+    pp.setCurrentTime('2021-10-01 00:00:00')
+    nodeId = pp.getNodeIds(cursor)[0]
+    blockIds = [pp.registerDataBlock(cursor, 'ScienceCalibratedExposure')
+                for i in xrange(nBlocks)]
+    start = time.time()
+    for blockId in blockIds:
+        pp.registerTaskExecution(cursor, 'Image Correction', nodeId, blockId)
+    pp.flush(cursor)
+    elapsed = time.time() - start
+    conn.rollback()
+    return nBlocks / elapsed
+
+def _deepSize(obj, seen=None):
+    """
+    Returns bytes taken by obj and the objects it contains (tuples and lists),
+    counting each object once.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (tuple, list)):
+        size += sum(_deepSize(item, seen) for item in obj)
+    return size
+
+def _syntheticRows(kind, n):
+    """
+    Returns n rows of task executions, data block membership or lineage, as
+    a database driver returns them: a new string object per value.
+    """
+    perBlock = 100
+    if kind == 'taskExecution':
+        return [(i+1, i % 8 + 1, i % 10 + 1,
+                 '2021-10-01 %02d:%02d:00' % (i // perBlock % 24,
+                                              i // perBlock // 24 % 60),
+                 i // perBlock + 1, None)
+                for i in xrange(n)]
+    if kind == 'membership':
+        return [(i // perBlock + 1, 2*i, 2*i + (i % 2)) for i in xrange(n)]
+    return [(i+1, i // 3 + 1, i // 30 + 1, i // perBlock + 1, i // 10 + 1,
+             '2021-10-01 %02d:%02d:00' % (i // perBlock % 24,
+                                          i // perBlock // 24 % 60),
+             'node%d' % (i % 10), i % 8 + 1, '%06x' % (0x33226a + i % 8))
+            for i in xrange(n)]
+
+def benchMemory(nRecords):
+    """
+    Holds nRecords task executions, data block memberships and lineage records
+    in memory as a list of tuples and as a record array. Returns a list of
+    (kind, tuple bytes, array bytes, seconds to fill the array, seconds to
+    iterate over its records).
+    """
+    results = []
+    for (kind, arrayType) in (('taskExecution', TaskExecutionArray),
+                              ('membership', MembershipArray),
+                              ('lineage', LineageArray)):
+        rows = _syntheticRows(kind, nRecords)
+        gc.collect()
+        tupleBytes = _deepSize(rows)
+        start = time.time()
+        records = arrayType(rows)
+        fillSeconds = time.time() - start
+        arrayBytes = records.nbytes() + sum(
+            _deepSize(records.distinct(field)) for field in arrayType.encodedFields)
+        start = time.time()
+        for rec in records:
+            pass
+        iterSeconds = time.time() - start
+        results.append((kind, tupleBytes, arrayBytes, fillSeconds, iterSeconds))
+        rows = records = None
+    return results
+
+def benchParallelDRP(backend, nExposures, nWorkers):
+    """
+    Recreates the database with nExposures exposures, then runs DRP through
+    orchestration with nWorkers workers (serially if nWorkers is None). Returns
+    exposures per second.
+    """
+    backend.createSchema()
+    pp = prepareIt(backend, nExposures)
+    orch = Orchestration(pp, backend)
+    start = time.time()
+    if nWorkers is None:
+        orch.runDRP()
+    else:
+        orch.runDRPParallel(nWorkers)
+    return nExposures / (time.time() - start)
+
+def benchTransfer(backend, nRows, fileName):
+    """
+    Recreates the database, registers one data block with nRows isolated row
+    ids (so that all of them go to prv_RowIdToDataBlock), then exports
+    provenance to fileName and imports it back. Compares that with a dump of
+    prv_RowIdToDataBlock as written by mysqldump (extended inserts). Returns
+    (export size, dump size, compressed dump size, import seconds, dump load
+    seconds).
+    """
+    backend.createSchema()
+    prepareIt(backend, 0)
+    conn = backend.connect()
+    cursor = conn.cursor()
+    pp = ProvProto(1000)
+    pp.setCurrentTime('2021-11-01 00:00:00')
+    blockId = pp.registerDataBlock(cursor, 'ScienceCalibratedExposure')
+    pp.registerTaskExecution(cursor, 'Image Correction',
+                             pp.getNodeIds(cursor)[0], blockId)
+    for theId in xrange(1, 2*nRows, 2):
+        pp.registerRowIdInBlock(cursor, blockId, theId)
+    pp.flush(cursor)
+    conn.commit()
+
+    ProvExporter(backend).export(fileName, timeBegin='2021-11-01 00:00:00')
+    start = time.time()
+    ProvImporter(backend).load(fileName)
+    importSeconds = time.time() - start
+
+    cursor.execute('SELECT theId, blockId FROM prv_RowIdToDataBlock '
+                   'WHERE blockId=%s', (blockId,))
+    rows = cursor.fetchall()
+    dump = ''.join('INSERT INTO `prv_RowIdToDataBlock` VALUES %s;\n' %
+                   ','.join('(%d,%d)' % row for row in rows[i:i+10000])
+                   for i in xrange(0, len(rows), 10000))
+    start = time.time()
+    for statement in dump.splitlines():
+        cursor.execute(statement)
+    conn.commit()
+    dumpSeconds = time.time() - start
+    conn.close()
+    return (os.path.getsize(fileName), len(dump), len(zlib.compress(dump)),
+            importSeconds, dumpSeconds)
+
+# ----------------------------------------------------------------------------------
+
+def main():
+    if len(sys.argv) > 1:
+        backend = SQLiteBackend(sys.argv[1])
+    else:
+        backend = MySQLBackend(**mysqlCredentials)
+    for (kind, tupleBytes, arrayBytes, fillSeconds, iterSeconds) in \
+            benchMemory(1000000):
+        print 'memory of 1000000 %-13s tuples: %6.1f MB  arrays: %6.1f MB  ' \
+            '(x%.1f)  fill %.2f s  iterate %.2f s' % \
+            (kind, tupleBytes / 1e6, arrayBytes / 1e6, float(tupleBytes) / arrayBytes,
+             fillSeconds, iterSeconds)
+
+    conn = backend.connect()
+    for (name, bench, n) in (('rowIdInBlock', benchRowIdInBlock, 20000),
+                             ('taskExecution', benchTaskExecution, 2000)):
+        perRow = bench(conn, n, 0)
+        buffered = bench(conn, n, 1000)
+        print '%-15s per-row: %10.0f rows/s  buffered: %10.0f rows/s  (x%.1f)' % \
+            (name, perRow, buffered, buffered / perRow)
+    conn.close()
+
+    for nWorkers in (None, 1, 2, 4, 6):
+        rate = benchParallelDRP(backend, 200, nWorkers)
+        print 'DRP with %-7s workers: %8.1f exposures/s' % (nWorkers or 'no', rate)
+
+    (size, dumpSize, zDumpSize, importSeconds, dumpSeconds) = \
+        benchTransfer(backend, 200000, 'benchTransfer.prvx')
+    print 'transfer of 200000 row ids: export %d bytes, mysqldump %d bytes ' \
+        '(%d compressed), import %.2f s, dump load %.2f s' % \
+        (size, dumpSize, zDumpSize, importSeconds, dumpSeconds)
+    os.remove('benchTransfer.prvx')
+
+# ----------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
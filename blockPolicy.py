@@ -0,0 +1,161 @@
+from datetime import datetime
+
+
+class BlockPolicy(object):
+    """
+    Decides when Orchestration closes a data block. The size of data blocks
+    trades the volume of provenance (each block adds a prv_DataBlock row, one
+    task execution per task, links to task executions, and membership ranges)
+    against how finely provenance can be resolved (everything in one block is
+    known to have been processed the same way).
+
+    Regardless of the policy, a block is always closed when configuration
+    changes in a way that affects it (see ImpactAnalyzer). This base class
+    never closes a block; subclasses override the methods below:
+     - startBlock(pp, cursor, nodeIds) is called when a new block is started,
+       nodeIds are the nodes that will process it (None if not known yet)
+     - isFull(pp, nExposures) is called after each exposure is added, with the
+       prototype clock already forwarded past it
+     - blockClosed(nExposures, cnfChanged) is called when a block is closed,
+       cnfChanged tells if it was closed because configuration changed
+    """
+    def startBlock(self, pp, cursor, nodeIds):
+        pass
+
+    def isFull(self, pp, nExposures):
+        return False
+
+    def blockClosed(self, nExposures, cnfChanged):
+        pass
+
+
+class FixedBlockSize(BlockPolicy):
+    """
+    Closes a block after a fixed number of exposures.
+    """
+    def __init__(self, size=10):
+        """
+        @param size  Max number of exposures per block
+        """
+        self._size = size
+
+    def isFull(self, pp, nExposures):
+        return nExposures >= self._size
+
+    def __str__(self):
+        return 'fixed:%d' % self._size
+
+
+class TimeWindowBlocks(BlockPolicy):
+    """
+    Closes a block once it covers a time window: all exposures processed within
+    that many seconds (of the prototype clock) from the start of the block go to
+    the same block.
+    """
+    def __init__(self, seconds):
+        """
+        @param seconds  Length of the time window
+        """
+        self._seconds = seconds
+        self._start = None
+
+    def startBlock(self, pp, cursor, nodeIds):
+        self._start = _parseTime(pp.getCurrentTime())
+
+    def isFull(self, pp, nExposures):
+        elapsed = _parseTime(pp.getCurrentTime()) - self._start
+        return elapsed.days * 86400 + elapsed.seconds >= self._seconds
+
+    def __str__(self):
+        return 'time:%d' % self._seconds
+
+
+class NodeCapacityBlocks(BlockPolicy):
+    """
+    Sizes each block to fit the nodes that process it: the number of exposures
+    is proportional to the number of cores and to the memory of the weakest of
+    these nodes, whichever gives a smaller block (see prv_cnf_Node). If the
+    nodes are not known when the block is started, all nodes are considered.
+    """
+    def __init__(self, exposuresPerCore=2, exposuresPerGB=1):
+        """
+        @param exposuresPerCore  Number of exposures per core
+        @param exposuresPerGB    Number of exposures per GB of memory
+        """
+        self._perCore = exposuresPerCore
+        self._perGB = exposuresPerGB
+        self._size = 1
+
+    def startBlock(self, pp, cursor, nodeIds):
+        if nodeIds is None:
+            nodeIds = pp.getNodeIds(cursor)
+        sizes = []
+        for nodeId in nodeIds:
+            (cores, ram) = pp.getNodeCapacity(cursor, nodeId)
+            sizes.append(min(cores * self._perCore, ram * self._perGB))
+        self._size = max(1, int(min(sizes)))
+
+    def isFull(self, pp, nExposures):
+        return nExposures >= self._size
+
+    def __str__(self):
+        return 'capacity:%g:%g' % (self._perCore, self._perGB)
+
+
+class AdaptiveBlocks(BlockPolicy):
+    """
+    Grows blocks while configuration is stable: each block that is filled up
+    makes the next one growth times bigger, up to maxSize exposures. When a
+    block is cut because configuration changed, blocks start again from
+    minSize, so that provenance is fine grained around configuration changes.
+    """
+    def __init__(self, minSize=10, maxSize=10000, growth=2):
+        """
+        @param minSize  Size of the first block, and of the first block after
+                        a configuration change
+        @param maxSize  Max number of exposures per block
+        @param growth   Factor by which the size grows after each full block
+        """
+        self._minSize = minSize
+        self._maxSize = maxSize
+        self._growth = growth
+        self._size = minSize
+
+    def isFull(self, pp, nExposures):
+        return nExposures >= self._size
+
+    def blockClosed(self, nExposures, cnfChanged):
+        if cnfChanged:
+            self._size = self._minSize
+        elif nExposures >= self._size:
+            self._size = min(self._maxSize, int(self._size * self._growth))
+
+    def __str__(self):
+        return 'adaptive:%d:%d:%g' % (self._minSize, self._maxSize, self._growth)
+
+# ----------------------------------------------------------------------------------
+
+_policies = {'fixed': FixedBlockSize,
+             'time': TimeWindowBlocks,
+             'capacity': NodeCapacityBlocks,
+             'adaptive': AdaptiveBlocks}
+
+def makeBlockPolicy(spec):
+    """
+    Returns a block policy described by a string: policy name followed by
+    numeric arguments of its constructor, separated by colons, e.g. 'fixed:100',
+    'time:3600', 'capacity:2:1', 'adaptive:10:10000:2'. Raises ValueError if
+    the string is not valid.
+    """
+    parts = spec.split(':')
+    if parts[0] not in _policies:
+        raise ValueError('unknown block policy: %s (valid: %s)' %
+                         (parts[0], ', '.join(sorted(_policies))))
+    try:
+        args = [float(a) if '.' in a else int(a) for a in parts[1:]]
+        return _policies[parts[0]](*args)
+    except TypeError:
+        raise ValueError('invalid arguments of block policy: %s' % spec)
+
+def _parseTime(t):
+    return datetime.strptime(t, '%Y-%m-%d %H:%M:%S')
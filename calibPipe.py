@@ -1,5 +1,5 @@
 
-import MySQLdb
+from exposureStream import ExposureStream
 
 class CalibPipe(object):
     """
@@ -8,14 +8,15 @@ class CalibPipe(object):
     calibrated exposure. Depending on the 'algorithm' used in task.
     'Calib A', it will set fluxErr to 0.2 or 1 (all very scientific ;)
     """
-    def __init__(self, host, port, user, password, db):
+    def __init__(self, backend):
         """
-        Connect to the Prototype database using provided credentials.
+        Connect to the Prototype database through the provided backend.
         Note, the database should exist and schema should be loaded.
+
+        @param backend  Storage backend (see provBackend)
         """
-        self._conn = MySQLdb.connect(host=host, port=port, user=user,
-                                     passwd=password, db=db)
-        self._conn.autocommit(False)
+        self._backend = backend
+        self._conn = backend.connect()
 
     def __del__(self):
         """
@@ -23,14 +24,123 @@ class CalibPipe(object):
         """
         self._conn.close()
 
-    def run(self):
+    def run(self, resume=False, chunkSize=1000):
         """
         Runs the pipeline, as described in the class description.
+
+        Raw exposures are streamed from the database in chunks, and results are
+        committed after each chunk, together with the high-water mark of the
+        stream, so that a run that was interrupted can be resumed.
+
+        @param resume     Continue after the last raw exposure committed by a
+                          previous run
+        @param chunkSize  Number of raw exposures fetched from the database at once
         """
         cursor = self._conn.cursor()
         try:
-            # Find version of task 'Calib A'
+            fluxErr = self._fluxErr(cursor)
+            # create science calibrated exposure
+            stream = ExposureStream(self._backend, 'RawExposure', 'rawExposureId',
+                                    (), 'Calibration Pipeline', chunkSize)
+            if resume:
+                stream.resume(cursor)
+            for rows in stream.chunks():
+                for row in rows:
+                    cursor.execute('''
+INSERT INTO ScienceCalibratedExposure(rawExposureId, filter, ra, decl,
+                                      obsStart, cFlux, cFluxErr)
+  SELECT r.rawExposureId, r.filter, r.ra, r.decl, r.obsStart, r.flux*c.v, %f
+  FROM   RawExposure r, RawCalibExposure c
+  WHERE  r.rawExposureId=%s AND r.filter=c.filter
+     AND r.ra=c.ra AND r.decl=c.decl''' % (fluxErr, row[0]))
+                stream.saveHighWaterMark(cursor, rows[-1][0])
+                self._conn.commit()
+        except self._backend.Error as e:
+            print 'Problems: ', e.args[-1], 'when executing:', \
+                self._backend.lastStatement(cursor)
+            self._conn.rollback()
+
+    def runBulk(self, pp, nodeId=None):
+        """
+        Calibrates all raw exposures that were not calibrated yet with one
+        set-based statement, and registers the calibration in provenance: the
+        raw exposures as the input data block and the new science calibrated
+        exposures as the output data block of one execution of 'Calib A'.
+        Everything is committed in one transaction.
+
+        @param pp      ProvProto used to register provenance
+        @param nodeId  Id of the node where the calibration runs, defaults to
+                       the first registered node
+
+        Returns the number of calibrated exposures.
+        """
+        cursor = self._conn.cursor()
+        try:
+            fluxErr = self._fluxErr(cursor)
+            cursor.execute('''
+SELECT COALESCE(MAX(scExposureId), 0) FROM ScienceCalibratedExposure''')
+            lastId = cursor.fetchone()[0]
             cursor.execute('''
+INSERT INTO ScienceCalibratedExposure(rawExposureId, filter, ra, decl,
+                                      obsStart, cFlux, cFluxErr)
+  SELECT r.rawExposureId, r.filter, r.ra, r.decl, r.obsStart, r.flux*c.v, %s
+  FROM   RawExposure r
+  JOIN   RawCalibExposure c
+    ON   r.filter=c.filter AND r.ra=c.ra AND r.decl=c.decl
+  WHERE  NOT EXISTS (SELECT 1 FROM ScienceCalibratedExposure s
+                     WHERE s.rawExposureId=r.rawExposureId)
+  ORDER BY r.rawExposureId''', (fluxErr,))
+            nRows = cursor.rowcount
+            if nRows > 0:
+                if nodeId is None:
+                    nodeId = pp.getNodeIds(cursor)[0]
+                rawBlockId = pp.registerDataBlock(cursor, 'RawExposure')
+                self._registerRows(pp, cursor, rawBlockId, 'rawExposureId',
+                                   lastId)
+                sceBlockId = pp.registerDataBlock(cursor,
+                                                  'ScienceCalibratedExposure')
+                self._registerRows(pp, cursor, sceBlockId, 'scExposureId',
+                                   lastId)
+                pp.registerTaskExecution(cursor, 'Calib A', nodeId, rawBlockId,
+                                         sceBlockId)
+                pp.flush(cursor)
+            self._conn.commit()
+            return nRows
+        except self._backend.Error as e:
+            print 'Problems: ', e.args[-1], 'when executing:', \
+                self._backend.lastStatement(cursor)
+            self._conn.rollback()
+            pp.clearBuffers()
+            return 0
+
+    def _registerRows(self, pp, cursor, blockId, column, lastId):
+        """
+        Registers the given column of science calibrated exposures created after
+        lastId as members of a data block. Ids are normally contiguous, and are
+        then registered as a single range without being fetched.
+        """
+        cursor.execute('''
+SELECT MIN(%s), MAX(%s), COUNT(DISTINCT %s)
+FROM   ScienceCalibratedExposure
+WHERE  scExposureId > %%s''' % (column, column, column), (lastId,))
+        (idBegin, idEnd, n) = cursor.fetchone()
+        if idEnd - idBegin + 1 == n:
+            pp.registerRowIdRangeInBlock(cursor, blockId, idBegin, idEnd)
+            return
+        cursor.execute('''
+SELECT DISTINCT %s
+FROM   ScienceCalibratedExposure
+WHERE  scExposureId > %%s
+ORDER BY %s''' % (column, column), (lastId,))
+        for (theId,) in cursor.fetchall():
+            pp.registerRowIdInBlock(cursor, blockId, theId)
+        pp.closeDataBlock(cursor, blockId)
+
+    def _fluxErr(self, cursor):
+        """
+        Returns fluxErr set by the version of task 'Calib A' in use.
+        """
+        cursor.execute('''
 SELECT gitSHA
 FROM   prv_Pipeline p,
        prv_cnf_Pipeline cp,
@@ -45,23 +155,7 @@ WHERE  pipelineName = 'Calibration Pipeline'
    AND t.taskId=pt.taskId
    AND ct.taskId=t.taskId
    AND ct.validityEnd='2050-12-31 23:59:59' ''')
-            rows = cursor.fetchone()
-            if rows[0] == '33226a':
-                fluxErr = 0.2
-            else:
-                fluxErr = 1
-            # create science calibrated exposure
-            cursor.execute('SELECT rawExposureId FROM RawExposure')
-            rows = cursor.fetchall()
-            for row in rows:
-                cursor.execute('''
-INSERT INTO ScienceCalibratedExposure(rawExposureId, filter, ra, decl,
-                                      obsStart, cFlux, cFluxErr)
-  SELECT r.rawExposureId, r.filter, r.ra, r.decl, r.obsStart, r.flux*c.v, %f
-  FROM   RawExposure r, RawCalibExposure c
-  WHERE  r.rawExposureId=%s AND r.filter=c.filter
-     AND r.ra=c.ra AND r.decl=c.decl''' % (fluxErr, row[0]))
-            self._conn.commit()
-        except MySQLdb.Error as e:
-            print 'Problems: ', e[1], 'when executing:', cursor._last_executed
-            self._conn.rollback()
+        rows = cursor.fetchone()
+        if rows[0] == '33226a':
+            return 0.2
+        return 1
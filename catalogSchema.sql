@@ -1,9 +1,11 @@
 CREATE TABLE Object (
     objectId BIGINT NOT NULL AUTO_INCREMENT,
+    pixelId INT NOT NULL,   -- cell of the spatial index, see skyGrid.py
     ra DOUBLE,
     decl DOUBLE,
     flux DOUBLE,
-    PRIMARY KEY PK_objId(objectId)
+    PRIMARY KEY PK_objId(objectId),
+    INDEX IDX_pixelId(pixelId)
 ) ENGINE=MyISAM;
 
 CREATE TABLE Source (
@@ -14,7 +16,8 @@ CREATE TABLE Source (
     ra DOUBLE,
     decl DOUBLE,
     flux DOUBLE,
-    PRIMARY KEY PK_sId(sourceId)
+    PRIMARY KEY PK_sId(sourceId),
+    INDEX IDX_objectId(objectId)
 ) ENGINE=MyISAM;
 
 CREATE TABLE RawExposure (
@@ -46,5 +49,17 @@ CREATE TABLE ScienceCalibratedExposure (
     obsStart DATETIME,
     cFlux DOUBLE,           -- calibrated flux
     cFluxErr DOUBLE,
-    PRIMARY KEY PK_scExId(scExposureId)
+    PRIMARY KEY PK_scExId(scExposureId),
+    INDEX IDX_rawExposureId(rawExposureId)
 ) ENGINE=InnoDB;
+
+-- Ids reserved in ranges by clients that generate rows in bulk (see
+-- DRPPipe), so that they don't depend on auto-increment ids of each row.
+-- MyISAM, so that reservations are not held back by open transactions.
+CREATE TABLE IdSequence (
+    name VARCHAR(64) NOT NULL,
+    nextId BIGINT NOT NULL,
+    PRIMARY KEY PK_idSeq(name)
+) ENGINE=MyISAM;
+
+INSERT INTO IdSequence(name, nextId) VALUES ('Object', 1);
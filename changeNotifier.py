@@ -0,0 +1,132 @@
+import fcntl
+import mmap
+import os
+import struct
+import time
+
+
+class LocalNotifier(object):
+    """
+    Tells users of provenance that it changed, without them polling the
+    database: writers publish each change (see ProvProto.publishChanges), which
+    bumps a version counter, and readers compare the counter with the version
+    they have seen. The current procHistoryId is published together with the
+    version, so readers don't even need to query it.
+
+    This one is visible within one process only, see MmapNotifier for a
+    notifier shared by processes.
+    """
+    def __init__(self):
+        self._version = 0
+        self._procHistoryId = None
+
+    def read(self):
+        """
+        Returns (version, procHistoryId). procHistoryId is None if no
+        procHistoryId was published yet.
+        """
+        return (self._version, self._procHistoryId)
+
+    def publish(self, procHistoryId=None):
+        """
+        Bumps the version, and sets the current procHistoryId if it changed.
+        """
+        self._version += 1
+        if procHistoryId is not None:
+            self._procHistoryId = procHistoryId
+
+
+class MmapNotifier(object):
+    """
+    Notifier shared by all processes on one machine through a small memory
+    mapped file: a sequence number and the procHistoryId. Reading it is a
+    memory access, no system call. Writers serialize through an exclusive lock
+    on the file, and make the sequence number odd while they write (a seqlock):
+    a reader that gets the same, even sequence number before and after reading
+    procHistoryId has a consistent pair, otherwise it reads again. The version
+    is half the sequence number. A reader that keeps seeing an odd sequence
+    number backs off, and takes the lock: if it gets it, the writer died while
+    writing, and the reader makes the sequence number even again.
+
+    Notifiers can be pickled (e.g. passed to worker processes), they map the
+    same file again when unpickled.
+    """
+    _format = '<qq'   # sequence number, procHistoryId (0: none)
+    _maxSpins = 100   # reads of an odd sequence number before backing off
+
+    def __init__(self, path):
+        """
+        @param path  Path to the file, created if it does not exist
+        """
+        self._path = path
+        self._open()
+
+    def _open(self):
+        size = struct.calcsize(self._format)
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0644)
+        if os.fstat(self._fd).st_size < size:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_size < size:
+                    os.ftruncate(self._fd, size)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mm = mmap.mmap(self._fd, size)
+
+    def __getstate__(self):
+        return {'_path': self._path}
+
+    def __setstate__(self, state):
+        self._path = state['_path']
+        self._open()
+
+    def read(self):
+        """
+        Returns (version, procHistoryId). procHistoryId is None if no
+        procHistoryId was published yet.
+        """
+        spins = 0
+        while True:
+            seq = struct.unpack_from('<q', self._mm, 0)[0]
+            if seq & 1:
+                # being written
+                spins += 1
+                if spins >= self._maxSpins:
+                    time.sleep(0.001)
+                    self._repair()
+                    spins = 0
+                continue
+            procHistoryId = struct.unpack_from('<q', self._mm, 8)[0]
+            if struct.unpack_from('<q', self._mm, 0)[0] == seq:
+                return (seq >> 1, procHistoryId or None)
+
+    def _repair(self):
+        # waits for a writer that holds the lock; if the sequence number is
+        # still odd when the lock is free, its writer died while writing. Readers
+        # that repair it at the same time write the same value.
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+        try:
+            seq = struct.unpack_from('<q', self._mm, 0)[0]
+            if seq & 1:
+                struct.pack_into('<q', self._mm, 0, seq + 1)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def publish(self, procHistoryId=None):
+        """
+        Bumps the version, and sets the current procHistoryId if it changed.
+        """
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # odd while writing; already odd if a writer died while writing
+            seq = struct.unpack_from('<q', self._mm, 0)[0] | 1
+            struct.pack_into('<q', self._mm, 0, seq)
+            if procHistoryId is not None:
+                struct.pack_into('<q', self._mm, 8, procHistoryId)
+            struct.pack_into('<q', self._mm, 0, seq + 1)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
@@ -0,0 +1,160 @@
+from bisect import bisect_right
+from datetime import datetime
+
+
+class _Intervals(object):
+    """
+    Validity intervals of all configurations of one entity (one task, pipeline
+    or node), sorted by the beginning of validity.
+    """
+    def __init__(self):
+        self.rows = {}     # ident --> (validityBegin, validityEnd, value)
+        self.begins = []
+        self.ends = []
+        self.values = []
+
+    def rebuild(self):
+        rows = sorted(self.rows.values())
+        self.begins = [row[0] for row in rows]
+        self.ends = [row[1] for row in rows]
+        self.values = [row[2] for row in rows]
+
+    def find(self, t):
+        i = bisect_right(self.begins, t) - 1
+        if i >= 0 and t < self.ends[i]:
+            return self.values[i]
+        return None
+
+
+class ConfigResolver(object):
+    """
+    In-memory index of validity ranges of task, pipeline and node
+    configurations. It answers "which configuration was valid at time t"
+    without querying the database.
+
+    Intervals are loaded on the first refresh(). Each following refresh() only
+    fetches configurations added since then, and re-reads configurations that
+    were open (valid until "infinity") to pick up the ones that got closed.
+
+    Values returned for each kind of entity:
+     - 'task':     (taskCnfId, gitSHA), keyed by taskName
+     - 'pipeline': (pipelineCnfId, notes), keyed by pipelineName
+     - 'node':     (ip, os, cores, ram), keyed by nodeName
+
+    Times are 'YYYY-MM-DD HH:MM:SS' strings, datetime objects are converted.
+    """
+    _infinity = '2050-12-31 23:59:59'
+
+    # kind --> (query returning key, ident, validityBegin, validityEnd, value...,
+    #           key column, ident column). The ident must be unique per key,
+    #           and must grow for configurations added later.
+    _kinds = {
+        'task': ('''
+SELECT taskName, taskCnfId, validityBegin, validityEnd, taskCnfId, gitSHA
+FROM   prv_cnf_Task
+JOIN   prv_Task USING(taskId)''', 'taskName', 'taskCnfId'),
+        'pipeline': ('''
+SELECT pipelineName, pipelineCnfId, validityBegin, validityEnd, pipelineCnfId,
+       notes
+FROM   prv_cnf_Pipeline
+JOIN   prv_Pipeline USING(pipelineId)''', 'pipelineName', 'pipelineCnfId'),
+        'node': ('''
+SELECT nodeName, validityBegin, validityBegin, validityEnd, ip, os, cores, ram
+FROM   prv_cnf_Node
+JOIN   prv_Node USING(nodeId)''', 'nodeName', 'validityBegin')
+    }
+
+    def __init__(self, cursor=None):
+        """
+        @param cursor  Open, valid database cursor. If given, all intervals are
+                       loaded right away, otherwise on the first refresh().
+        """
+        self._intervals = dict((kind, {}) for kind in self._kinds)
+        self._maxIdent = {}   # kind --> highest ident loaded so far
+        if cursor is not None:
+            self.refresh(cursor)
+
+    def refresh(self, cursor):
+        """
+        Loads configurations added or closed since the last refresh.
+
+        @param cursor  Open, valid database cursor
+        """
+        for kind in self._kinds:
+            (query, keyCol, identCol) = self._kinds[kind]
+            byKey = self._intervals[kind]
+            if self._maxIdent.get(kind) is None:
+                cursor.execute(query)
+                rows = list(cursor.fetchall())
+            else:
+                cursor.execute(query + ' WHERE %s >= %%s' % identCol,
+                               (self._maxIdent[kind],))
+                rows = list(cursor.fetchall())
+                openOnes = [(key, ident)
+                            for (key, intervals) in byKey.items()
+                            for (ident, row) in intervals.rows.items()
+                            if row[1] == self._infinity]
+                if openOnes:
+                    cond = ' OR '.join(['(%s=%%s AND %s=%%s)' % (keyCol, identCol)]
+                                       * len(openOnes))
+                    cursor.execute(query + ' WHERE validityEnd <> %%s AND (%s)' %
+                                   cond, [self._infinity] +
+                                   [v for pair in openOnes for v in pair])
+                    rows += cursor.fetchall()
+            changed = set()
+            for row in rows:
+                (key, ident, vBegin, vEnd) = row[:4]
+                ident = self._toTime(ident)
+                byKey.setdefault(key, _Intervals()).rows[ident] = \
+                    (self._toTime(vBegin), self._toTime(vEnd), tuple(row[4:]))
+                changed.add(key)
+                if self._maxIdent.get(kind) is None or ident > self._maxIdent[kind]:
+                    self._maxIdent[kind] = ident
+            for key in changed:
+                byKey[key].rebuild()
+
+    def resolve(self, kind, key, t):
+        """
+        Returns configuration of a given entity valid at time t, or None.
+
+        @param kind  'task', 'pipeline' or 'node'
+        @param key   Name of the task, pipeline or node
+        @param t     Time
+        """
+        intervals = self._intervals[kind].get(key)
+        if intervals is None:
+            return None
+        return intervals.find(self._toTime(t))
+
+    def resolveMany(self, kind, key, times):
+        """
+        Returns a list of configurations of a given entity, one for each time
+        passed through times (None where no configuration was valid). Times are
+        sorted once and merged with the intervals, so this is much cheaper than
+        calling resolve() for each of them.
+
+        @param kind   'task', 'pipeline' or 'node'
+        @param key    Name of the task, pipeline or node
+        @param times  Sequence of times
+        """
+        times = [self._toTime(t) for t in times]
+        result = [None] * len(times)
+        intervals = self._intervals[kind].get(key)
+        if intervals is None or not intervals.begins:
+            return result
+        (begins, ends, values) = (intervals.begins, intervals.ends,
+                                  intervals.values)
+        i = -1
+        for n in sorted(range(len(times)), key=times.__getitem__):
+            t = times[n]
+            while i+1 < len(begins) and begins[i+1] <= t:
+                i += 1
+            if i >= 0 and t < ends[i]:
+                result[n] = values[i]
+        return result
+
+    @staticmethod
+    def _toTime(t):
+        if isinstance(t, datetime):
+            return t.strftime('%Y-%m-%d %H:%M:%S')
+        return t
@@ -1,7 +1,9 @@
 
 import random
 
-import MySQLdb
+import numpy
+
+from skyGrid import SkyGrid
 
 class DRPPipe(object):
     """
@@ -22,8 +24,23 @@ class DRPPipe(object):
     node in round robin fashion, every 10 exposures, so that defines our
     grouping. If configuration changes (if there is a new procHistoryId),
     we are automatically starting a new group.
+
+    Rows are generated for a whole batch of exposures (typically one data
+    block) at once with NumPy, and written with multi-row inserts. Ids of the
+    new objects are reserved in one range (see IdSequence in catalogSchema.sql),
+    so sources can refer to their objects without reading back each id.
+    Existing objects are looked up through the spatial index (see SkyGrid).
     """
 
+    def __init__(self, backend):
+        """
+        @param backend  Storage backend (see provBackend)
+        """
+        self._backend = backend
+        self._grid = SkyGrid()
+        # seeded from the random module, so that runs can be reproduced
+        self._rng = numpy.random.RandomState(random.randint(0, 2**31-1))
+
     def processExposure(self, scExpId, theFilter, ra, decl, flux, pp, cursor):
         """
         @param scExpId    scExposureId
@@ -34,46 +51,78 @@ class DRPPipe(object):
         @param pp         instance of ProvProto
         @param cursor     open cursor
         """
+        self.processExposures([(scExpId, theFilter, ra, decl, flux)], pp, cursor)
 
-        # randomly pick how many *new* sources we will generate and create
-        # these sources and objects
-        nSourcesToGen = random.randint(2, 10)
-        for i in range(0, nSourcesToGen):
-            # Decide what ra/decl and flux to use, assuming that the area
-            # is 2x2.
-            objRa = ra + random.uniform(-1, 1)
-            objDecl = decl + random.uniform(-1, 1)
-            objFlux = random.uniform(0.01, 1)
-            # Insert object and source.
-            cursor.execute('''
-INSERT INTO Object(ra, decl, flux) VALUES (%f, %f, %f)''' % \
-                           (objRa, objDecl, objFlux))
-            objId = cursor.lastrowid
-            cursor.execute('''
-INSERT INTO Source(objectId, scExposureId, filter, ra, decl, flux)
-VALUES (%s, %s, "%s", %s, %s, %s)''' % \
-                     (objId, scExpId, theFilter, objRa, objDecl, objFlux))
+    def processExposures(self, exposures, pp, cursor):
+        """
+        Generates objects and sources for a batch of exposures, as described in
+        the class description.
 
-        # now add sources to already existing objects
-        # fetch all objectIds and ra/decls from the area covered by
-        # the current exposure
-        cursor.execute('''
-SELECT objectId, ra, decl, flux
-FROM   Object
-WHERE  ra BETWEEN %f AND %f
-  AND  decl BETWEEN %f AND %f''' % (ra-1, ra+1, decl-1, decl+1))
-        rows = cursor.fetchall()
-        # pick some number of sources to add, between 10 and 50
-        for i in range(0, random.randint(10, 50)):
-            # randomly pick an existing object
-            sNo = random.randint(1, len(rows)-1)
-            (objId, ra, decl, flux) = rows[sNo]
+        @param exposures  Sequence of (scExposureId, filter, ra, decl, flux)
+        @param pp         instance of ProvProto
+        @param cursor     open cursor
+        """
+        exposures = list(exposures)
+        if not exposures:
+            return
+        rng = self._rng
+        (expIds, filters, expRa, expDecl) = [list(col) for col in
+                                             zip(*exposures)[:4]]
+        (expRa, expDecl) = (numpy.array(expRa), numpy.array(expDecl))
+
+        # fetch existing objects from the area covered by each pointing once
+        existing = {}
+        for (ra, decl) in set(zip(expRa.tolist(), expDecl.tolist())):
+            rows = self._grid.queryBox(cursor, ra-1, ra+1, decl-1, decl+1)
+            existing[(ra, decl)] = [
+                numpy.array([row[n] for row in rows], dtype=dtype)
+                for (n, dtype) in enumerate((numpy.int64, float, float, float))]
+
+        # randomly pick how many *new* sources we will generate for each exposure,
+        # and create these sources and objects within the 2x2 area
+        nNew = rng.randint(2, 11, size=len(exposures))
+        total = int(nNew.sum())
+        firstId = self._backend.reserveIds(cursor, 'Object', total)
+        newExp = numpy.repeat(numpy.arange(len(exposures)), nNew)
+        newIds = numpy.arange(firstId, firstId+total)
+        newRa = expRa[newExp] + rng.uniform(-1, 1, total)
+        newDecl = expDecl[newExp] + rng.uniform(-1, 1, total)
+        newFlux = rng.uniform(0.01, 1, total)
+        cursor.executemany('''
+INSERT INTO Object(objectId, pixelId, ra, decl, flux)
+VALUES (%s, %s, %s, %s, %s)''',
+                           zip(newIds.tolist(),
+                               self._grid.pixelIds(newRa, newDecl).tolist(),
+                               newRa.tolist(), newDecl.tolist(), newFlux.tolist()))
+        srcObj = [newIds]
+        srcExp = [newExp]
+        srcRa = [newRa]
+        srcDecl = [newDecl]
+        srcFlux = [newFlux]
+
+        # now add between 10 and 50 sources to objects from the area covered by
+        # each exposure, including objects created by this and earlier exposures
+        for (n, (ra, decl)) in enumerate(zip(expRa, expDecl)):
+            inBox = ((newExp <= n) & (abs(newRa-ra) <= 1) & (abs(newDecl-decl) <= 1))
+            (objIds, objRa, objDecl, objFlux) = [
+                numpy.concatenate((old, new[inBox])) for (old, new) in
+                zip(existing[(ra, decl)], (newIds, newRa, newDecl, newFlux))]
+            k = rng.randint(10, 51)
+            picked = rng.randint(0, len(objIds), k)
             # change ra/dec and flux just a little
-            sRa = ra + random.uniform(-0.1, 0.1)
-            sDecl = decl + random.uniform(-0.1, 0.1)
-            sFlux = flux + random.uniform(-0.2, 0.2)
-            # and add the source
-            cursor.execute('''
+            srcObj.append(objIds[picked])
+            srcExp.append(numpy.repeat(n, k))
+            srcRa.append(objRa[picked] + rng.uniform(-0.1, 0.1, k))
+            srcDecl.append(objDecl[picked] + rng.uniform(-0.1, 0.1, k))
+            srcFlux.append(objFlux[picked] + rng.uniform(-0.2, 0.2, k))
+
+        srcExp = numpy.concatenate(srcExp).tolist()
+        cursor.executemany('''
 INSERT INTO Source(objectId, scExposureId, filter, ra, decl, flux)
-VALUES (%s, %s, "%s", %s, %s, %s)''' % \
-                       (objId, scExpId, theFilter, sRa, sDecl, sFlux))
+VALUES (%s, %s, %s, %s, %s, %s)''',
+                           zip(numpy.concatenate(srcObj).tolist(),
+                               [expIds[n] for n in srcExp],
+                               [filters[n] for n in srcExp],
+                               numpy.concatenate(srcRa).tolist(),
+                               numpy.concatenate(srcDecl).tolist(),
+                               numpy.concatenate(srcFlux).tolist()))
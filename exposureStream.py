@@ -0,0 +1,80 @@
+class ExposureStream(object):
+    """
+    Lazily iterates over the rows of an exposure table in order of their ids. The
+    table is read in chunks using keyset pagination (WHERE id > last ORDER BY id
+    LIMIT chunkSize) through a server-side cursor on a dedicated connection, so
+    that neither the client nor the server holds the whole result, and the first
+    rows are available right away.
+
+    The stream can be resumed: the code that processes the rows saves the id of
+    the last row it committed (saveHighWaterMark), in the same transaction as its
+    results, and a restarted run calls resume() to skip everything up to it.
+    """
+    def __init__(self, backend, table, idColumn, columns, name, chunkSize=1000):
+        """
+        @param backend    Storage backend (see provBackend)
+        @param table      Name of the table to read
+        @param idColumn   Name of the integer, unique id column of the table
+        @param columns    Names of other columns to read, rows are returned as
+                          (id, columns...)
+        @param name       Name of the stream, used for its high-water mark
+        @param chunkSize  Number of rows fetched per query
+        """
+        self._backend = backend
+        self._query = 'SELECT %s FROM %s WHERE %s > %%s ORDER BY %s LIMIT %%s' % \
+            (', '.join((idColumn,) + tuple(columns)), table, idColumn, idColumn)
+        self._name = name
+        self._chunkSize = chunkSize
+        self.lastId = 0
+
+    def __iter__(self):
+        """
+        Yields rows one by one.
+        """
+        for chunk in self.chunks():
+            for row in chunk:
+                yield row
+
+    def chunks(self):
+        """
+        Yields lists of up to chunkSize rows.
+        """
+        conn = self._backend.connect()
+        try:
+            while True:
+                cursor = self._backend.streamingCursor(conn)
+                cursor.execute(self._query, (self.lastId, self._chunkSize))
+                chunk = list(cursor)
+                cursor.close()
+                # end the read transaction, so that no snapshot is held open
+                conn.rollback()
+                if not chunk:
+                    return
+                self.lastId = chunk[-1][0]
+                yield chunk
+        finally:
+            conn.close()
+
+    def resume(self, cursor):
+        """
+        Continues after the high-water mark saved by a previous run, if any.
+
+        @param cursor  Open, valid database cursor
+        """
+        cursor.execute('SELECT lastId FROM prv_HighWaterMark WHERE streamName=%s',
+                       (self._name,))
+        row = cursor.fetchone()
+        if row is not None:
+            self.lastId = row[0]
+
+    def saveHighWaterMark(self, cursor, lastId):
+        """
+        Records that all rows up to lastId have been processed. It should be
+        called in the transaction that commits results of processing these rows.
+
+        @param cursor  Open, valid database cursor
+        @param lastId  Id of the last processed row
+        """
+        cursor.execute('''
+            REPLACE INTO prv_HighWaterMark(streamName, lastId)
+            VALUES (%s, %s)''', (self._name, lastId))
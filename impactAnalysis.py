@@ -0,0 +1,160 @@
+class ImpactAnalyzer(object):
+    """
+    In-memory dependency graph of current configurations: which tasks each
+    pipeline consists of (prv_cnf_Pipeline_Tasks), and which tables and
+    columns each task writes (prv_cnf_Task_Columns of its configuration
+    contents, "<table>.*" standing for all columns of a table). It answers
+    which columns and which open data blocks are affected by a configuration
+    change, so that a change to a task that has nothing to do with the data in
+    flight does not force a new data block.
+
+    A data block is affected by a change of task configuration if the task
+    processes the block, if it writes into the table the block consists of, or
+    if it writes a column that is also written by a task processing the block.
+
+    The graph is loaded on the first refresh(); each following refresh()
+    reloads it and tells which tasks changed since the previous one.
+    """
+    _infinity = '2050-12-31 23:59:59'
+
+    def __init__(self, cursor=None):
+        """
+        @param cursor  Open, valid database cursor. If given, the graph is
+                       loaded right away, otherwise on the first refresh().
+        """
+        self._pipelines = {}   # pipelineName --> tuple of taskNames, in order
+        self._tasks = {}       # taskName --> (taskCnfId, frozenset of tcNames)
+        self._replaced = {}    # taskName --> tcNames before the last refresh
+        self._writers = {}     # tableName --> {columnName or '*': set of tasks}
+        self._loaded = False
+        if cursor is not None:
+            self.refresh(cursor)
+
+    def refresh(self, cursor):
+        """
+        Reloads the graph. Returns the set of names of tasks whose
+        configuration changed since the previous refresh (including tasks that
+        were added, or removed from a pipeline), empty on the first one.
+
+        @param cursor  Open, valid database cursor
+        """
+        cursor.execute('''
+SELECT taskName, taskCnfId, tcName
+FROM   prv_cnf_Task t
+JOIN   prv_Task USING(taskId)
+LEFT JOIN prv_cnf_Task_Columns c ON c.taskBodyId=t.taskBodyId
+WHERE  validityEnd=%s''', (self._infinity,))
+        columns = {}
+        for (taskName, taskCnfId, tcName) in cursor.fetchall():
+            (cnfId, tcNames) = columns.setdefault(taskName, (taskCnfId, set()))
+            if tcName is not None:
+                tcNames.add(tcName)
+        tasks = dict((taskName, (cnfId, frozenset(tcNames)))
+                     for (taskName, (cnfId, tcNames)) in columns.items())
+
+        cursor.execute('''
+SELECT pipelineName, taskName
+FROM   prv_cnf_Pipeline
+JOIN   prv_Pipeline USING(pipelineId)
+JOIN   prv_cnf_Pipeline_Tasks USING(pipelineCnfId)
+JOIN   prv_Task USING(taskId)
+WHERE  validityEnd=%s
+ORDER  BY pipelineCnfId, taskPosition''', (self._infinity,))
+        pipelines = {}
+        for (pipelineName, taskName) in cursor.fetchall():
+            pipelines.setdefault(pipelineName, []).append(taskName)
+        pipelines = dict((name, tuple(taskNames))
+                         for (name, taskNames) in pipelines.items())
+
+        changed = set()
+        if self._loaded:
+            for taskName in set(tasks) | set(self._tasks):
+                if tasks.get(taskName) != self._tasks.get(taskName):
+                    changed.add(taskName)
+            for name in set(pipelines) | set(self._pipelines):
+                (old, new) = (self._pipelines.get(name, ()),
+                              pipelines.get(name, ()))
+                if old != new:
+                    changed.update(set(old) ^ set(new))
+        self._replaced = dict((taskName, self._tasks[taskName][1])
+                              for taskName in changed if taskName in self._tasks)
+        self._tasks = tasks
+        self._pipelines = pipelines
+        self._writers = {}
+        for (taskName, (cnfId, tcNames)) in tasks.items():
+            for tcName in tcNames:
+                (table, column) = _split(tcName)
+                self._writers.setdefault(table, {}).setdefault(
+                    column, set()).add(taskName)
+        self._loaded = True
+        return changed
+
+    def tasksOf(self, pipelineName):
+        """
+        Returns names of tasks of a pipeline, in order.
+        """
+        return self._pipelines.get(pipelineName, ())
+
+    def columnsWrittenBy(self, taskName):
+        """
+        Returns the set of "<table>.<column>" names written by a task.
+        """
+        return self._tasks.get(taskName, (None, frozenset()))[1]
+
+    def writersOf(self, tcName):
+        """
+        Returns the set of names of tasks that write a column ("<table>.<column>")
+        or, for "<table>.*", any column of a table.
+        """
+        (table, column) = _split(tcName)
+        byColumn = self._writers.get(table, {})
+        if column == '*':
+            return set().union(*byColumn.values())
+        return byColumn.get(column, set()) | byColumn.get('*', set())
+
+    def affectedColumns(self, taskNames):
+        """
+        Returns the set of "<table>.<column>" names affected by a change of
+        configuration of tasks: columns they write, before and after the last
+        refresh.
+        """
+        tcNames = set()
+        for taskName in taskNames:
+            tcNames |= self.columnsWrittenBy(taskName)
+            tcNames |= self._replaced.get(taskName, frozenset())
+        return tcNames
+
+    def affectsBlock(self, taskNames, tableName, blockTaskNames):
+        """
+        Tells whether a change of configuration of tasks affects a data block.
+
+        @param taskNames       Names of tasks whose configuration changed
+        @param tableName       Table the data block consists of
+        @param blockTaskNames  Names of tasks that process the data block
+        """
+        if set(taskNames) & set(blockTaskNames):
+            return True
+        for tcName in self.affectedColumns(taskNames):
+            (table, column) = _split(tcName)
+            if table == tableName:
+                return True
+            if self.writersOf(tcName) & set(blockTaskNames):
+                return True
+        return False
+
+    def affectedBlocks(self, taskNames, blocks):
+        """
+        Returns ids of data blocks affected by a change of configuration of
+        tasks, in the order they were given.
+
+        @param taskNames  Names of tasks whose configuration changed
+        @param blocks     Sequence of (blockId, tableName, blockTaskNames) of open
+                          data blocks
+        """
+        return [blockId for (blockId, tableName, blockTaskNames) in blocks
+                if self.affectsBlock(taskNames, tableName, blockTaskNames)]
+
+
+def _split(tcName):
+    (table, sep, column) = tcName.partition('.')
+    return (table, column or '*')
@@ -1,24 +1,79 @@
 
-import MySQLdb
+import multiprocessing
+import random
+import time
 
+from asyncProvProto import AsyncProvProto
+from blockPolicy import FixedBlockSize
+from changeNotifier import MmapNotifier
 from drpPipe import DRPPipe
+from exposureStream import ExposureStream
+from impactAnalysis import ImpactAnalyzer
+from provJournal import JournalLoader, ProvJournal, readMark, saveMark
+from provMetrics import Histogram, instrument
+from provProto import ProvProto
 from task import Task
 
+# Tasks of the DRP pipeline, in the order they are executed.
+_drpTasks = ('Image Correction',
+             'WCS Determination',
+             'Photometric Calibration',
+             'Astrometric Calibration',
+             'Image Coaddition',
+             'Classification')
+
+# Name of the mark of the provenance journal that is committed with the results
+_journalMark = 'Data Release Pipeline journal'
+
 class Orchestration(object):
     """
     Mock implementation of pipeline orchestration. It only orchestrates DRP pipe.
     It does it by iterating through all available Science Calibrated Exposures.
-    Exposures are processed in groups of 10, except when a configuration change is
-    detected (in which case a new group is started right away). It pretends that it
+    Exposures are processed in groups of 10 (or as decided by a block policy, see
+    blockPolicy), except when a configuration change that affects the group is
+    detected (in which case a new group is started right away; changes to tasks
+    that don't process the exposures nor write into their table are ignored, see
+    ImpactAnalyzer). It pretends that it
     assigns tasks to nodes. The algorithm is: the first three tasks always run on
     nodes from pool A, and the remaining threee tasks always run on nodes from pool
     B. The nodes used in the pools are taken from provenance.
 
-    After processing the first 70 exposures, it changes one algorithm for one task.
+    After processing the first 70 exposures, it changes one algorithm for one task
+    (or, with cnfChangeEvery, after every cnfChangeEvery exposures).
+
+    Lineage of the exposures of each closed data block is materialized when the
+    block is committed (see ProvProto.registerExposureLineage).
+
+    With metrics (see provMetrics), calls of ProvProto and DRPPipe methods are
+    timed, and so is each committed data block, together with the number of
+    rows it wrote. Use an InstrumentedBackend to also time individual
+    statements; if profiling is enabled in metrics, each block is profiled.
+
+    runDRPParallel does the same, but data blocks are really processed in
+    parallel, by a pool of worker processes, one per node.
+
+    With asyncProv, runDRP writes provenance of data blocks through
+    AsyncProvProto: while provenance of one block is written, the next block is
+    already being processed. Provenance of each block is committed in its own
+    transaction, right after the catalog data of the block, together with the
+    high-water mark of the exposure stream. If the provenance of a block can't
+    be written, runDRP stops, and deletes the objects and sources of that
+    block and of the blocks after it (which were committed already, but have
+    no provenance either), so that a resumed run can process them again.
+
+    With journal, runDRP appends provenance of data blocks to a local journal
+    (see provJournal), and a background loader loads it into the database.
+    Each block is committed to the journal before its results are committed,
+    together with the position the journal got to: the loader only loads
+    that far, and a resumed run drops from the journal whatever follows it.
+    A run that is not resumed starts the journal anew, and binds it to the
+    database, so that groups of earlier runs are never loaded.
     """
-    def __init__(self, pp, host, port, user, password, db):
+    def __init__(self, pp, backend, metrics=None, maxInGroup=10,
+                 cnfChangeEvery=None, blockPolicy=None, asyncProv=False,
+                 journal=None):
         """
-        Connect to the Prototype database using provided credentials.
+        Connect to the Prototype database through the provided backend.
         Note, the database should exist and schema should be loaded.
 
         Get from provenance a list of nodes available for processing, and split
@@ -27,23 +82,44 @@ class Orchestration(object):
 
         Initialize variables used for managing group of exposures
 
-        @param pp    Provenance prototype object
-        @host        mysql credentials: host
-        @port        mysql credentials: port
-        @user        mysql credentials: user
-        @password    mysql credentials: password
-        @db          mysql credentials: database name
+        @param pp              Provenance prototype object
+        @param backend         Storage backend (see provBackend)
+        @param metrics         Metrics to record, or None
+        @param maxInGroup      Max count of exposures per data block, if no
+                               blockPolicy is given
+        @param cnfChangeEvery  Change configuration after every cnfChangeEvery
+                               exposures (never if 0), instead of once after
+                               70 exposures
+        @param blockPolicy     Decides when data blocks are closed (see
+                               blockPolicy), defaults to FixedBlockSize(maxInGroup)
+        @param asyncProv       Write provenance of data blocks asynchronously in
+                               runDRP (see AsyncProvProto)
+        @param journal         Directory of a journal provenance of data blocks
+                               is written to in runDRP (see provJournal), or
+                               None
         """
+        if asyncProv and journal is not None:
+            raise ValueError('asyncProv and journal are exclusive')
+        self._metrics = metrics
+        if metrics is not None:
+            pp = instrument(pp, metrics, 'provproto')
         self._pp = pp
+        self._provWriter = pp   # writes provenance of data blocks
+        self._asyncProv = asyncProv
+        self._journal = journal
 
-        self._conn = MySQLdb.connect(host=host, port=port, user=user,
-                                     passwd=password, db=db)
-        self._conn.autocommit(False)
+        self._backend = backend
+        self._conn = backend.connect()
         self._cursor = self._conn.cursor()
 
         # Find all available nodes to use
         nodeIds = self._pp.getNodeIds(self._cursor)
 
+        # Keep track of what tasks write, to know which configuration changes
+        # affect the data block in flight
+        self._impact = ImpactAnalyzer(self._cursor)
+        self._procHistoryId = self._pp.getProcHistoryId(self._cursor)
+
         # Split them into two roughly equal groups
         self._nodeIdsA = nodeIds[:len(nodeIds)/2]
         self._nodeIdsB = nodeIds[len(nodeIds)/2:]
@@ -54,8 +130,15 @@ class Orchestration(object):
 
         # Process exposures in groups. Keep the count.
         self._blockId = None
+        self._closedBlockIds = []  # closed since the last commit
+        self._nProfiledBlocks = 0  # committed so far, names profiles
         self._agCount = 0     # count of exposures already processed in that group
-        self._maxInGroup = 10 # max count of exposures per group
+        if blockPolicy is None:
+            blockPolicy = FixedBlockSize(maxInGroup)
+        self._blockPolicy = blockPolicy
+
+        self._cnfChangeEvery = cnfChangeEvery
+        self._nCnfChanges = 0
 
     def __del__(self):
         """
@@ -63,52 +146,311 @@ class Orchestration(object):
         """
         self._conn.close()
 
-    def runDRP(self):
+    def runDRP(self, resume=False, chunkSize=1000):
         """
         Do the orchestration as described in the class description.
+
+        Exposures are streamed from the database in chunks. Results are committed
+        each time a data block is completed, together with the high-water mark of
+        the exposure stream, so that a run that was interrupted can be resumed.
+
+        @param resume     Continue after the last exposure committed by a
+                          previous run
+        @param chunkSize  Number of exposures fetched from the database at once
         """
-        drpPipe = DRPPipe()
+        drpPipe = DRPPipe(self._backend)
+        if self._metrics is not None:
+            drpPipe = instrument(drpPipe, self._metrics, 'drppipe')
+        if self._asyncProv:
+            self._provWriter = AsyncProvProto(self._backend, self._pp)
+            self._provGroups = []   # (future, resultsStart) not written yet
+        if self._journal is not None:
+            self._provWriter = ProvJournal(self._journal, self._pp)
+            loader = JournalLoader(self._backend, self._journal,
+                                   markName=_journalMark)
+            # a new run, or the journal is of another database: start it anew
+            position = None
+            if resume and loader.journalId() == self._provWriter.journalId:
+                position = readMark(self._cursor, _journalMark)
+            self._provWriter.truncate(position)
+            if position is None:
+                loader.bind(self._provWriter.journalId,
+                            self._provWriter.position())
+            loader.start()
+        stream = self._exposureStream(chunkSize)
         try:
-            # Fetch all science calibrated exposures to process.
-            self._cursor.execute('''
-SELECT scExposureId, filter, ra, decl, cFlux
-FROM   ScienceCalibratedExposure''')
-            rows = self._cursor.fetchall()
+            if resume:
+                stream.resume(self._cursor)
+            if self._asyncProv:
+                self._resultsStart = self._getResultsStart(stream.lastId)
             rowN = 0
-            for row in rows:
-                (scExpId, theFilter, ra, decl, flux) = row
+            pending = []   # exposures not processed by DRP yet
+            for row in stream:
+                if not pending:
+                    self._startBlockMetrics()
+                scExpId = row[0]
                 self._addExposureToDataBlock(scExpId)
-                drpPipe.processExposure(scExpId, theFilter, ra, decl, flux,
-                                        self._pp, self._cursor)
+                pending.append(row)
                 rowN += 1
-                if rowN == 70:
+                if self._cnfChangeDue(rowN):
                     self._insertNewWCSDeterminationAlgorithm()
+                if self._blockId is None:
+                    # the data block is complete
+                    drpPipe.processExposures(pending, self._pp, self._cursor)
+                    pending = []
+                    self._commit(stream, scExpId)
+            if self._blockId is not None:
+                self._closeDataBlock()
+            drpPipe.processExposures(pending, self._pp, self._cursor)
+            self._commit(stream, stream.lastId)
+        except self._backend.Error as e:
+            print 'Problems: ', e.args[-1], 'when executing:', \
+                self._backend.lastStatement(self._cursor)
+            self._conn.rollback()
+            self._pp.clearBuffers()
+            self._pp.invalidateCaches()
+            self._closedBlockIds = []
+        if self._asyncProv:
+            self._closeAsyncProv()
+        if self._journal is not None:
+            self._closeJournal(loader)
+
+    def _closeAsyncProv(self):
+        # drops provenance of the block that was rolled back, if any
+        self._provWriter.close()
+        try:
+            self._checkProvGroups()
+        except self._backend.Error as e:
+            print 'Problems when writing provenance: ', e.args[-1]
+        self._provWriter = self._pp
+
+    def _getResultsStart(self, lastExpId):
+        # where results of the next data block start: after exposure lastExpId,
+        # and at the next object id
+        self._cursor.execute(
+            "SELECT nextId FROM IdSequence WHERE name='Object'")
+        return (lastExpId, self._cursor.fetchone()[0])
+
+    def _checkProvGroups(self):
+        """
+        Forgets groups of provenance (see AsyncProvProto) that were written. If
+        one failed, deletes results of its data block and all later ones, whose
+        provenance was dropped, and raises an error.
+        """
+        while self._provGroups and self._provGroups[0][0].done():
+            (future, (lastExpId, firstObjectId)) = self._provGroups.pop(0)
+            error = future.exception()
+            if error is None:
+                continue
+            self._provGroups = []
+            self._conn.rollback()
+            self._cursor.execute('DELETE FROM Source WHERE scExposureId > %s',
+                                 (lastExpId,))
+            self._cursor.execute('DELETE FROM Object WHERE objectId >= %s',
+                                 (firstObjectId,))
             self._conn.commit()
-        except MySQLdb.Error as e:
-            print 'Problems: ', e[1], 'when executing:', self._cursor._last_executed
+            raise self._backend.Error(
+                'provenance of a data block was not written (%s), results of '
+                'exposures after %s were deleted' % (error.args[-1], lastExpId))
+
+    def _closeJournal(self, loader):
+        # drops provenance of the block that was rolled back, if any, and loads
+        # the rest
+        self._provWriter.close()
+        self._provWriter = self._pp
+        try:
+            print 'provenance journal: loaded %d groups' % loader.stop()
+        except self._backend.Error as e:
+            print 'Problems when loading provenance journal: ', e.args[-1]
+        loader.close()
+
+    def runDRPParallel(self, nWorkers=None, bufferSize=1000, chunkSize=1000):
+        """
+        Do the orchestration using a pool of worker processes, one per node
+        registered in provenance (or the first nWorkers nodes). The exposures are
+        grouped into data blocks here, exactly like in runDRP: a block is closed
+        when the block policy says so, or when configuration changes in a way
+        that affects it (the nodes are not known yet when a block is started).
+        Each block is then processed by one worker, which runs all DRP tasks on
+        its node, using its own connection and one transaction per block. If
+        the ProvProto of this object has an MmapNotifier, workers share it, and
+        learn about configuration changes through it.
+
+        The prototype clock is kept here too: each block gets the time at which
+        it would have started in runDRP, so that provenance resolves to the
+        configurations valid at that time.
+
+        Returns the number of blocks that were processed successfully.
+
+        @param nWorkers    Number of worker processes, defaults to one per node
+        @param bufferSize  Buffer size of the ProvProto used by workers
+        @param chunkSize   Number of exposures fetched from the database at once
+        """
+        nodeIds = self._pp.getNodeIds(self._cursor)
+        if nWorkers is not None:
+            nodeIds = nodeIds[:nWorkers]
+        nodeQueue = multiprocessing.Queue()
+        for nodeId in nodeIds:
+            nodeQueue.put(nodeId)
+        # other notifiers are not seen by other processes
+        notifier = self._pp.getNotifier()
+        if not isinstance(notifier, MmapNotifier):
+            notifier = None
+        pool = multiprocessing.Pool(len(nodeIds), _initWorker,
+                                    (self._backend, nodeQueue, bufferSize,
+                                     notifier, self._metrics))
+        results = []
+        try:
+            block = []
+            blockTime = None
+            rowN = 0
+            for row in self._exposureStream(chunkSize):
+                if block and self._splitsBlock(self._newCnfChanges()):
+                    results.append(pool.apply_async(_processBlock,
+                                                    (blockTime, block)))
+                    self._blockPolicy.blockClosed(len(block), True)
+                    block = []
+                if not block:
+                    blockTime = self._pp.getCurrentTime()
+                    self._newCnfChanges()
+                    self._blockPolicy.startBlock(self._pp, self._cursor, None)
+                block.append(row)
+                self._pp.forwardCurrentTime(12)
+                if self._blockPolicy.isFull(self._pp, len(block)):
+                    results.append(pool.apply_async(_processBlock,
+                                                    (blockTime, block)))
+                    self._blockPolicy.blockClosed(len(block), False)
+                    block = []
+                rowN += 1
+                if self._cnfChangeDue(rowN):
+                    self._insertNewWCSDeterminationAlgorithm()
+                    # workers must see the new configuration
+                    self._conn.commit()
+                    self._pp.publishChanges()
+            if block:
+                results.append(pool.apply_async(_processBlock, (blockTime, block)))
+                self._blockPolicy.blockClosed(len(block), False)
+        except self._backend.Error as e:
+            print 'Problems: ', e.args[-1], 'when executing:', \
+                self._backend.lastStatement(self._cursor)
             self._conn.rollback()
+            self._pp.invalidateCaches()
+        finally:
+            pool.close()
+            pool.join()
+        nOk = 0
+        for result in results:
+            (error, snapshot) = result.get()
+            if snapshot is not None:
+                self._metrics.merge(snapshot)
+            if error is None:
+                nOk += 1
+            else:
+                print 'Problems when processing data block: ', error
+        return nOk
+
+    def _exposureStream(self, chunkSize):
+        return ExposureStream(self._backend, 'ScienceCalibratedExposure',
+                              'scExposureId', ('filter', 'ra', 'decl', 'cFlux'),
+                              'Data Release Pipeline', chunkSize)
+
+    def _commit(self, stream, lastExpId):
+        self._provWriter.flush(self._cursor)
+        blockIds = self._closedBlockIds
+        for blockId in blockIds:
+            self._provWriter.registerExposureLineage(self._cursor, blockId)
+        self._closedBlockIds = []
+        if self._journal is not None:
+            saveMark(self._cursor, _journalMark, self._provWriter.commit())
+        if self._asyncProv:
+            self._checkProvGroups()
+            # the mark is committed with provenance of the block, by the writer
+            self._provWriter.execute(stream.saveHighWaterMark, lastExpId)
+            self._conn.commit()
+            self._provGroups.append((self._provWriter.commit(),
+                                     self._resultsStart))
+            self._resultsStart = self._getResultsStart(lastExpId)
+        else:
+            stream.saveHighWaterMark(self._cursor, lastExpId)
+            self._conn.commit()
+        self._pp.publishChanges()
+        self._endBlockMetrics(blockIds)
+
+    def _startBlockMetrics(self):
+        if self._metrics is None:
+            return
+        self._blockStart = time.time()
+        self._blockRows = self._metrics.total('sql_rows_written_total')
+        self._profiler = self._metrics.startProfile()
+
+    def _endBlockMetrics(self, blockIds):
+        if self._metrics is None or not blockIds:
+            return
+        _observeBlock(self._metrics, time.time() - self._blockStart,
+                      (self._metrics.total('sql_rows_written_total') -
+                       self._blockRows) / len(blockIds), len(blockIds))
+        # blocks are numbered here: with asyncProv or journal, their ids are not
+        # known yet, or are not those of the database
+        first = self._nProfiledBlocks + 1
+        self._nProfiledBlocks += len(blockIds)
+        self._metrics.saveProfile(self._profiler, 'block-%s' % '-'.join(
+            map(str, xrange(first, self._nProfiledBlocks + 1))))
+
+    def _cnfChangeDue(self, rowN):
+        if self._cnfChangeEvery is None:
+            return rowN == 70
+        return self._cnfChangeEvery > 0 and rowN % self._cnfChangeEvery == 0
+
+    def _newCnfChanges(self):
+        # Returns names of tasks whose configuration changed since the last call,
+        # or None if procHistoryId did not change
+        procHistoryId = self._pp.getProcHistoryId(self._cursor)
+        if procHistoryId == self._procHistoryId:
+            return None
+        self._procHistoryId = procHistoryId
+        return self._impact.refresh(self._cursor)
+
+    def _splitsBlock(self, changed):
+        # Tells if configuration changes affect the data block in flight. A new
+        # procHistoryId that can't be attributed to any task affects it too.
+        if changed is None:
+            return False
+        return not changed or self._impact.affectsBlock(
+            changed, 'ScienceCalibratedExposure', _drpTasks)
 
     def _insertNewWCSDeterminationAlgorithm(self):
-        # pretend some time passed and now it is mid October of 2021
-        self._pp.setCurrentTime('2021-10-15 17:42:12')
-        # update the algorithms a bit, including changing some input parameters
-        self._pp.updateTaskConfig(self._cursor,
-                                 Task('WCS Determination',
-                                      '4355aa',
-                                      {"x":"2.1","y":"5.08","z":"6.7"}))
-        # and of course that means we need to update procHistoryId
-        self._pp.createProcHistoryId(self._cursor)
+        # pretend some time passed and now it is mid October of 2021 (unless
+        # that time has passed already)
+        if self._pp.getCurrentTime() < '2021-10-15 17:42:12':
+            self._pp.setCurrentTime('2021-10-15 17:42:12')
+        # update the algorithms a bit, including changing some input parameters;
+        # each subsequent change is a bit different, so that it is a change
+        n = self._nCnfChanges
+        self._nCnfChanges += 1
+        changed = self._pp.updateTaskConfig(self._cursor,
+                                            Task('WCS Determination',
+                                                 '%06x' % (0x4355aa + n),
+                                                 {"x":"2.1","y":"5.08",
+                                                  "z":str(6.7 + n)}))
+        # and of course that means we need to update procHistoryId, if anything
+        # really changed
+        if changed:
+            self._pp.createProcHistoryId(self._cursor)
 
     def _addExposureToDataBlock(self, scExpId):
         if self._blockId:
-            # check if configuration changed, if it did, start a new data block
-            if self._procHistoryId != self._pp.getProcHistoryId(self._cursor):
+            # check if configuration changed, if it did in a way that affects the
+            # data block, start a new data block
+            changed = self._newCnfChanges()
+            if self._splitsBlock(changed):
                 print "configuration changed, resetting data block"
-                self._blockId = None
+                self._closeDataBlock(cnfChanged=True)
+            elif changed is not None:
+                print "configuration changed, data block not affected"
 
         if self._blockId is None:
-            self._blockId = self._pp.registerDataBlock(self._cursor,
-                                                      "ScienceCalibratedExposure")
+            self._blockId = self._provWriter.registerDataBlock(
+                self._cursor, "ScienceCalibratedExposure")
 
             # register taskExecutions and bind them with the group of exposures
             # that will be processed by these taskExecutions. Let\'s say the first
@@ -116,23 +458,26 @@ FROM   ScienceCalibratedExposure''')
             for n in ['Image Correction',
                       'WCS Determination',
                       'Photometric Calibration']:
-                self._pp.registerTaskExecution(self._cursor, n,
+                self._provWriter.registerTaskExecution(self._cursor, n,
                     self._nodeIdsA[self._activeNodeA], self._blockId)
             for n in ['Astrometric Calibration',
                       'Image Coaddition',
                       'Classification']:
-                self._pp.registerTaskExecution(self._cursor, n,
+                self._provWriter.registerTaskExecution(self._cursor, n,
                     self._nodeIdsB[self._activeNodeB], self._blockId)
-            # and capture the current procHistoryId
-            self._procHistoryId = self._pp.getProcHistoryId(self._cursor)
+            # and catch up with configuration changes made since the last block
+            self._newCnfChanges()
+            self._blockPolicy.startBlock(self._pp, self._cursor,
+                                         (self._nodeIdsA[self._activeNodeA],
+                                          self._nodeIdsB[self._activeNodeB]))
 
         # add current exposure to that group
-        self._pp.registerRowIdInBlock(self._cursor, self._blockId, scExpId)
+        self._provWriter.registerRowIdInBlock(self._cursor, self._blockId, scExpId)
 
         self._agCount += 1
-        if self._agCount >= self._maxInGroup:
-            self._blockId = None
-            self._agCount = 0
+        self._pp.forwardCurrentTime(12)
+        if self._blockPolicy.isFull(self._pp, self._agCount):
+            self._closeDataBlock()
             self._activeNodeA += 1
             if self._activeNodeA >=len(self._nodeIdsA):
                 self._activeNodeA = 0
@@ -140,4 +485,86 @@ FROM   ScienceCalibratedExposure''')
             if self._activeNodeB >=len(self._nodeIdsB):
                 self._activeNodeB = 0
 
-        self._pp.forwardCurrentTime(12)
+    def _closeDataBlock(self, cnfChanged=False):
+        self._provWriter.closeDataBlock(self._cursor, self._blockId)
+        self._closedBlockIds.append(self._blockId)
+        self._blockId = None
+        self._blockPolicy.blockClosed(self._agCount, cnfChanged)
+        self._agCount = 0
+
+# ----------------------------------------------------------------------------------
+# -----              worker side of Orchestration.runDRPParallel               -----
+# ----------------------------------------------------------------------------------
+
+_worker = {}
+
+def _initWorker(backend, nodeQueue, bufferSize, notifier, metrics):
+    """
+    Initializes one worker process: it takes one node, and opens its own
+    connection. Its ProvProto uses notifier (None for no notifier). Metrics
+    recorded by the worker are sent back with the result of each block.
+    """
+    _worker['backend'] = backend
+    _worker['nodeId'] = nodeQueue.get()
+    _worker['conn'] = backend.connect()
+    _worker['cursor'] = _worker['conn'].cursor()
+    _worker['pp'] = ProvProto(bufferSize, notifier)
+    # don't let all workers generate the same random data
+    random.seed(_worker['nodeId'])
+    _worker['drpPipe'] = DRPPipe(backend)
+    _worker['metrics'] = metrics
+    if metrics is not None:
+        # forget whatever was recorded by the parent before the fork
+        metrics.snapshot(reset=True)
+        _worker['pp'] = instrument(_worker['pp'], metrics, 'provproto')
+        _worker['drpPipe'] = instrument(_worker['drpPipe'], metrics, 'drppipe')
+
+def _processBlock(blockTime, rows):
+    """
+    Registers a new data block with the exposures passed through rows, runs all
+    DRP tasks on them on the node of this worker, and commits. Returns
+    (error, metrics): error is None on success, or the error message, metrics
+    is a snapshot of metrics recorded for this block, or None.
+    """
+    (nodeId, metrics) = (_worker['nodeId'], _worker['metrics'])
+    if metrics is None:
+        return (_runBlock(blockTime, rows), None)
+    start = time.time()
+    profiler = metrics.startProfile()
+    error = _runBlock(blockTime, rows)
+    metrics.saveProfile(profiler, 'block-node%s-%s' % (nodeId, rows[0][0]))
+    _observeBlock(metrics, time.time() - start,
+                  metrics.total('sql_rows_written_total'), 1)
+    return (error, metrics.snapshot(reset=True))
+
+def _runBlock(blockTime, rows):
+    (backend, nodeId) = (_worker['backend'], _worker['nodeId'])
+    (conn, cursor, pp) = (_worker['conn'], _worker['cursor'], _worker['pp'])
+    pp.setCurrentTime(blockTime)
+    try:
+        blockId = pp.registerDataBlock(cursor, "ScienceCalibratedExposure")
+        for n in _drpTasks:
+            pp.registerTaskExecution(cursor, n, nodeId, blockId)
+        for row in rows:
+            pp.registerRowIdInBlock(cursor, blockId, row[0])
+            pp.forwardCurrentTime(12)
+        pp.closeDataBlock(cursor, blockId)
+        _worker['drpPipe'].processExposures(rows, pp, cursor)
+        pp.flush(cursor)
+        pp.registerExposureLineage(cursor, blockId)
+        conn.commit()
+        return None
+    except backend.Error as e:
+        conn.rollback()
+        pp.clearBuffers()
+        pp.invalidateCaches()
+        return '%s when executing: %s' % (e.args[-1], backend.lastStatement(cursor))
+
+def _observeBlock(metrics, seconds, rowsPerBlock, nBlocks):
+    """
+    Records metrics of nBlocks data blocks committed together.
+    """
+    metrics.inc('orchestration_blocks_total', nBlocks)
+    metrics.observe('orchestration_block_seconds', seconds / nBlocks)
+    metrics.observe('orchestration_block_rows_written', rowsPerBlock,
+                    bounds=Histogram.countBounds)
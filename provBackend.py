@@ -0,0 +1,393 @@
+import os
+import re
+import sqlite3
+
+
+# ----------------------------------------------------------------------------------
+
+class MySQLBackend(object):
+    """
+    Keeps catalog and provenance in a MySQL database, the way the prototype was
+    designed to run. The database should exist and the schema should be loaded
+    (see runIt.sh).
+
+    Backends are small, picklable objects holding connection parameters only,
+    so that they can be handed to other processes, which then connect on their
+    own.
+    """
+    name = 'mysql'
+    randomFunc = 'RAND()'
+
+    def __init__(self, host, port, user, password, db):
+        """
+        @host        mysql credentials: host
+        @port        mysql credentials: port
+        @user        mysql credentials: user
+        @password    mysql credentials: password
+        @db          mysql credentials: database name
+        """
+        self._credentials = dict(host=host, port=port, user=user,
+                                 passwd=password, db=db)
+
+    @property
+    def Error(self):
+        import MySQLdb
+        return MySQLdb.Error
+
+    def connect(self):
+        """
+        Returns a new connection, with autocommit disabled.
+        """
+        import MySQLdb
+        conn = MySQLdb.connect(**self._credentials)
+        conn.autocommit(False)
+        return conn
+
+    def streamingCursor(self, conn):
+        """
+        Returns a server-side cursor: rows are fetched from the server as they
+        are consumed, instead of the whole result being stored on the client.
+        """
+        import MySQLdb.cursors
+        return conn.cursor(MySQLdb.cursors.SSCursor)
+
+    def lastStatement(self, cursor):
+        """
+        Returns the last statement executed through the cursor.
+        """
+        return cursor._last_executed
+
+    def reserveIds(self, cursor, name, n):
+        """
+        Reserves n consecutive ids from the IdSequence row called name, and
+        returns the first one. The sequence table is not transactional, so the
+        reservation is visible to other connections right away and ids are
+        never reused, even if the transaction is rolled back.
+        """
+        cursor.execute('''
+UPDATE IdSequence SET nextId=LAST_INSERT_ID(nextId+%s) WHERE name=%s''',
+                       (n, name))
+        return cursor.lastrowid - n
+
+    def tableSizes(self, cursor):
+        """
+        Returns {tableName: bytes} for all tables of the database, data and
+        indexes together, as estimated by the storage engine.
+        """
+        cursor.execute('''
+SELECT table_name, data_length + index_length
+FROM   information_schema.TABLES
+WHERE  table_schema=DATABASE()''')
+        return dict((name, int(size)) for (name, size) in cursor.fetchall())
+
+    def createTableLike(self, cursor, newTable, table):
+        """
+        Creates an empty table with the columns and indexes of another table,
+        without its foreign keys.
+        """
+        cursor.execute('CREATE TABLE %s LIKE %s' % (newTable, table))
+
+    def loadSchema(self, conn, fileName):
+        """
+        Executes all statements from a schema file.
+        """
+        cursor = conn.cursor()
+        for statement in _statements(fileName):
+            cursor.execute(statement)
+        conn.commit()
+
+    def createSchema(self, schemaDir=None):
+        """
+        Drops all tables from the database and loads the catalog and provenance
+        schema.
+
+        @param schemaDir  Directory with catalogSchema.sql and provSchema.sql,
+                          defaults to the directory of this module.
+        """
+        if schemaDir is None:
+            schemaDir = os.path.dirname(os.path.abspath(__file__))
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SHOW TABLES')
+        tables = [row[0] for row in cursor.fetchall()]
+        cursor.execute('SET FOREIGN_KEY_CHECKS=0')
+        for table in tables:
+            cursor.execute('DROP TABLE %s' % table)
+        cursor.execute('SET FOREIGN_KEY_CHECKS=1')
+        for fileName in ('catalogSchema.sql', 'provSchema.sql'):
+            self.loadSchema(conn, os.path.join(schemaDir, fileName))
+        conn.close()
+
+
+# ----------------------------------------------------------------------------------
+
+class SQLiteBackend(object):
+    """
+    Keeps catalog and provenance in an embedded SQLite database file, so that
+    provenance can be captured in-process, without a database server (e.g. on
+    worker nodes, or for file repositories, see Provenance.md section 3.7).
+
+    Connections use write-ahead logging, so readers don't block the writer.
+    SQL written for MySQLdb (with %s placeholders) is translated to the qmark
+    style; translated statements are cached, so sqlite3 reuses its prepared
+    statements. The schema files are translated from the MySQL dialect when
+    loaded (see createSchema).
+    """
+    name = 'sqlite'
+    randomFunc = 'RANDOM()'
+    Error = sqlite3.Error
+
+    def __init__(self, path, timeout=60):
+        """
+        @param path     Path to the database file
+        @param timeout  How many seconds to wait for a lock held by another
+                        connection
+        """
+        self._path = path
+        self._timeout = timeout
+
+    def connect(self):
+        """
+        Returns a new connection. Transactions are started implicitly by the
+        first modifying statement, like with MySQL and autocommit disabled.
+        The connection may be used by another thread than the one that made it
+        (e.g. when handed out again by ConnectionPool), but by one at a time.
+        """
+        conn = sqlite3.connect(self._path, timeout=self._timeout,
+                               cached_statements=512, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return _SQLiteConnection(conn)
+
+    def streamingCursor(self, conn):
+        """
+        Returns a cursor that fetches rows as they are consumed (all SQLite
+        cursors do).
+        """
+        return conn.cursor()
+
+    def lastStatement(self, cursor):
+        """
+        Returns the last statement executed through the cursor.
+        """
+        return cursor._last_executed
+
+    def reserveIds(self, cursor, name, n):
+        """
+        Reserves n consecutive ids from the IdSequence row called name, and
+        returns the first one. The sequence row stays locked until the end of
+        the transaction (SQLite has one writer at a time anyway).
+        """
+        cursor.execute('''
+UPDATE IdSequence SET nextId=nextId+%s WHERE name=%s''', (n, name))
+        cursor.execute('''
+SELECT nextId FROM IdSequence WHERE name=%s''', (name,))
+        return cursor.fetchone()[0] - n
+
+    def tableSizes(self, cursor):
+        """
+        Returns {tableName: bytes} for all tables of the database, data and
+        indexes together: the size of pages used by them. Needs SQLite compiled
+        with the dbstat virtual table.
+        """
+        cursor.execute('''
+SELECT m.tbl_name, SUM(d.pgsize)
+FROM   dbstat d
+JOIN   sqlite_master m ON m.name=d.name
+GROUP  BY m.tbl_name''')
+        return dict(cursor.fetchall())
+
+    def createTableLike(self, cursor, newTable, table):
+        """
+        Creates an empty table with the columns and indexes of another table,
+        without its foreign keys, and with ids that are not autoincremented.
+        """
+        cursor.execute('''
+SELECT type, sql FROM sqlite_master WHERE tbl_name=%s AND sql IS NOT NULL
+ORDER  BY type DESC''', (table,))
+        for (kind, sql) in cursor.fetchall():
+            if kind == 'table':
+                sql = re.sub(r',\s*CONSTRAINT \w+ FOREIGN KEY\(\w+\) '
+                             r'REFERENCES \w+\(\w+\)', '', sql)
+                sql = sql.replace(' AUTOINCREMENT', '')
+            cursor.execute(sql.replace(table, newTable))
+
+    def loadSchema(self, conn, fileName):
+        """
+        Executes all statements from a schema file written for MySQL,
+        translated to SQLite.
+        """
+        cursor = conn.cursor()
+        for statement in _statements(fileName):
+            for s in _mysqlToSQLite(statement):
+                cursor.execute(s)
+        conn.commit()
+
+    def createSchema(self, schemaDir=None):
+        """
+        Creates a new database file with the catalog and provenance schema.
+
+        @param schemaDir  Directory with catalogSchema.sql and provSchema.sql,
+                          defaults to the directory of this module.
+        """
+        if schemaDir is None:
+            schemaDir = os.path.dirname(os.path.abspath(__file__))
+        if os.path.exists(self._path):
+            os.remove(self._path)
+        conn = self.connect()
+        for fileName in ('catalogSchema.sql', 'provSchema.sql'):
+            self.loadSchema(conn, os.path.join(schemaDir, fileName))
+        conn.close()
+
+
+class _SQLiteConnection(object):
+    """
+    Wraps sqlite3 connection so that it can be used like a MySQLdb connection.
+    """
+    def __init__(self, conn):
+        self._conn = conn
+        self.Error = sqlite3.Error
+
+    def cursor(self):
+        return _SQLiteCursor(self, self._conn.cursor())
+
+    def autocommit(self, flag):
+        self._conn.isolation_level = None if flag else ''
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+class _SQLiteCursor(object):
+    """
+    Wraps sqlite3 cursor so that it can be used like a MySQLdb cursor:
+    translates %s placeholders, and sets lastrowid after executemany() to the
+    id of the first inserted row, which is what MySQL returns for multi-row
+    inserts.
+    """
+    _translated = {}
+
+    def __init__(self, connection, cursor):
+        self.connection = connection
+        self._cursor = cursor
+        self._last_executed = None
+        self.lastrowid = None
+
+    def execute(self, query, args=None):
+        self._last_executed = query
+        if args is None:
+            self._cursor.execute(query)
+        else:
+            self._cursor.execute(self._toQmark(query), tuple(args))
+        self.lastrowid = self._cursor.lastrowid
+        return self._cursor.rowcount
+
+    def executemany(self, query, args):
+        self._last_executed = query
+        args = list(args)
+        self._cursor.executemany(self._toQmark(query), args)
+        if args and query.lstrip().upper().startswith('INSERT'):
+            self._cursor.execute('SELECT last_insert_rowid()')
+            self.lastrowid = self._cursor.fetchone()[0] - len(args) + 1
+        return len(args)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._cursor.fetchmany()
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @classmethod
+    def _toQmark(cls, query):
+        translated = cls._translated.get(query)
+        if translated is None:
+            translated = re.sub('%[s%]', lambda m: '?' if m.group() == '%s' else '%',
+                                query)
+            cls._translated[query] = translated
+        return translated
+
+
+# ----------------------------------------------------------------------------------
+
+def _statements(fileName):
+    """
+    Returns statements from a schema file, with comments removed.
+    """
+    with open(fileName) as f:
+        text = re.sub('--[^\n]*', '', f.read())
+    return [s.strip() for s in text.split(';') if s.strip()]
+
+
+def _splitTopLevel(text):
+    """
+    Splits text on commas that are not inside parentheses.
+    """
+    parts = []
+    (depth, current) = (0, '')
+    for c in text:
+        if c == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+            continue
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        current += c
+    parts.append(current)
+    return [' '.join(p.split()) for p in parts if p.strip()]
+
+
+def _mysqlToSQLite(statement):
+    """
+    Translates one MySQL DDL statement from our schema files into a list of
+    SQLite statements: AUTO_INCREMENT primary keys become INTEGER PRIMARY KEY
+    AUTOINCREMENT columns, inline indexes become CREATE INDEX statements, and
+    table options (ENGINE etc.) are dropped. Other statements are returned as
+    they are.
+    """
+    m = re.match(r'CREATE TABLE (\w+)\s*\((.*)\)[^)]*$', statement, re.S)
+    if m is None:
+        return [statement]
+    (table, body) = m.groups()
+    definitions = _splitTopLevel(body)
+    autoCols = [d.split()[0] for d in definitions if 'AUTO_INCREMENT' in d]
+    columns = []
+    indexes = []
+    for d in definitions:
+        if d.startswith('PRIMARY KEY'):
+            cols = re.search(r'\((.*)\)', d).group(1).strip()
+            if cols not in autoCols:
+                columns.append('PRIMARY KEY (%s)' % cols)
+        elif re.match(r'(UNIQUE )?(INDEX|KEY) ', d):
+            im = re.match(r'(UNIQUE )?(?:INDEX|KEY) (\w+)\s*\((.*)\)', d)
+            indexes.append('CREATE %sINDEX %s_%s ON %s(%s)' %
+                           (im.group(1) or '', table, im.group(2), table,
+                            im.group(3)))
+        elif 'AUTO_INCREMENT' in d:
+            columns.append('%s INTEGER PRIMARY KEY AUTOINCREMENT' % d.split()[0])
+        else:
+            columns.append(d)
+    return ['CREATE TABLE %s (\n    %s\n)' % (table, ',\n    '.join(columns))] + \
+        indexes
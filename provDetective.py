@@ -1,25 +1,114 @@
 
-import MySQLdb
+from contextlib import contextmanager
+
+from configResolver import ConfigResolver
+from provPartitions import PartitionManager
+from provPool import session
+from provRecords import SourceProvenance
 
 class ProvDetective(object):
     """
     This class is helping to poke around inside provenance to find things.
+
+    Queries go through prv_ExposureLineage, which maps each science calibrated
+    exposure directly to the task executions that processed it (see
+    ProvProto.registerExposureLineage), so the Source table is joined with one
+    narrow, indexed table instead of data block membership.
+
+    If provenance is partitioned (see provPartitions), lineage is also looked
+    up in partitions, but only in those that can hold the exposures of the
+    sources asked about, and, for bulk queries given a time range, that
+    overlap it.
+
+    A connection is checked out for each call (see provPool.session), so a
+    detective that is kept around holds none while it is idle.
+
+    Configurations are loaded once, and loaded again only after a change was
+    announced through the notifier (see changeNotifier), or, without one, after
+    a new procHistoryId was created.
     """
-    def __init__(self, host, port, user, password, db):
-        self._conn = MySQLdb.connect(host=host, port=port, user=user,
-                                     passwd=password, db=db)
-        self._cursor = self._conn.cursor()
+    def __init__(self, backend, notifier=None):
+        """
+        @param backend   Storage backend (see provBackend)
+        @param notifier  Change notifier configuration changes are published
+                         through, or None
+        """
+        self._backend = backend
+        self._cursor = None   # of the connection checked out for a call
+        self._notifier = notifier
+        with self._session():
+            self._seenChange = self._configChange()
+            self._configResolver = ConfigResolver(self._cursor)
+        self._partitions = PartitionManager(backend)
+
+    @contextmanager
+    def _session(self):
+        # checks out a connection for a call (see provPool.session), calls made
+        # from within it use the same one
+        if self._cursor is not None:
+            yield
+            return
+        with session(self._backend) as conn:
+            self._cursor = conn.cursor()
+            try:
+                yield
+            finally:
+                self._cursor = None
+
+    # tables that grow with the number of data blocks and task executions
+    _volumeTables = ('prv_DataBlock',
+                     'prv_RowIdToDataBlock',
+                     'prv_RowIdRangeToDataBlock',
+                     'prv_TaskExecution',
+                     'prv_TaskExecutionToInputDataBlock',
+                     'prv_TaskExecutionToOutputDataBlock',
+                     'prv_ExposureLineage')
 
-    def __del__(self):
-        self._conn.close()
+    def provenanceVolume(self):
+        """
+        Returns a list of (tableName, rows, bytes) for provenance tables that
+        grow with data blocks: the blocks themselves, their membership, task
+        executions and their links, and the lineage. bytes is None if the
+        backend can't tell.
+        """
+        with self._session():
+            try:
+                sizes = self._backend.tableSizes(self._cursor)
+            except self._backend.Error:
+                sizes = {}
+            volume = []
+            for table in self._volumeTables:
+                self._cursor.execute('SELECT COUNT(*) FROM %s' % table)
+                volume.append((table, self._cursor.fetchone()[0],
+                               sizes.get(table)))
+            return volume
+
+    def printProvenanceVolume(self, nExposures=None):
+        """
+        Prints provenanceVolume(), with rows per exposure: per science
+        calibrated exposure in the catalog, unless nExposures is given.
+        """
+        with self._session():
+            if nExposures is None:
+                self._cursor.execute(
+                    'SELECT COUNT(*) FROM ScienceCalibratedExposure')
+                nExposures = self._cursor.fetchone()[0]
+            print "provenance volume for %d exposures:" % nExposures
+            print "table, rows, rows per exposure, bytes"
+            for (table, rows, size) in self.provenanceVolume():
+                print '%-35s %10d %8.2f %12s' % (
+                    table, rows, float(rows) / max(nExposures, 1),
+                    size if size is not None else '-')
 
     def _getRandomObjectId(self):
-        self._cursor.execute('SELECT objectId FROM Object ORDER BY RAND() LIMIT 1')
+        self._cursor.execute('SELECT objectId FROM Object ORDER BY %s LIMIT 1' %
+                             self._backend.randomFunc)
         row = self._cursor.fetchone()
         return row[0]
 
     def _getRandomSourceId(self):
-        self._cursor.execute('SELECT sourceId FROM Source ORDER BY RAND() LIMIT 1')
+        self._cursor.execute('SELECT sourceId FROM Source ORDER BY %s LIMIT 1' %
+                             self._backend.randomFunc)
         row = self._cursor.fetchone()
         return row[0]
 
@@ -28,21 +117,20 @@ class ProvDetective(object):
         Prints which node processed a given object. If objectId is none, the
         function will do it for one randomly selected object.
         """
-        if objectId is None:
-            objectId = self._getRandomObjectId()
-
-        # find all exposures that have sources corresponding to this object
-        self._cursor.execute('''
-SELECT scExposureId, sourceId, blockId, taskExecId, taskName, nodeName
-FROM   Source
-JOIN   ScienceCalibratedExposure sce USING(scExposureId)
-JOIN   prv_RowIdToDataBlock r ON sce.scExposureId=r.theId
-JOIN   prv_TaskExecutionToInputDataBlock USING(blockId)
-JOIN   prv_TaskExecution USING(taskExecId)
-JOIN   prv_Node USING(nodeId)
-JOIN   prv_Task USING(taskId)
-WHERE  objectId=%s''' % objectId)
-        rows = self._cursor.fetchall()
+        with self._session():
+            if objectId is None:
+                objectId = self._getRandomObjectId()
+
+            # find all exposures that have sources corresponding to this object
+            self._partitions.refresh(self._cursor)
+            rows = self._queryLineage('''
+SELECT l.scExposureId, s.sourceId, l.blockId, l.taskExecId, t.taskName,
+       n.nodeName
+FROM   Source s
+JOIN   prv_ExposureLineage l ON l.scExposureId=s.scExposureId
+JOIN   prv_Task t ON t.taskId=l.taskId
+JOIN   prv_Node n ON n.nodeId=l.nodeId
+WHERE  s.objectId=%s''', (objectId,), 's.objectId=%s', (objectId,))
         print "object with id", objectId, "processsing history, showing:"
         print "scExposureId, sourceId, sceGroupId, taskExecId, taskName, nodeName"
         for row in rows:
@@ -54,46 +142,181 @@ WHERE  objectId=%s''' % objectId)
         If objectId is none, the function will do it for one randomly selected
         object.
         """
-        if objectId is None:
-            objectId = self._getRandomObjectId()
-        self._cursor.execute('''
-SELECT sourceId
-FROM   Source
-WHERE  objectId='%s' ''' % objectId)
-        rows = self._cursor.fetchall()
-        for row in rows:
-            self.taskVersionForSource(taskName, row[0])
-
+        with self._session():
+            if objectId is None:
+                objectId = self._getRandomObjectId()
+            self._refreshConfig()
+            rows = self._processingTimes(taskName, 'objectId', objectId)
+            cnfs = self._configResolver.resolveMany('task', taskName,
+                                                    [row[1] for row in rows])
+            for (row, cnf) in zip(rows, cnfs):
+                self._printTaskVersion(taskName, row, cnf)
 
     def taskVersionForSource(self, taskName, sourceId=None):
         """
         Prints version of the task taskName for a given source. If sourceId is
         none, the function will do it for one randomly selected source.
         """
-        if sourceId is None:
-            sourceId = self._getRandomSourceId()
-
-        # first get the time when given source was processed
-        self._cursor.execute('''
-SELECT theTime, blockId
-FROM   Source
-JOIN   ScienceCalibratedExposure sce USING(scExposureId)
-JOIN   prv_RowIdToDataBlock r ON sce.scExposureId=r.theId
-JOIN   prv_TaskExecutionToInputDataBlock USING(blockId)
-JOIN   prv_TaskExecution USING(taskExecId)
-WHERE  sourceId=%s''' % sourceId)
-        row = self._cursor.fetchone()
-        theTime = row[0]
-        theGroup = row[1]
-
-        # then find the configuration valid for that time
-        self._cursor.execute('''
-SELECT gitSHA
-FROM   prv_cnf_Task
-JOIN   prv_Task USING(taskId)
-WHERE  taskName='%s'
-  AND  validityBegin <= '%s'
-  AND  validityEnd > '%s' ''' % (taskName, theTime, theTime))
-        row = self._cursor.fetchone()
+        with self._session():
+            if sourceId is None:
+                sourceId = self._getRandomSourceId()
+
+            # first get the time when given source was processed, then find the
+            # configuration valid for that time
+            self._refreshConfig()
+            row = self._processingTimes(taskName, 'sourceId', sourceId)[0]
+            cnf = self._configResolver.resolve('task', taskName, row[1])
+            self._printTaskVersion(taskName, row, cnf)
+
+    def _configChange(self):
+        # tells whether configuration changed: (version, procHistoryId) of the
+        # notifier, or the current procHistoryId
+        if self._notifier is not None:
+            return self._notifier.read()
+        self._cursor.execute('SELECT MAX(procHistoryId) FROM prv_ProcHistory')
+        return self._cursor.fetchone()[0]
+
+    def _refreshConfig(self):
+        change = self._configChange()
+        if change != self._seenChange:
+            self._seenChange = change
+            self._configResolver.refresh(self._cursor)
+
+    def _processingTimes(self, taskName, column, value):
+        """
+        Returns (sourceId, theTime, blockId) for each source selected by
+        column=value, where theTime is the time when the task taskName processed
+        the data block of the source exposure.
+        """
+        self._partitions.refresh(self._cursor)
+        return self._queryLineage('''
+SELECT s.sourceId, l.theTime, l.blockId
+FROM   Source s
+JOIN   prv_ExposureLineage l ON l.scExposureId=s.scExposureId
+JOIN   prv_Task t ON t.taskId=l.taskId
+WHERE  s.%s=%%s AND t.taskName=%%s''' % column, (value, taskName),
+                                  's.%s=%%s' % column, (value,))
+
+    def _queryLineage(self, query, args, sourceCond, sourceArgs, timeRange=None):
+        """
+        Executes a query that reads prv_ExposureLineage, against the live table
+        and each partition that can hold exposures of sources selected by
+        sourceCond, and returns all rows. Partitions are looked up as of the
+        last refresh of the partition catalog.
+        """
+        (timeBegin, timeEnd) = timeRange or (None, None)
+        if timeRange is not None:
+            query += ' AND l.theTime >= %s AND l.theTime < %s'
+            args = tuple(args) + (timeBegin, timeEnd)
+        if not self._partitions.partitions('prv_ExposureLineage'):
+            tables = ['prv_ExposureLineage']
+        else:
+            self._cursor.execute('''
+SELECT MIN(s.scExposureId), MAX(s.scExposureId) FROM Source s WHERE ''' +
+                                 sourceCond, sourceArgs)
+            (keyBegin, keyEnd) = self._cursor.fetchone()
+            if keyBegin is None:
+                return []
+            tables = self._partitions.tablesFor('prv_ExposureLineage', timeBegin,
+                                                timeEnd, keyBegin, keyEnd)
+        rows = []
+        for table in tables:
+            self._cursor.execute(query.replace('prv_ExposureLineage', table), args)
+            rows += self._cursor.fetchall()
+        return rows
+
+    # ------------------------------------------------------------------------------
+    # -----   bulk queries: they work on batches of ids and yield records      -----
+    # ------------------------------------------------------------------------------
+
+    _bulkQuery = '''
+SELECT s.sourceId, s.objectId, s.scExposureId, l.blockId, l.taskExecId,
+       l.theTime, n.nodeName, l.taskCnfId, ct.gitSHA
+FROM   Source s
+JOIN   prv_ExposureLineage l ON l.scExposureId=s.scExposureId
+JOIN   prv_Task t ON t.taskId=l.taskId
+JOIN   prv_Node n ON n.nodeId=l.nodeId
+JOIN   prv_cnf_Task ct ON ct.taskCnfId=l.taskCnfId
+WHERE  t.taskName=%s AND '''
+
+    def taskVersionsForObjects(self, taskName, objectIds, batchSize=1000,
+                               timeRange=None):
+        """
+        Yields a SourceProvenance record for each source of the given objects:
+        which data block and task execution of task taskName processed it, on
+        which node, and which configuration of the task was valid at that time.
+        Each batch of objects is resolved with one query (per partition that
+        can match). To keep many records in memory, collect them in a
+        provRecords.LineageArray.
+
+        @param taskName   Name of the task
+        @param objectIds  Iterable of objectIds
+        @param batchSize  Max number of objectIds per query
+        @param timeRange  (begin, end) of the time of processing to consider, or
+                          None for all
+        """
+        return self._bulkTaskVersions(taskName, 's.objectId', objectIds, batchSize,
+                                      timeRange)
+
+    def taskVersionsForSources(self, taskName, sourceIds, batchSize=1000,
+                               timeRange=None):
+        """
+        Same as taskVersionsForObjects, but for a list of sources.
+
+        @param taskName   Name of the task
+        @param sourceIds  Iterable of sourceIds
+        @param batchSize  Max number of sourceIds per query
+        @param timeRange  (begin, end) of the time of processing, or None
+        """
+        return self._bulkTaskVersions(taskName, 's.sourceId', sourceIds, batchSize,
+                                      timeRange)
+
+    def taskVersionsForSourceRange(self, taskName, sourceIdBegin, sourceIdEnd,
+                                   batchSize=10000, timeRange=None):
+        """
+        Same as taskVersionsForObjects, but for all sources with sourceId from
+        sourceIdBegin to sourceIdEnd (inclusive). The range is processed in
+        windows of batchSize ids.
+
+        @param taskName       Name of the task
+        @param sourceIdBegin  First sourceId of the range
+        @param sourceIdEnd    Last sourceId of the range
+        @param batchSize      Number of sourceIds per query
+        @param timeRange      (begin, end) of the time of processing, or None
+        """
+        with self._session():
+            self._partitions.refresh(self._cursor)
+            for first in xrange(sourceIdBegin, sourceIdEnd+1, batchSize):
+                last = min(first+batchSize-1, sourceIdEnd)
+                cond = 's.sourceId BETWEEN %s AND %s'
+                for row in self._queryLineage(self._bulkQuery + cond,
+                                              (taskName, first, last), cond,
+                                              (first, last), timeRange):
+                    yield SourceProvenance.fromRow(row)
+
+    def _bulkTaskVersions(self, taskName, column, ids, batchSize, timeRange):
+        with self._session():
+            self._partitions.refresh(self._cursor)
+            batch = []
+            for theId in ids:
+                batch.append(theId)
+                if len(batch) == batchSize:
+                    for rec in self._taskVersionsForBatch(taskName, column,
+                                                          batch, timeRange):
+                        yield rec
+                    batch = []
+            if batch:
+                for rec in self._taskVersionsForBatch(taskName, column, batch,
+                                                      timeRange):
+                    yield rec
+
+    def _taskVersionsForBatch(self, taskName, column, batch, timeRange):
+        cond = '%s IN (%s)' % (column, ', '.join(['%s']*len(batch)))
+        rows = self._queryLineage(self._bulkQuery + cond, [taskName] + batch,
+                                  cond, batch, timeRange)
+        return [SourceProvenance.fromRow(row) for row in rows]
+
+    def _printTaskVersion(self, taskName, row, cnf):
+        (sourceId, theTime, theGroup) = row
         print "Source %s was processed through group %s using '%s' with sha: %s" % \
-            (sourceId, theGroup, taskName, row[0])
+            (sourceId, theGroup, taskName, cnf[1] if cnf else None)
@@ -0,0 +1,662 @@
+#!/usr/bin/env python
+
+"""
+Bulk export and import of provenance, e.g. to ship it between data centers or
+into a file repository (see Provenance.md section 3.7).
+
+The exporter streams the provenance graph of a time range (of task
+executions), or of a range of procHistoryIds, to a compact columnar file: task
+executions of that range, data blocks they read or wrote with their
+membership, lineage of exposures, and the configuration of tasks and nodes
+they refer to. Pipeline configurations are not exported.
+
+File format: magic, a JSON header, then one section per table. A section is
+a table name, its column names, and chunks of rows; a chunk is the number of
+rows followed by each of its columns, compressed separately. Integer and time
+columns are delta encoded (ids are exported in ascending order, so deltas are
+small), and runs of equal deltas (e.g. ids of one block, or every other id) are
+run-length encoded if that is shorter. End of an id range is stored as its
+length, and strings are dictionary encoded. Numbers are written as zigzag
+varints.
+
+The importer loads such a file into another database: tasks and nodes are
+matched by name, task configuration contents by hash, and task and node
+configurations by validity begin, missing ones are inserted. Data blocks and
+task executions get new ids (shifted past the ids used in the database); row
+ids of catalog tables are kept as they are. Importing the same range twice
+imports it twice.
+"""
+
+import argparse
+import calendar
+import json
+import time
+import zlib
+from datetime import datetime
+
+from provBackend import MySQLBackend, SQLiteBackend
+from testProvProto import makeBackend, mysqlCredentials
+
+_magic = 'PRVX\x01'
+
+# Columns are (name, kind): 'int' is delta encoded, 'int?' can be NULL, 'time'
+# is DATETIME delta encoded as seconds, 'str' is dictionary encoded, and
+# ('span', column) is stored as the difference to that column of the same row.
+_cnfSections = (
+    ('prv_Task', (('taskId', 'int'), ('taskName', 'str')), '''
+SELECT taskId, taskName FROM prv_Task ORDER BY taskId'''),
+    ('prv_Node', (('nodeId', 'int'), ('nodeName', 'str')), '''
+SELECT nodeId, nodeName FROM prv_Node ORDER BY nodeId'''),
+    ('prv_cnf_Node', (('nodeId', 'int'), ('validityBegin', 'time'),
+                      ('validityEnd', 'time'), ('ip', 'str'), ('os', 'str'),
+                      ('cores', 'int?'), ('ram', 'int?')), '''
+SELECT nodeId, validityBegin, validityEnd, ip, os, cores, ram
+FROM   prv_cnf_Node ORDER BY nodeId, validityBegin'''),
+    ('prv_cnf_TaskBody', (('taskBodyId', 'int'), ('cnfHash', 'str')), '''
+SELECT taskBodyId, cnfHash FROM prv_cnf_TaskBody ORDER BY taskBodyId'''),
+    ('prv_cnf_Task_KVParams', (('taskBodyId', 'int'), ('theKey', 'str'),
+                               ('theValue', 'str')), '''
+SELECT taskBodyId, theKey, theValue FROM prv_cnf_Task_KVParams
+ORDER  BY taskBodyId'''),
+    ('prv_cnf_Task_Columns', (('taskBodyId', 'int'), ('tcName', 'str')), '''
+SELECT taskBodyId, tcName FROM prv_cnf_Task_Columns ORDER BY taskBodyId'''),
+    ('prv_cnf_Task_Files', (('taskBodyId', 'int'), ('fileUrl', 'str')), '''
+SELECT taskBodyId, fileUrl FROM prv_cnf_Task_Files ORDER BY taskBodyId'''),
+    ('prv_cnf_Task', (('taskCnfId', 'int'), ('taskId', 'int?'),
+                      ('validityBegin', 'time'), ('validityEnd', 'time'),
+                      ('taskCnfVersion', 'int'), ('gitSHA', 'str'),
+                      ('taskBodyId', 'int')), '''
+SELECT taskCnfId, taskId, validityBegin, validityEnd, taskCnfVersion, gitSHA,
+       taskBodyId
+FROM   prv_cnf_Task ORDER BY taskCnfId'''))
+
+# task executions of the exported range
+_window = 'te.theTime >= %s AND te.theTime < %s'
+
+# data blocks read or written by these task executions
+_blockIds = '''
+SELECT l.blockId FROM prv_TaskExecutionToInputDataBlock l
+JOIN   prv_TaskExecution te ON te.taskExecId=l.taskExecId WHERE ''' + _window + '''
+UNION
+SELECT l.blockId FROM prv_TaskExecutionToOutputDataBlock l
+JOIN   prv_TaskExecution te ON te.taskExecId=l.taskExecId WHERE ''' + _window
+
+# (table, columns, query, number of times the range is used in the query)
+_dataSections = (
+    ('prv_DataBlock', (('blockId', 'int'), ('tableName', 'str')), '''
+SELECT blockId, tableName FROM prv_DataBlock
+WHERE  blockId IN (''' + _blockIds + ''') ORDER BY blockId''', 2),
+    ('prv_RowIdToDataBlock', (('blockId', 'int'), ('theId', 'int')), '''
+SELECT blockId, theId FROM prv_RowIdToDataBlock
+WHERE  blockId IN (''' + _blockIds + ''') ORDER BY blockId, theId''', 2),
+    ('prv_RowIdRangeToDataBlock', (('blockId', 'int'), ('idBegin', 'int'),
+                                   ('idEnd', ('span', 'idBegin'))), '''
+SELECT blockId, idBegin, idEnd FROM prv_RowIdRangeToDataBlock
+WHERE  blockId IN (''' + _blockIds + ''') ORDER BY blockId, idBegin''', 2),
+    ('prv_TaskExecution', (('taskExecId', 'int'), ('taskId', 'int'),
+                           ('nodeId', 'int'), ('theTime', 'time'),
+                           ('taskCnfVersion', 'int')), '''
+SELECT taskExecId, taskId, nodeId, theTime, taskCnfVersion
+FROM   prv_TaskExecution te WHERE ''' + _window + ''' ORDER BY taskExecId''', 1),
+    ('prv_TaskExecutionToInputDataBlock', (('taskExecId', 'int'),
+                                           ('blockId', 'int?')), '''
+SELECT l.taskExecId, l.blockId FROM prv_TaskExecutionToInputDataBlock l
+JOIN   prv_TaskExecution te ON te.taskExecId=l.taskExecId
+WHERE  ''' + _window + ''' ORDER BY l.taskExecId''', 1),
+    ('prv_TaskExecutionToOutputDataBlock', (('taskExecId', 'int'),
+                                            ('blockId', 'int?')), '''
+SELECT l.taskExecId, l.blockId FROM prv_TaskExecutionToOutputDataBlock l
+JOIN   prv_TaskExecution te ON te.taskExecId=l.taskExecId
+WHERE  ''' + _window + ''' ORDER BY l.taskExecId''', 1),
+    ('prv_ExposureLineage', (('blockId', 'int'), ('scExposureId', 'int'),
+                             ('taskExecId', 'int'), ('taskId', 'int'),
+                             ('nodeId', 'int'), ('taskCnfId', 'int'),
+                             ('theTime', 'time')), '''
+SELECT l.blockId, l.scExposureId, l.taskExecId, l.taskId, l.nodeId,
+       l.taskCnfId, l.theTime
+FROM   prv_ExposureLineage l
+JOIN   prv_TaskExecution te ON te.taskExecId=l.taskExecId
+WHERE  ''' + _window + ''' ORDER BY l.blockId, l.scExposureId, l.taskExecId''', 1))
+
+_minTime = '1000-01-01 00:00:00'
+_maxTime = '9999-12-31 23:59:59'
+
+# ----------------------------------------------------------------------------------
+
+class ProvExporter(object):
+    """
+    Exports provenance to a file, see the module description.
+    """
+    def __init__(self, backend):
+        """
+        @param backend  Storage backend (see provBackend)
+        """
+        self._backend = backend
+        self._conn = backend.connect()
+
+    def __del__(self):
+        self._conn.close()
+
+    def export(self, fileName, timeBegin=None, timeEnd=None,
+               procHistoryIds=None, chunkSize=65536):
+        """
+        Exports provenance of task executions from timeBegin (inclusive) to
+        timeEnd (exclusive), or of the procHistoryIds from procHistoryIds[0] to
+        procHistoryIds[1] (inclusive), i.e. from the time the first one was
+        created, to the time the one following the last one was created.
+        Returns {tableName: number of rows exported}.
+
+        @param fileName        Name of the file to write
+        @param timeBegin       'YYYY-MM-DD HH:MM:SS', defaults to the beginning
+        @param timeEnd         'YYYY-MM-DD HH:MM:SS', defaults to the end
+        @param procHistoryIds  (first, last) procHistoryId, instead of times
+        @param chunkSize       Number of rows per chunk
+        """
+        if procHistoryIds is not None:
+            (timeBegin, timeEnd) = self._procHistoryTimes(*procHistoryIds)
+        window = (timeBegin or _minTime, timeEnd or _maxTime)
+        header = {'timeBegin': window[0], 'timeEnd': window[1],
+                  'procHistoryIds': procHistoryIds, 'backend': self._backend.name,
+                  'exported': time.strftime('%Y-%m-%d %H:%M:%S')}
+        counts = {}
+        with open(fileName, 'wb') as f:
+            f.write(_magic)
+            _writeBytes(f, json.dumps(header))
+            for (table, columns, query) in _cnfSections:
+                counts[table] = self._exportSection(f, table, columns, query, (),
+                                                    chunkSize)
+            for (table, columns, query, nWindows) in _dataSections:
+                counts[table] = self._exportSection(f, table, columns, query,
+                                                    window * nWindows, chunkSize)
+            _writeBytes(f, '')
+        self._conn.rollback()
+        return counts
+
+    def _procHistoryTimes(self, first, last):
+        cursor = self._conn.cursor()
+        cursor.execute('''
+SELECT theTime FROM prv_ProcHistory WHERE procHistoryId=%s''', (first,))
+        timeBegin = cursor.fetchone()[0]
+        cursor.execute('''
+SELECT MIN(theTime) FROM prv_ProcHistory WHERE procHistoryId>%s''', (last,))
+        timeEnd = cursor.fetchone()[0]
+        cursor.close()
+        return (_timeStr(timeBegin), _timeStr(timeEnd) if timeEnd else None)
+
+    def _exportSection(self, f, table, columns, query, args, chunkSize):
+        _writeBytes(f, table)
+        _writeBytes(f, ','.join(name for (name, kind) in columns))
+        cursor = self._backend.streamingCursor(self._conn)
+        cursor.execute(query, args)
+        nRows = 0
+        while True:
+            rows = cursor.fetchmany(chunkSize)
+            if not rows:
+                break
+            nRows += len(rows)
+            _writeChunk(f, columns, rows)
+        cursor.close()
+        f.write(_varint(0))
+        return nRows
+
+
+class ProvImporter(object):
+    """
+    Imports provenance from a file written by ProvExporter, see the module
+    description.
+    """
+    def __init__(self, backend):
+        """
+        @param backend  Storage backend (see provBackend)
+        """
+        self._backend = backend
+        self._conn = backend.connect()
+        self._cursor = self._conn.cursor()
+
+    def __del__(self):
+        self._conn.close()
+
+    def load(self, fileName):
+        """
+        Loads a file in one transaction. Returns {tableName: number of rows
+        read}.
+
+        @param fileName  Name of the file to read
+        """
+        self._ids = {'prv_Task': {}, 'prv_Node': {}, 'prv_cnf_TaskBody': {},
+                     'prv_cnf_Task': {}}
+        self._newBodyIds = set()   # bodies (old ids) not known before
+        self._offsets = {}         # table --> id offset
+        counts = {}
+        try:
+            with open(fileName, 'rb') as f:
+                if f.read(len(_magic)) != _magic:
+                    raise ValueError('%s is not a provenance export' % fileName)
+                json.loads(_readBytes(f))
+                while True:
+                    table = _readBytes(f)
+                    if not table:
+                        break
+                    names = _readBytes(f).split(',')
+                    loader = getattr(self, '_load_' + table)
+                    counts[table] = 0
+                    for rows in _readChunks(f, _columnsOf(table, names)):
+                        loader(rows)
+                        counts[table] += len(rows)
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+        return counts
+
+    # -----   configuration: matched by name, hash or validity, or inserted   -----
+
+    def _load_prv_Task(self, rows):
+        self._mapByName(rows, 'prv_Task', 'taskId', 'taskName')
+
+    def _load_prv_Node(self, rows):
+        self._mapByName(rows, 'prv_Node', 'nodeId', 'nodeName')
+
+    def _load_prv_cnf_TaskBody(self, rows):
+        ids = self._ids['prv_cnf_TaskBody']
+        for (oldId, cnfHash) in rows:
+            self._cursor.execute('''
+SELECT taskBodyId FROM prv_cnf_TaskBody WHERE cnfHash=%s''', (cnfHash,))
+            row = self._cursor.fetchone()
+            if row is None:
+                self._cursor.execute('''
+INSERT INTO prv_cnf_TaskBody(cnfHash) VALUES (%s)''', (cnfHash,))
+                row = (self._cursor.lastrowid,)
+                self._newBodyIds.add(oldId)
+            ids[oldId] = row[0]
+
+    def _load_prv_cnf_Task_KVParams(self, rows):
+        self._loadBodyRows(rows, 'prv_cnf_Task_KVParams', 'theKey, theValue')
+
+    def _load_prv_cnf_Task_Columns(self, rows):
+        self._loadBodyRows(rows, 'prv_cnf_Task_Columns', 'tcName')
+
+    def _load_prv_cnf_Task_Files(self, rows):
+        self._loadBodyRows(rows, 'prv_cnf_Task_Files', 'fileUrl')
+
+    def _load_prv_cnf_Node(self, rows):
+        nodeIds = self._ids['prv_Node']
+        for row in rows:
+            self._mergeValidity('prv_cnf_Node', None,
+                                'nodeId, validityBegin, validityEnd, ip, os, '
+                                'cores, ram',
+                                (nodeIds[row[0]],) + row[1:])
+
+    def _load_prv_cnf_Task(self, rows):
+        (taskIds, bodyIds) = (self._ids['prv_Task'], self._ids['prv_cnf_TaskBody'])
+        for row in rows:
+            (taskCnfId, taskId, begin, end, version, gitSHA, taskBodyId) = row
+            self._ids['prv_cnf_Task'][taskCnfId] = self._mergeValidity(
+                'prv_cnf_Task', 'taskCnfId',
+                'taskId, validityBegin, validityEnd, taskCnfVersion, gitSHA, '
+                'taskBodyId',
+                (taskIds.get(taskId), begin, end, version, gitSHA,
+                 bodyIds[taskBodyId]))
+
+    def _mapByName(self, rows, table, idColumn, nameColumn):
+        ids = self._ids[table]
+        for (oldId, name) in rows:
+            self._cursor.execute('SELECT %s FROM %s WHERE %s=%%s' %
+                                 (idColumn, table, nameColumn), (name,))
+            row = self._cursor.fetchone()
+            if row is None:
+                self._cursor.execute('INSERT INTO %s(%s) VALUES (%%s)' %
+                                     (table, nameColumn), (name,))
+                row = (self._cursor.lastrowid,)
+            ids[oldId] = row[0]
+
+    def _loadBodyRows(self, rows, table, columns):
+        bodyIds = self._ids['prv_cnf_TaskBody']
+        rows = [(bodyIds[row[0]],) + row[1:] for row in rows
+                if row[0] in self._newBodyIds]
+        if rows:
+            self._cursor.executemany(
+                'INSERT INTO %s(taskBodyId, %s) VALUES (%s)' %
+                (table, columns, ', '.join(['%s'] * len(rows[0]))), rows)
+
+    def _mergeValidity(self, table, idColumn, columns, row):
+        """
+        Inserts a configuration row (the first column identifies the object, the
+        second and third are validityBegin and validityEnd), unless a row of the
+        same object with the same validityBegin exists: its validityEnd is then
+        set to the earlier of the two (a configuration that was superseded at
+        either side is superseded). Returns the id of the row if idColumn is
+        given.
+        """
+        names = [c.strip() for c in columns.split(',')]
+        self._cursor.execute('''
+SELECT %s, validityEnd FROM %s WHERE %s=%%s AND validityBegin=%%s''' %
+                             (idColumn or 'NULL', table, names[0]), row[:2])
+        existing = self._cursor.fetchone()
+        if existing is None:
+            self._cursor.execute('INSERT INTO %s(%s) VALUES (%s)' %
+                                 (table, columns, ', '.join(['%s'] * len(row))),
+                                 row)
+            return self._cursor.lastrowid
+        if row[2] < _timeStr(existing[1]):
+            self._cursor.execute('''
+UPDATE %s SET validityEnd=%%s WHERE %s=%%s AND validityBegin=%%s''' %
+                                 (table, names[0]), (row[2],) + tuple(row[:2]))
+        return existing[0]
+
+    # -----   data: new ids for blocks and task executions   -----
+
+    def _load_prv_DataBlock(self, rows):
+        offset = self._offset('prv_DataBlock', 'blockId', rows[0][0])
+        self._cursor.executemany('''
+INSERT INTO prv_DataBlock(blockId, tableName) VALUES (%s, %s)''',
+                                 [(blockId + offset, tableName)
+                                  for (blockId, tableName) in rows])
+
+    def _load_prv_RowIdToDataBlock(self, rows):
+        offset = self._offsets['prv_DataBlock']
+        self._cursor.executemany('''
+INSERT INTO prv_RowIdToDataBlock(blockId, theId) VALUES (%s, %s)''',
+                                 [(blockId + offset, theId)
+                                  for (blockId, theId) in rows])
+
+    def _load_prv_RowIdRangeToDataBlock(self, rows):
+        offset = self._offsets['prv_DataBlock']
+        self._cursor.executemany('''
+INSERT INTO prv_RowIdRangeToDataBlock(blockId, idBegin, idEnd)
+VALUES (%s, %s, %s)''', [(blockId + offset, idBegin, idEnd)
+                         for (blockId, idBegin, idEnd) in rows])
+
+    def _load_prv_TaskExecution(self, rows):
+        offset = self._offset('prv_TaskExecution', 'taskExecId', rows[0][0])
+        (taskIds, nodeIds) = (self._ids['prv_Task'], self._ids['prv_Node'])
+        self._cursor.executemany('''
+INSERT INTO prv_TaskExecution(taskExecId, taskId, nodeId, theTime, taskCnfVersion)
+VALUES (%s, %s, %s, %s, %s)''',
+            [(taskExecId + offset, taskIds[taskId], nodeIds[nodeId], theTime,
+              version)
+             for (taskExecId, taskId, nodeId, theTime, version) in rows])
+
+    def _load_prv_TaskExecutionToInputDataBlock(self, rows):
+        self._loadLinks(rows, 'prv_TaskExecutionToInputDataBlock')
+
+    def _load_prv_TaskExecutionToOutputDataBlock(self, rows):
+        self._loadLinks(rows, 'prv_TaskExecutionToOutputDataBlock')
+
+    def _loadLinks(self, rows, table):
+        teOffset = self._offsets['prv_TaskExecution']
+        blockOffset = self._offsets.get('prv_DataBlock', 0)
+        self._cursor.executemany(
+            'INSERT INTO %s(taskExecId, blockId) VALUES (%%s, %%s)' % table,
+            [(taskExecId + teOffset,
+              blockId + blockOffset if blockId is not None else None)
+             for (taskExecId, blockId) in rows])
+
+    def _load_prv_ExposureLineage(self, rows):
+        blockOffset = self._offsets['prv_DataBlock']
+        teOffset = self._offsets['prv_TaskExecution']
+        (taskIds, nodeIds, cnfIds) = (self._ids['prv_Task'],
+                                      self._ids['prv_Node'],
+                                      self._ids['prv_cnf_Task'])
+        self._cursor.executemany('''
+INSERT INTO prv_ExposureLineage(blockId, scExposureId, taskExecId, taskId, nodeId,
+                                taskCnfId, theTime)
+VALUES (%s, %s, %s, %s, %s, %s, %s)''',
+            [(blockId + blockOffset, scExposureId, taskExecId + teOffset,
+              taskIds[taskId], nodeIds[nodeId], cnfIds[taskCnfId], theTime)
+             for (blockId, scExposureId, taskExecId, taskId, nodeId, taskCnfId,
+                  theTime) in rows])
+
+    def _offset(self, table, idColumn, firstId):
+        """
+        Returns the offset added to ids of table: imported ids start right after
+        the largest id in the database. Ids are exported in ascending order, so
+        the first id of the first chunk is the smallest one.
+        """
+        if table not in self._offsets:
+            self._cursor.execute('SELECT MAX(%s) FROM %s' % (idColumn, table))
+            maxId = self._cursor.fetchone()[0] or 0
+            self._offsets[table] = maxId + 1 - firstId
+        return self._offsets[table]
+
+# ----------------------------------------------------------------------------------
+# -----                        columnar encoding                               -----
+# ----------------------------------------------------------------------------------
+
+def _columnsOf(table, names):
+    for sections in (_cnfSections, _dataSections):
+        for section in sections:
+            if section[0] == table:
+                columns = section[1]
+                if [name for (name, kind) in columns] != names:
+                    raise ValueError('unexpected columns of %s: %s' %
+                                     (table, ', '.join(names)))
+                return columns
+    raise ValueError('unexpected table: %s' % table)
+
+def _writeChunk(f, columns, rows):
+    f.write(_varint(len(rows)))
+    values = zip(*rows)
+    names = [name for (name, kind) in columns]
+    for (i, (name, kind)) in enumerate(columns):
+        if isinstance(kind, tuple):
+            base = values[names.index(kind[1])]
+            data = _encodeInts([v - b for (v, b) in zip(values[i], base)])
+        else:
+            data = _encoders[kind](values[i])
+        _writeBytes(f, zlib.compress(data))
+
+def _readChunks(f, columns):
+    """
+    Yields lists of rows, one per chunk of a section.
+    """
+    names = [name for (name, kind) in columns]
+    while True:
+        nRows = _readVarint(f)
+        if not nRows:
+            return
+        values = []
+        for (name, kind) in columns:
+            data = zlib.decompress(_readBytes(f))
+            if isinstance(kind, tuple):
+                base = values[names.index(kind[1])]
+                values.append([v + b for (v, b) in
+                               zip(_decodeInts(data, nRows), base)])
+            else:
+                values.append(_decoders[kind](data, nRows))
+        yield zip(*values)
+
+def _encodeInts(values):
+    """
+    Encodes deltas, either one by one (mode 0), or as (delta, run length)
+    pairs (mode 1), whichever is shorter. The mode is the first byte.
+    """
+    (plain, runs) = (bytearray('\x00'), bytearray('\x01'))
+    (prev, run, runDelta) = (0, 0, None)
+    for v in values:
+        d = v - prev
+        prev = v
+        z = (d << 1) if d >= 0 else ((-d << 1) - 1)
+        _putVarint(plain, z)
+        if z == runDelta:
+            run += 1
+        else:
+            if run:
+                _putVarint(runs, runDelta)
+                _putVarint(runs, run)
+            (runDelta, run) = (z, 1)
+    if run:
+        _putVarint(runs, runDelta)
+        _putVarint(runs, run)
+    return str(runs if len(runs) < len(plain) else plain)
+
+def _decodeInts(data, n):
+    values = []
+    prev = 0
+    data = bytearray(data)
+    pos = 1
+    if data[0] == 1:
+        while len(values) < n:
+            (z, pos) = _getVarint(data, pos)
+            (run, pos) = _getVarint(data, pos)
+            d = (z >> 1) if not z & 1 else -((z + 1) >> 1)
+            if d:
+                values.extend(xrange(prev + d, prev + d * (run + 1), d))
+            else:
+                values.extend([prev] * run)
+            prev += d * run
+        return values
+    for i in xrange(n):
+        (z, pos) = _getVarint(data, pos)
+        prev += (z >> 1) if not z & 1 else -((z + 1) >> 1)
+        values.append(prev)
+    return values
+
+def _encodeNullableInts(values):
+    nulls = ''.join('\x01' if v is None else '\x00' for v in values)
+    return nulls + _encodeInts([v for v in values if v is not None])
+
+def _decodeNullableInts(data, n):
+    nulls = data[:n]
+    ints = iter(_decodeInts(data[n:], n - nulls.count('\x01')))
+    return [None if isNull == '\x01' else ints.next() for isNull in nulls]
+
+def _encodeTimes(values):
+    return _encodeInts([_epoch(v) for v in values])
+
+def _decodeTimes(data, n):
+    return [time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t))
+            for t in _decodeInts(data, n)]
+
+def _encodeStrings(values):
+    codes = {}
+    out = bytearray()
+    for v in values:
+        if v not in codes:
+            codes[v] = len(codes)
+    _putVarint(out, len(codes))
+    for (v, code) in sorted(codes.items(), key=lambda item: item[1]):
+        if v is None:
+            _putVarint(out, 0)
+        else:
+            v = v.encode('utf-8') if isinstance(v, unicode) else v
+            _putVarint(out, len(v) + 1)
+            out.extend(v)
+    for v in values:
+        _putVarint(out, codes[v])
+    return str(out)
+
+def _decodeStrings(data, n):
+    data = bytearray(data)
+    (nCodes, pos) = _getVarint(data, 0)
+    strings = []
+    for i in xrange(nCodes):
+        (length, pos) = _getVarint(data, pos)
+        if length == 0:
+            strings.append(None)
+        else:
+            strings.append(str(data[pos:pos+length-1]).decode('utf-8'))
+            pos += length - 1
+    values = []
+    for i in xrange(n):
+        (code, pos) = _getVarint(data, pos)
+        values.append(strings[code])
+    return values
+
+_encoders = {'int': _encodeInts, 'int?': _encodeNullableInts,
+             'time': _encodeTimes, 'str': _encodeStrings}
+_decoders = {'int': _decodeInts, 'int?': _decodeNullableInts,
+             'time': _decodeTimes, 'str': _decodeStrings}
+
+def _putVarint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _getVarint(data, pos):
+    (n, shift) = (0, 0)
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return (n, pos)
+        shift += 7
+
+def _varint(n):
+    out = bytearray()
+    _putVarint(out, n)
+    return str(out)
+
+def _readVarint(f):
+    (n, shift) = (0, 0)
+    while True:
+        c = f.read(1)
+        if not c:
+            raise ValueError('unexpected end of provenance export')
+        b = ord(c)
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n
+        shift += 7
+
+def _writeBytes(f, data):
+    f.write(_varint(len(data)))
+    f.write(data)
+
+def _readBytes(f):
+    n = _readVarint(f)
+    data = f.read(n)
+    if len(data) != n:
+        raise ValueError('unexpected end of provenance export')
+    return data
+
+def _epoch(t):
+    if not isinstance(t, datetime):
+        t = datetime.strptime(t, '%Y-%m-%d %H:%M:%S')
+    return calendar.timegm(t.timetuple())
+
+def _timeStr(t):
+    if isinstance(t, datetime):
+        return t.strftime('%Y-%m-%d %H:%M:%S')
+    return t
+
+# ----------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Export provenance to a file, or import it from a file.')
+    parser.add_argument('command', choices=('export', 'import'))
+    parser.add_argument('file', help='export file')
+    parser.add_argument('--sqlite', metavar='FILE',
+                        help='SQLite database (default: MySQL, see '
+                        'testProvProto.py)')
+    parser.add_argument('--create', action='store_true',
+                        help='import into a new database')
+    parser.add_argument('--from', dest='timeBegin', metavar='TIME',
+                        help="export task executions since 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_argument('--to', dest='timeEnd', metavar='TIME',
+                        help="export task executions before 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_argument('--proc-history', type=int, nargs=2,
+                        metavar=('FIRST', 'LAST'),
+                        help='export the range of procHistoryIds')
+    args = parser.parse_args()
+    if args.create:
+        backend = makeBackend(args.sqlite)
+    elif args.sqlite:
+        backend = SQLiteBackend(args.sqlite)
+    else:
+        backend = MySQLBackend(**mysqlCredentials)
+    start = time.time()
+    if args.command == 'export':
+        counts = ProvExporter(backend).export(args.file, args.timeBegin,
+                                              args.timeEnd, args.proc_history)
+    else:
+        counts = ProvImporter(backend).load(args.file)
+    for (table, n) in sorted(counts.items()):
+        print '%-35s %10d rows' % (table, n)
+    print '%s took %.2f s' % (args.command, time.time() - start)
+
+if __name__ == "__main__":
+    main()
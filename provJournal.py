@@ -0,0 +1,639 @@
+#!/usr/bin/env python
+
+"""
+Write-ahead journal of provenance, for capture on worker nodes that does not
+wait for the database.
+
+ProvJournal has the provenance writing API of ProvProto (data blocks, their
+row ids, task executions, lineage, task configuration changes), but calls only
+append an event to a memory mapped segment file in a local directory, which
+takes microseconds. Events are grouped into transactions by commit(). Data
+written into the mapping survives a crash of the process (it is in the page
+cache of the kernel), and is synced to disk in batches: every syncEvery groups
+or syncInterval seconds, whichever comes first, so only the last batch can be
+lost if the node itself goes down.
+
+JournalLoader loads complete groups into the central prv_* tables, one
+transaction per group, in which it also records how far it got
+(prv_JournalLoad). That makes loading idempotent: a loader that is restarted,
+or runs again after a crash, continues right after the last group it
+committed, and no group is loaded twice. Loaded segments are deleted.
+
+Each journal has a random id, which is written into the header of its
+segments. The producer binds the journal to the database it commits results
+to (JournalLoader.bind), and a loader only loads segments of the journal bound
+to its database: groups of a journal that was started for another run, or
+another database, are never loaded. Loading is also limited by the mark the
+journal was bound with, whichever loader does it. Starting a journal anew
+(truncate(None)) drops all its groups, and gives it a new id.
+
+Segment files ("segment-NNNNNNNN.prvj") start with a magic number, a version
+and the id of the journal, followed by records: (length, crc32) of the
+payload, then the payload, a marshalled (name, theTime, args) event. A group
+ends with a "commit" event.
+The header of a record is written after its payload, so a reader never sees a
+record that is only partially written; a record of length zero is the end of
+the data written so far, a special length tells that the journal continues in
+the next segment. When a journal is opened again, whatever follows the last
+complete group is dropped.
+
+Data blocks get ids local to the journal (the position of the event that
+registered them), which the loader maps to the ids given by the database. A
+data block must be registered, filled, closed and have its lineage
+registered in one group.
+
+Example:
+  ./provJournal.py load /scratch/provJournal --sqlite provProto.db
+  ./provJournal.py load /scratch/provJournal --sqlite provProto.db --follow 1
+"""
+
+import argparse
+import errno
+import fcntl
+import marshal
+import mmap
+import os
+import random
+import re
+import socket
+import struct
+import threading
+import time
+import zlib
+
+from provProto import ProvProto
+from task import Task
+
+_magic = 'PRVJ'
+_version = 2
+_segmentHeader = struct.Struct('<4sIQ')    # magic, version, journal id
+_recordHeader = struct.Struct('<II')       # length, crc32 of the payload
+_nextSegment = 0xffffffff                  # length: continued in the next one
+_zeros = '\0' * (1 << 20)
+
+
+class ProvJournal(object):
+    """
+    Appends provenance events to a journal in a local directory, see the module
+    description. Methods take the same arguments as those of ProvProto,
+    including the cursor, which is ignored, so that this class can be used in
+    place of ProvProto for writing provenance of data blocks, like
+    AsyncProvProto. Times of the calls are taken from clock (a ProvProto) when
+    they are made. registerDataBlock returns the id of the block in the
+    journal, the other methods return nothing. journalId is the id of the
+    journal, see the module description.
+
+    Only one ProvJournal can write to a directory at a time.
+    """
+    def __init__(self, directory, clock, segmentSize=64*1024*1024, syncEvery=100,
+                 syncInterval=1.0):
+        """
+        @param directory     Directory of the journal, created if needed
+        @param clock         ProvProto that keeps the current time
+        @param segmentSize   Size of a segment file in bytes
+        @param syncEvery     Number of committed groups after which the journal
+                             is synced to disk
+        @param syncInterval  Seconds after which committed groups are synced to
+                             disk, checked on commit
+        """
+        self._dir = directory
+        self._clock = clock
+        self._segmentSize = segmentSize
+        self._syncEvery = syncEvery
+        self._syncInterval = syncInterval
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lockFd = os.open(os.path.join(directory, 'writer.lock'),
+                               os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            fcntl.flock(self._lockFd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            os.close(self._lockFd)
+            raise RuntimeError('journal %s is open by another writer' % directory)
+        (self._fd, self._mm) = (None, None)
+        self.journalId = None
+        self._nUnsynced = 0
+        self._lastSync = time.time()
+        self._recover()
+
+    def registerDataBlock(self, cursor, tableName):
+        # the position no other event starts at
+        blockId = self._segmentNo << 32 | self._offset
+        self._append('registerDataBlock', (blockId, tableName))
+        return blockId
+
+    def registerRowIdInBlock(self, cursor, blockId, theId):
+        self._append('registerRowIdInBlock', (blockId, theId))
+
+    def registerRowIdRangeInBlock(self, cursor, blockId, idBegin, idEnd):
+        self._append('registerRowIdRangeInBlock', (blockId, idBegin, idEnd))
+
+    def closeDataBlock(self, cursor, blockId):
+        self._append('closeDataBlock', (blockId,))
+
+    def registerTaskExecution(self, cursor, taskName, nodeId, blockId,
+                              outputBlockId=None):
+        self._append('registerTaskExecution',
+                     (taskName, nodeId, blockId, outputBlockId))
+
+    def registerExposureLineage(self, cursor, blockId):
+        self._append('registerExposureLineage', (blockId,))
+
+    def updateTaskConfig(self, cursor, task):
+        self._append('updateTaskConfig',
+                     (task.name, task.gitSHA, sorted(task.paramKVDict.items()),
+                      task.tCols, task.files))
+
+    def createProcHistoryId(self, cursor):
+        self._append('createProcHistoryId', ())
+
+    def flush(self, cursor):
+        self._append('flush', ())
+
+    def commit(self):
+        """
+        Ends the group of events appended since the previous commit() or
+        rollback(): it is loaded in one transaction. Syncs the journal if
+        syncEvery groups were committed since the last sync, or syncInterval
+        passed. Returns the position (segmentNo, offset) right after the group.
+        """
+        self._append('commit', ())
+        self._groupStart = (self._segmentNo, self._offset)
+        self._nUnsynced += 1
+        if self._nUnsynced >= self._syncEvery or \
+                time.time() - self._lastSync >= self._syncInterval:
+            self.sync()
+        return self._groupStart
+
+    def rollback(self):
+        """
+        Drops events appended since the previous commit() or rollback().
+        """
+        if self._groupStart != (self._segmentNo, self._offset):
+            self._truncate(self._groupStart, (self._segmentNo, self._offset))
+
+    def truncate(self, position):
+        """
+        Drops all groups committed after position (see commit), e.g. groups of
+        data blocks whose results were not committed before a crash, and which
+        are going to be processed again. If position is None, drops all groups,
+        and starts the journal anew, under a new id.
+        """
+        self.rollback()
+        if position is None:
+            self._closeSegment()
+            for n in _segmentNumbers(self._dir):
+                os.remove(_segmentPath(self._dir, n))
+            self._start()
+        else:
+            self._truncate(position, (self._segmentNo, self._offset))
+
+    def position(self):
+        """
+        Returns the position right after the last committed group.
+        """
+        return self._groupStart
+
+    def sync(self):
+        """
+        Writes all committed groups to disk.
+        """
+        self._mm.flush()
+        self._nUnsynced = 0
+        self._lastSync = time.time()
+
+    def close(self):
+        """
+        Drops events that were not committed, syncs and closes the journal.
+        """
+        self.rollback()
+        self.sync()
+        self._closeSegment()
+        os.close(self._lockFd)
+
+    def _append(self, name, args):
+        payload = marshal.dumps((name, self._clock.getCurrentTime(), args), 2)
+        size = _recordHeader.size + len(payload)
+        if self._offset + size + _recordHeader.size > self._segmentSize:
+            if _segmentHeader.size + size + _recordHeader.size > self._segmentSize:
+                raise ValueError('event larger than a journal segment')
+            _recordHeader.pack_into(self._mm, self._offset, _nextSegment, 0)
+            self._openSegment(self._segmentNo + 1)
+            self._offset = _segmentHeader.size
+        start = self._offset + _recordHeader.size
+        self._mm[start:start + len(payload)] = payload
+        _recordHeader.pack_into(self._mm, self._offset, len(payload),
+                                zlib.crc32(payload) & 0xffffffff)
+        self._offset += size
+
+    def _start(self):
+        self.journalId = _newJournalId()
+        self._openSegment(1)
+        self._offset = _segmentHeader.size
+        self._groupStart = (1, self._offset)
+
+    def _recover(self):
+        segments = _segmentNumbers(self._dir)
+        if not segments:
+            self._start()
+            return
+        self.journalId = _journalIdOf(_segmentPath(self._dir, segments[0]))
+        (lastCommit, end) = ((segments[0], _segmentHeader.size), None)
+        for (event, end) in _events(self._dir, lastCommit):
+            if event[0] == 'commit':
+                lastCommit = end
+        self._truncate(lastCommit, end or lastCommit)
+
+    def _truncate(self, position, end):
+        """
+        Drops events from position to end, the record that may be partially
+        written at end, and all segments after the one of position.
+        """
+        (segmentNo, offset) = position
+        for n in _segmentNumbers(self._dir):
+            if n > segmentNo:
+                if n == getattr(self, '_segmentNo', None):
+                    self._closeSegment()
+                os.remove(_segmentPath(self._dir, n))
+        if getattr(self, '_segmentNo', None) != segmentNo or self._mm is None:
+            self._openSegment(segmentNo)
+        if end[0] != segmentNo:
+            stop = self._segmentSize
+        else:
+            stop = end[1] + _recordHeader.size
+            if stop <= self._segmentSize:
+                length = _recordHeader.unpack_from(self._mm, end[1])[0]
+                if length != _nextSegment:
+                    stop += length
+            stop = min(stop, self._segmentSize)
+        for start in xrange(offset, stop, len(_zeros)):
+            n = min(len(_zeros), stop - start)
+            self._mm[start:start + n] = _zeros[:n]
+        self._offset = offset
+        self._groupStart = position
+
+    def _openSegment(self, segmentNo):
+        self._closeSegment()
+        path = _segmentPath(self._dir, segmentNo)
+        created = not os.path.exists(path)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+        if created:
+            os.ftruncate(self._fd, self._segmentSize)
+        else:
+            self._segmentSize = os.fstat(self._fd).st_size
+        self._mm = mmap.mmap(self._fd, self._segmentSize)
+        if created:
+            _segmentHeader.pack_into(self._mm, 0, _magic, _version,
+                                     self.journalId)
+            self._mm.flush()
+            dirFd = os.open(self._dir, os.O_RDONLY)
+            try:
+                os.fsync(dirFd)
+            finally:
+                os.close(dirFd)
+        elif _segmentHeader.unpack_from(self._mm, 0) != \
+                (_magic, _version, self.journalId):
+            raise ValueError('%s is not a segment of provenance journal %d'
+                             % (path, self.journalId))
+        self._segmentNo = segmentNo
+
+    def _closeSegment(self):
+        if self._mm is not None:
+            # the segment is complete, or the journal is closed
+            self._mm.flush()
+            self._mm.close()
+            os.close(self._fd)
+            (self._fd, self._mm) = (None, None)
+
+
+class JournalLoader(object):
+    """
+    Loads complete groups of events from a journal (see ProvJournal) into the
+    database, each in its own transaction together with the position it got
+    to, either when asked (loadAvailable) or continuously, from a background
+    thread (start, stop). See the module description.
+
+    Only the journal bound to the database under the name of the loader (see
+    bind) is loaded. If it was bound with a mark name, only groups up to the
+    position saved under that name by saveMark are loaded: the producer saves
+    it in the transaction that commits results of the data blocks the groups
+    belong to, so provenance of blocks whose results were rolled back is never
+    loaded. The mark is recorded with the binding, so that it also limits
+    loaders started without it (e.g. "provJournal.py load").
+    """
+    # positions of arguments of events that are ids of data blocks
+    _blockArgs = {'registerRowIdInBlock': (0,),
+                  'registerRowIdRangeInBlock': (0,),
+                  'closeDataBlock': (0,),
+                  'registerTaskExecution': (2, 3),
+                  'registerExposureLineage': (0,)}
+
+    def __init__(self, backend, directory, name=None, markName=None,
+                 bufferSize=1000, notifier=None):
+        """
+        @param backend     Storage backend (see provBackend)
+        @param directory   Directory of the journal
+        @param name        Name of the journal in prv_JournalLoad, defaults to
+                           the host name and the path of the directory
+        @param markName    Name of the mark that limits loading of a journal
+                           bound by this loader, or None
+        @param bufferSize  Buffer size of the ProvProto used for loading
+        @param notifier    Change notifier configuration changes are published
+                           through, or None
+        """
+        self._backend = backend
+        self._dir = directory
+        self._name = name or '%s:%s' % (socket.gethostname(),
+                                        os.path.abspath(directory))
+        self._markName = markName
+        self._pp = ProvProto(bufferSize, notifier)
+        self._conn = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self.nGroups = 0     # groups loaded so far
+        self.error = None    # last error of the background thread
+
+    def journalId(self):
+        """
+        Returns the id of the journal bound to the database under the name of
+        this loader, or None.
+        """
+        cursor = self._cursor()
+        cursor.execute(
+            'SELECT journalId FROM prv_JournalLoad WHERE journalName=%s',
+            (self._name,))
+        row = cursor.fetchone()
+        self._conn.rollback()
+        return None if row is None else int(row[0])
+
+    def bind(self, journalId, position):
+        """
+        Binds journal journalId to the database, e.g. after it was started
+        anew (see ProvJournal.truncate): loading starts at position, and with
+        markName, it is limited by that mark from now on, which is set to
+        position, so that nothing is loaded until the producer saves a mark.
+        Whatever was loaded of the journal bound before is forgotten.
+        """
+        cursor = self._cursor()
+        try:
+            cursor.execute('''
+REPLACE INTO prv_JournalLoad(journalName, journalId, markName, segmentNo,
+                             segmentOffset)
+VALUES (%s, %s, %s, %s, %s)''', (self._name, journalId, self._markName) +
+                           tuple(position))
+            if self._markName:
+                saveMark(cursor, self._markName, position)
+            self._conn.commit()
+        except:
+            self._conn.rollback()
+            raise
+
+    def loadAvailable(self):
+        """
+        Loads all complete groups that were not loaded yet, and deletes segments
+        that were loaded completely. Returns the number of groups loaded.
+        """
+        cursor = self._cursor()
+        cursor.execute('''
+SELECT journalId, markName, segmentNo, segmentOffset FROM prv_JournalLoad
+WHERE  journalName=%s''', (self._name,))
+        row = cursor.fetchone()
+        if row is None:
+            # not bound to this database
+            self._conn.rollback()
+            return 0
+        (journalId, markName) = (int(row[0]), row[1])
+        position = (int(row[2]), int(row[3]))
+        limit = readMark(cursor, markName) if markName else None
+        self._conn.rollback()
+        nGroups = 0
+        for (events, end) in _groups(self._dir, position, journalId):
+            if markName and (limit is None or end > limit):
+                break
+            self._load(cursor, events, end)
+            position = end
+            nGroups += 1
+        # segments before position were read through, they are of the journal
+        for n in _segmentNumbers(self._dir) if nGroups else ():
+            if n < position[0]:
+                os.remove(_segmentPath(self._dir, n))
+        self.nGroups += nGroups
+        return nGroups
+
+    def start(self, interval=0.5):
+        """
+        Starts loading in a background thread, every interval seconds.
+        """
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,),
+                                        name='JournalLoader')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread, and loads what is left. Returns the
+        number of groups loaded in total.
+        """
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+        self.loadAvailable()
+        return self.nGroups
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _cursor(self):
+        if self._conn is None:
+            self._conn = self._backend.connect()
+        return self._conn.cursor()
+
+    def _run(self, interval):
+        while not self._stopping.wait(interval):
+            try:
+                self.loadAvailable()
+            except self._backend.Error as e:
+                # tried again next time
+                self.error = e
+
+    def _load(self, cursor, events, end):
+        (conn, pp) = (self._conn, self._pp)
+        blocks = {}   # blockId in the journal --> blockId in the database
+        try:
+            for (name, theTime, args) in events:
+                pp.setCurrentTime(theTime)
+                if name == 'registerDataBlock':
+                    blocks[args[0]] = pp.registerDataBlock(cursor, args[1])
+                elif name == 'updateTaskConfig':
+                    pp.updateTaskConfig(cursor, Task(*args))
+                else:
+                    args = list(args)
+                    for i in self._blockArgs.get(name, ()):
+                        if args[i] is not None:
+                            args[i] = blocks[args[i]]
+                    getattr(pp, name)(cursor, *args)
+            pp.flush(cursor)
+            cursor.execute('''
+UPDATE prv_JournalLoad SET segmentNo=%s, segmentOffset=%s
+WHERE  journalName=%s''', end + (self._name,))
+            conn.commit()
+        except KeyError as e:
+            conn.rollback()
+            pp.clearBuffers()
+            pp.invalidateCaches()
+            raise self._backend.Error('data block %s of the journal was not '
+                                      'registered in the same group' % e.args[0])
+        except:
+            conn.rollback()
+            pp.clearBuffers()
+            pp.invalidateCaches()
+            raise
+        pp.publishChanges()
+
+# ----------------------------------------------------------------------------------
+
+def saveMark(cursor, markName, position):
+    """
+    Records that groups up to position (see ProvJournal.commit) may be loaded.
+    It should be called in the transaction that commits results of the data
+    blocks of these groups.
+
+    @param cursor    Open, valid database cursor
+    @param markName  Name of the mark (prv_HighWaterMark.streamName)
+    @param position  (segmentNo, offset)
+    """
+    cursor.execute('''
+        REPLACE INTO prv_HighWaterMark(streamName, lastId)
+        VALUES (%s, %s)''', (markName, position[0] << 32 | position[1]))
+
+def readMark(cursor, markName):
+    """
+    Returns the position saved by saveMark, or None.
+    """
+    cursor.execute('SELECT lastId FROM prv_HighWaterMark WHERE streamName=%s',
+                   (markName,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return (int(row[0] >> 32), int(row[0] & 0xffffffff))
+
+def _newJournalId():
+    return random.SystemRandom().getrandbits(63)
+
+def _journalIdOf(path):
+    with open(path, 'rb') as f:
+        header = f.read(_segmentHeader.size)
+    if len(header) != _segmentHeader.size or \
+            _segmentHeader.unpack(header)[:2] != (_magic, _version):
+        raise ValueError('%s is not a provenance journal segment' % path)
+    return _segmentHeader.unpack(header)[2]
+
+def _segmentPath(directory, segmentNo):
+    return os.path.join(directory, 'segment-%08d.prvj' % segmentNo)
+
+def _segmentNumbers(directory):
+    try:
+        names = os.listdir(directory)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return []
+        raise
+    return sorted(int(m.group(1)) for m in
+                  (re.match(r'segment-(\d+)\.prvj$', name) for name in names) if m)
+
+def _events(directory, position, journalId=None):
+    """
+    Yields (event, position after it) for each complete event from position on,
+    stopping at a segment that is not of journal journalId (if not None).
+    """
+    (segmentNo, offset) = position
+    while True:
+        path = _segmentPath(directory, segmentNo)
+        try:
+            f = open(path, 'rb')
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        try:
+            if journalId is not None and \
+                    _segmentHeader.unpack_from(mm, 0)[2] != journalId:
+                return
+            while offset + _recordHeader.size <= len(mm):
+                (length, crc) = _recordHeader.unpack_from(mm, offset)
+                if length == _nextSegment:
+                    break
+                start = offset + _recordHeader.size
+                if length == 0 or start + length > len(mm):
+                    return
+                payload = mm[start:start + length]
+                if zlib.crc32(payload) & 0xffffffff != crc:
+                    # being written
+                    return
+                offset = start + length
+                yield (marshal.loads(payload), (segmentNo, offset))
+            else:
+                return
+        finally:
+            mm.close()
+        (segmentNo, offset) = (segmentNo + 1, _segmentHeader.size)
+
+def _groups(directory, position, journalId):
+    """
+    Yields (events, position after the group) for each complete group of journal
+    journalId from position on.
+    """
+    events = []
+    for (event, end) in _events(directory, position, journalId):
+        if event[0] == 'commit':
+            yield (events, end)
+            events = []
+        else:
+            events.append(event)
+
+# ----------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Load a provenance journal into the database.')
+    parser.add_argument('command', choices=('load',))
+    parser.add_argument('directory', help='directory of the journal')
+    parser.add_argument('--sqlite', metavar='FILE',
+                        help='SQLite database (default: MySQL, see '
+                        'testProvProto.py)')
+    parser.add_argument('--name', help='name of the journal (default: host name '
+                        'and directory)')
+    parser.add_argument('--follow', type=float, metavar='SECONDS',
+                        help='keep loading every SECONDS, until interrupted')
+    args = parser.parse_args()
+    if args.sqlite:
+        from provBackend import SQLiteBackend
+        backend = SQLiteBackend(args.sqlite)
+    else:
+        from provBackend import MySQLBackend
+        from testProvProto import mysqlCredentials
+        backend = MySQLBackend(**mysqlCredentials)
+    loader = JournalLoader(backend, args.directory, args.name)
+    try:
+        while True:
+            n = loader.loadAvailable()
+            if n:
+                print 'loaded %d groups' % n
+            if args.follow is None:
+                break
+            time.sleep(args.follow)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loader.close()
+
+if __name__ == "__main__":
+    main()
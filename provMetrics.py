@@ -0,0 +1,405 @@
+import cProfile
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from contextlib import contextmanager
+
+
+# ----------------------------------------------------------------------------------
+
+class Histogram(object):
+    """
+    Histogram with fixed buckets, in the Prometheus style: counts per bucket,
+    total count and sum. The default buckets are roughly logarithmic, suitable
+    for latencies in seconds.
+    """
+    secondBounds = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                    0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    countBounds = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000,
+                   20000, 50000, 100000)
+
+    def __init__(self, bounds=None):
+        self.bounds = tuple(bounds or self.secondBounds)
+        self.counts = [0] * (len(self.bounds) + 1)   # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        self.counts = [a + b for (a, b) in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """
+        Returns the upper bound of the bucket holding the q-quantile.
+        """
+        rank = q * self.count
+        seen = 0
+        for (n, bound) in zip(self.counts, self.bounds + (float('inf'),)):
+            seen += n
+            if seen >= rank and seen > 0:
+                return bound
+        return None
+
+
+class Metrics(object):
+    """
+    Registry of counters and latency histograms, identified by a name and
+    labels (keyword arguments), e.g. metrics.inc('sql_statements_total',
+    kind='INSERT', target='provenance').
+
+    Metrics can be exported as a JSON or Prometheus text file (write), or
+    served over HTTP in the Prometheus text format (serve). Metrics collected
+    in other processes are added through snapshot() / merge().
+
+    If profileDir is given, profile() runs blocks of code under cProfile and
+    saves their statistics there, one file per block.
+    """
+    def __init__(self, profileDir=None):
+        """
+        @param profileDir  Directory where profiles are saved, or None to
+                           disable profiling
+        """
+        self.profileDir = profileDir
+        self._lock = threading.Lock()
+        self._counters = {}     # (name, labels) --> value
+        self._histograms = {}   # (name, labels) --> Histogram
+
+    def __getstate__(self):
+        return {'profileDir': self.profileDir}
+
+    def __setstate__(self, state):
+        self.__init__(state['profileDir'])
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, n=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def observe(self, name, value, bounds=None, **labels):
+        """
+        Adds value to histogram name. Buckets (bounds) are set when the
+        histogram is created, see Histogram.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(bounds)
+            self._histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observes how long the enclosed block takes in histogram name.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def total(self, name):
+        """
+        Returns the sum of counter name over all labels.
+        """
+        with self._lock:
+            return sum(v for ((n, l), v) in self._counters.items() if n == name)
+
+    def histogram(self, name, **labels):
+        return self._histograms.get(self._key(name, labels))
+
+    def startProfile(self):
+        """
+        Starts profiling with cProfile, if profiling is enabled. Returns the
+        profiler (None if profiling is disabled), to be passed to saveProfile.
+        """
+        if self.profileDir is None:
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def saveProfile(self, profiler, name):
+        """
+        Stops profiling, and saves the statistics in profileDir/name.prof (see
+        the pstats module).
+        """
+        if profiler is None:
+            return
+        profiler.disable()
+        if not os.path.isdir(self.profileDir):
+            os.makedirs(self.profileDir)
+        profiler.dump_stats(os.path.join(self.profileDir, name + '.prof'))
+
+    @contextmanager
+    def profile(self, name):
+        """
+        Profiles the enclosed block, if profiling is enabled (see saveProfile).
+        """
+        profiler = self.startProfile()
+        try:
+            yield
+        finally:
+            self.saveProfile(profiler, name)
+
+    def snapshot(self, reset=False):
+        """
+        Returns all metrics collected so far in a picklable form, and forgets
+        them if reset is True.
+        """
+        with self._lock:
+            snap = (dict(self._counters),
+                    dict((k, (h.bounds, h.counts, h.count, h.sum))
+                         for (k, h) in self._histograms.items()))
+            if reset:
+                self._counters = {}
+                self._histograms = {}
+        return snap
+
+    def merge(self, snap):
+        """
+        Adds metrics returned by snapshot() (e.g. in a worker process).
+        """
+        (counters, histograms) = snap
+        with self._lock:
+            for (key, value) in counters.items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for (key, (bounds, counts, count, total)) in histograms.items():
+                h = Histogram(bounds)
+                (h.counts, h.count, h.sum) = (list(counts), count, total)
+                if key in self._histograms:
+                    self._histograms[key].merge(h)
+                else:
+                    self._histograms[key] = h
+
+    # ------------------------------------------------------------------------------
+
+    def toPrometheus(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        def fmt(labels, extra=()):
+            labels = tuple(labels) + tuple(extra)
+            if not labels:
+                return ''
+            return '{%s}' % ','.join('%s="%s"' % (k, v) for (k, v) in labels)
+        lines = []
+        with self._lock:
+            for name in sorted(set(k[0] for k in self._counters)):
+                lines.append('# TYPE %s counter' % name)
+                for ((n, labels), value) in sorted(self._counters.items()):
+                    if n == name:
+                        lines.append('%s%s %s' % (name, fmt(labels), value))
+            for name in sorted(set(k[0] for k in self._histograms)):
+                lines.append('# TYPE %s histogram' % name)
+                for ((n, labels), h) in sorted(self._histograms.items()):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for (bound, count) in zip(h.bounds + ('+Inf',), h.counts):
+                        cumulative += count
+                        lines.append('%s_bucket%s %d' % (
+                            name, fmt(labels, (('le', bound),)), cumulative))
+                    lines.append('%s_sum%s %.9f' % (name, fmt(labels), h.sum))
+                    lines.append('%s_count%s %d' % (name, fmt(labels), h.count))
+        return '\n'.join(lines) + '\n'
+
+    def toJSON(self):
+        """
+        Returns all metrics as a JSON string.
+        """
+        with self._lock:
+            return json.dumps({
+                'counters': [dict(name=n, labels=dict(l), value=v)
+                             for ((n, l), v) in sorted(self._counters.items())],
+                'histograms': [dict(name=n, labels=dict(l), count=h.count,
+                                    sum=h.sum, bounds=list(h.bounds),
+                                    counts=h.counts)
+                               for ((n, l), h) in sorted(self._histograms.items())]},
+                indent=1)
+
+    def write(self, path):
+        """
+        Writes all metrics to a file: JSON if the name ends with .json,
+        Prometheus text format otherwise.
+        """
+        with open(path, 'w') as f:
+            f.write(self.toJSON() if path.endswith('.json') else self.toPrometheus())
+
+    def serve(self, port, host=''):
+        """
+        Serves metrics in the Prometheus text format over HTTP from a daemon
+        thread. Returns the server (call shutdown() to stop it).
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.toPrometheus()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+    def summary(self):
+        """
+        Returns a short, human readable summary: time and rows written by SQL
+        statements, split between provenance and catalog tables.
+        """
+        lines = []
+        for target in ('provenance', 'catalog'):
+            (seconds, n) = (0.0, 0)
+            for ((name, labels), h) in self._histograms.items():
+                if name == 'sql_statement_seconds' and \
+                        dict(labels).get('target') == target:
+                    seconds += h.sum
+                    n += h.count
+            rows = sum(v for ((name, labels), v) in self._counters.items()
+                       if name == 'sql_rows_written_total' and
+                       dict(labels).get('target') == target)
+            lines.append('%-10s %7d statements %9.3f s %9d rows written' %
+                         (target, n, seconds, rows))
+        return '\n'.join(lines)
+
+
+# ----------------------------------------------------------------------------------
+
+def instrument(obj, metrics, component):
+    """
+    Returns a proxy of obj that times calls of its public methods in the
+    histogram <component>_call_seconds, labelled by method. Calls the object
+    makes on itself are not timed separately.
+
+    @param obj        Object to instrument, e.g. ProvProto
+    @param metrics    Metrics
+    @param component  Name of the component, e.g. 'provproto'
+    """
+    return _Instrumented(obj, metrics, component + '_call_seconds')
+
+
+class _Instrumented(object):
+    def __init__(self, obj, metrics, histogram):
+        self._obj = obj
+        self._metrics = metrics
+        self._histogram = histogram
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        (metrics, histogram) = (self._metrics, self._histogram)
+        def timed(*args, **kwargs):
+            with metrics.timer(histogram, method=name):
+                return attr(*args, **kwargs)
+        return timed
+
+
+class InstrumentedBackend(object):
+    """
+    Wraps a storage backend (see provBackend) so that all statements executed
+    through its connections are counted and timed: sql_statements_total,
+    sql_rows_written_total and sql_statement_seconds, labelled by the kind of
+    statement (INSERT, SELECT...) and its target: 'provenance' for statements
+    on prv_ tables, 'catalog' for the rest. Components that take a backend need
+    no changes to be instrumented.
+    """
+    def __init__(self, backend, metrics):
+        self._backend = backend
+        self.metrics = metrics
+
+    def __getstate__(self):
+        return {'_backend': self._backend, 'metrics': self.metrics}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def __getattr__(self, name):
+        if name in ('_backend', 'metrics'):
+            raise AttributeError(name)
+        return getattr(self._backend, name)
+
+    def connect(self):
+        return _InstrumentedConnection(self._backend.connect(), self.metrics)
+
+    def streamingCursor(self, conn):
+        return _InstrumentedCursor(self._backend.streamingCursor(conn._conn),
+                                   self.metrics)
+
+    def lastStatement(self, cursor):
+        return self._backend.lastStatement(getattr(cursor, '_cursor', cursor))
+
+
+class _InstrumentedConnection(object):
+    def __init__(self, conn, metrics):
+        self._conn = conn
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args):
+        return _InstrumentedCursor(self._conn.cursor(*args), self._metrics)
+
+    def commit(self):
+        with self._metrics.timer('sql_commit_seconds'):
+            self._conn.commit()
+
+
+class _InstrumentedCursor(object):
+    _modifying = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+    def __init__(self, cursor, metrics):
+        self._cursor = cursor
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, query, args=None):
+        start = time.time()
+        result = self._cursor.execute(query, args)
+        self._record(query, time.time() - start, self._cursor.rowcount)
+        return result
+
+    def executemany(self, query, args):
+        args = list(args)
+        start = time.time()
+        result = self._cursor.executemany(query, args)
+        self._record(query, time.time() - start, len(args))
+        return result
+
+    def _record(self, query, seconds, nRows):
+        words = query.split(None, 1)
+        kind = words[0].upper() if words else ''
+        target = 'provenance' if re.search(r'\bprv_', query) else 'catalog'
+        self._metrics.observe('sql_statement_seconds', seconds, kind=kind,
+                              target=target)
+        self._metrics.inc('sql_statements_total', kind=kind, target=target)
+        if kind in self._modifying and nRows > 0:
+            self._metrics.inc('sql_rows_written_total', nRows, target=target)
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+
+"""
+Time partitioning of provenance tables that grow without bound.
+
+Task executions are partitioned by the time they were executed, in periods of
+a fixed number of days. Rolling a period moves its task executions out of the
+live tables, together with their links to data blocks, the data blocks (and
+their membership) that are not used by any later task execution, and lineage
+of exposures of that period, into tables of a partition named after the
+beginning of the period: "<table>_p<YYYYMMDD>". The partitions are recorded in
+prv_Partition with their time period and the range of keys (ids) they hold,
+so queries can be routed to the live tables and only those partitions that
+can match (see PartitionManager.tablesFor, used by ProvDetective). Old data
+releases are archived (e.g. mysqldump of the partition tables) and dropped per
+partition, with DROP TABLE instead of a long DELETE.
+
+This is done by the manager rather than with native MySQL partitioning:
+partitioned InnoDB tables can't have foreign keys, nor be referenced by them,
+and the partitioning column would have to be part of every unique key, while
+SQLite has no partitioning at all. Live tables keep their foreign keys;
+partition tables have the columns and indexes of the live tables, without
+foreign keys. Configuration tables (prv_cnf_*) are not partitioned: they are
+small, and resolving configuration valid at any time needs all of them.
+
+Rows are only moved for periods that ended before the time given to roll(),
+which should be before the start of any data block that is still open.
+Exports (provExport.py) only read live tables.
+
+Example:
+  ./provPartitions.py roll --sqlite provProto.db --until '2021-11-01 00:00:00'
+  ./provPartitions.py list --sqlite provProto.db
+  ./provPartitions.py drop p20211001 --sqlite provProto.db
+"""
+
+import argparse
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from provBackend import MySQLBackend, SQLiteBackend
+
+Partition = namedtuple(
+    'Partition',
+    'tableName partitionName timeBegin timeEnd keyBegin keyEnd nRows')
+
+
+class PartitionManager(object):
+    """
+    Creates, rolls and drops partitions of provenance tables, and routes
+    queries to them. The catalog of partitions is loaded on refresh().
+    """
+    # Partitioned tables, in the order rows are moved: table, which of its rows
+    # belong to a period (see _rollPeriod), and the columns giving the range of
+    # keys held by a partition.
+    _tables = (
+        ('prv_DataBlock', 'blocks', 'blockId', 'blockId'),
+        ('prv_RowIdToDataBlock', 'members', 'theId', 'theId'),
+        ('prv_RowIdRangeToDataBlock', 'members', 'idBegin', 'idEnd'),
+        ('prv_TaskExecutionToInputDataBlock', 'links', 'taskExecId',
+         'taskExecId'),
+        ('prv_TaskExecutionToOutputDataBlock', 'links', 'taskExecId',
+         'taskExecId'),
+        ('prv_TaskExecution', 'period', 'taskExecId', 'taskExecId'),
+        ('prv_ExposureLineage', 'period', 'scExposureId', 'scExposureId'))
+
+    # beginning of the first period, periods are aligned on it
+    _epoch = datetime(2000, 1, 1)
+
+    def __init__(self, backend, days=30):
+        """
+        @param backend  Storage backend (see provBackend)
+        @param days     Length of the period of a partition, in days
+        """
+        self._backend = backend
+        self._days = days
+        self._partitions = {}   # tableName --> list of Partition, by time
+
+    def refresh(self, cursor):
+        """
+        Loads the catalog of partitions.
+
+        @param cursor  Open, valid database cursor
+        """
+        cursor.execute('''
+SELECT tableName, partitionName, timeBegin, timeEnd, keyBegin, keyEnd, nRows
+FROM   prv_Partition
+ORDER  BY timeBegin''')
+        self._partitions = {}
+        for row in cursor.fetchall():
+            p = Partition(row[0], row[1], _toTime(row[2]), _toTime(row[3]),
+                          *row[4:])
+            self._partitions.setdefault(p.tableName, []).append(p)
+
+    def partitions(self, tableName=None):
+        """
+        Returns a list of partitions (Partition records) of a table, or of all
+        tables, as of the last refresh().
+        """
+        if tableName is not None:
+            return list(self._partitions.get(tableName, ()))
+        return [p for t in self._tables for p in self._partitions.get(t[0], ())]
+
+    def tablesFor(self, tableName, timeBegin=None, timeEnd=None, keyBegin=None,
+                  keyEnd=None):
+        """
+        Returns names of tables that hold rows of a partitioned table and can
+        match a query: the live table, followed by partitions whose period
+        overlaps [timeBegin, timeEnd), and whose keys overlap [keyBegin,
+        keyEnd]. Bounds that are None are not checked.
+        """
+        tables = [tableName]
+        for p in self._partitions.get(tableName, ()):
+            if timeBegin is not None and p.timeEnd <= _toTime(timeBegin):
+                continue
+            if timeEnd is not None and p.timeBegin >= _toTime(timeEnd):
+                continue
+            if p.keyBegin is None or \
+                    (keyBegin is not None and p.keyEnd < keyBegin) or \
+                    (keyEnd is not None and p.keyBegin > keyEnd):
+                continue
+            tables.append('%s_%s' % (tableName, p.partitionName))
+        return tables
+
+    def period(self, t):
+        """
+        Returns (begin, end) of the period that time t belongs to.
+        """
+        t = datetime.strptime(_toTime(t), '%Y-%m-%d %H:%M:%S')
+        n = (t - self._epoch).days // self._days
+        begin = self._epoch + timedelta(days=n * self._days)
+        end = begin + timedelta(days=self._days)
+        return (_toTime(begin), _toTime(end))
+
+    def roll(self, cursor, until):
+        """
+        Moves rows of all periods that ended by time until into their
+        partitions, creating partitions as needed, and updates the catalog.
+        Returns names of partitions that were created or got more rows. The
+        caller commits.
+
+        @param cursor  Open, valid database cursor
+        @param until   Time, e.g. start of the oldest open data block
+        """
+        until = _toTime(until)
+        cursor.execute('''
+SELECT MIN(theTime) FROM prv_TaskExecution WHERE theTime < %s''', (until,))
+        first = cursor.fetchone()[0]
+        rolled = []
+        if first is None:
+            return rolled
+        (begin, end) = self.period(first)
+        while end <= until:
+            if self._rollPeriod(cursor, begin, end):
+                rolled.append(self._name(begin))
+            (begin, end) = self.period(end)
+        self.refresh(cursor)
+        return rolled
+
+    def drop(self, cursor, partitionName):
+        """
+        Drops tables of a partition, and removes it from the catalog. The
+        caller commits (MySQL commits DROP TABLE right away).
+
+        @param cursor         Open, valid database cursor
+        @param partitionName  Name of the partition, e.g. 'p20211001'
+        """
+        if not any(self._exists(t[0], partitionName) for t in self._tables):
+            raise ValueError('unknown partition: %s' % partitionName)
+        for t in self._tables:
+            if self._exists(t[0], partitionName):
+                cursor.execute('DROP TABLE %s_%s' % (t[0], partitionName))
+        cursor.execute('''
+DELETE FROM prv_Partition WHERE partitionName=%s''', (partitionName,))
+        self.refresh(cursor)
+
+    def _rollPeriod(self, cursor, begin, end):
+        """
+        Moves rows of one period, returns True if there were any. Data blocks
+        go with the period of the last task execution that reads or writes
+        them, so no live link refers to a block that was moved.
+        """
+        name = self._name(begin)
+        cursor.execute('''
+SELECT COUNT(*) FROM prv_TaskExecution WHERE theTime >= %s AND theTime < %s''',
+                       (begin, end))
+        if cursor.fetchone()[0] == 0:
+            return False
+        taskExecs = '''
+    (SELECT taskExecId FROM prv_TaskExecution
+     WHERE  theTime >= %s AND theTime < %s)'''
+        laterTaskExecs = '''
+    (SELECT taskExecId FROM prv_TaskExecution WHERE theTime >= %s)'''
+        blocks = ('''
+    (SELECT blockId FROM prv_TaskExecutionToInputDataBlock
+     WHERE  taskExecId IN %s
+     UNION
+     SELECT blockId FROM prv_TaskExecutionToOutputDataBlock
+     WHERE  taskExecId IN %s)
+AND blockId NOT IN
+    (SELECT blockId FROM prv_TaskExecutionToInputDataBlock
+     WHERE  taskExecId IN %s AND blockId IS NOT NULL
+     UNION
+     SELECT blockId FROM prv_TaskExecutionToOutputDataBlock
+     WHERE  taskExecId IN %s AND blockId IS NOT NULL)''' %
+                  (taskExecs, taskExecs, laterTaskExecs, laterTaskExecs),
+                  (begin, end, begin, end, end, end))
+        conditions = {
+            'blocks': ('blockId IN' + blocks[0], blocks[1]),
+            'members': ('blockId IN (SELECT blockId FROM prv_DataBlock_%s)' %
+                        name, ()),
+            'links': ('taskExecId IN' + taskExecs, (begin, end)),
+            'period': ('theTime >= %s AND theTime < %s', (begin, end))}
+
+        for (table, rows, keyBegin, keyEnd) in self._tables:
+            if not self._exists(table, name):
+                self._backend.createTableLike(cursor, '%s_%s' % (table, name),
+                                              table)
+            (where, args) = conditions[rows]
+            cursor.execute('INSERT INTO %s_%s SELECT * FROM %s WHERE %s' %
+                           (table, name, table, where), args)
+        # children first, blocks are found through the partition by now
+        for table in ('prv_ExposureLineage', 'prv_RowIdToDataBlock',
+                      'prv_RowIdRangeToDataBlock',
+                      'prv_TaskExecutionToInputDataBlock',
+                      'prv_TaskExecutionToOutputDataBlock', 'prv_DataBlock',
+                      'prv_TaskExecution'):
+            rows = [t[1] for t in self._tables if t[0] == table][0]
+            if rows == 'blocks':
+                (where, args) = conditions['members']
+            else:
+                (where, args) = conditions[rows]
+            cursor.execute('DELETE FROM %s WHERE %s' % (table, where), args)
+
+        for (table, rows, keyBegin, keyEnd) in self._tables:
+            cursor.execute('SELECT MIN(%s), MAX(%s), COUNT(*) FROM %s_%s' %
+                           (keyBegin, keyEnd, table, name))
+            (kBegin, kEnd, nRows) = cursor.fetchone()
+            cursor.execute('''
+DELETE FROM prv_Partition WHERE tableName=%s AND partitionName=%s''',
+                           (table, name))
+            cursor.execute('''
+INSERT INTO prv_Partition(tableName, partitionName, timeBegin, timeEnd,
+                          keyBegin, keyEnd, nRows)
+VALUES (%s, %s, %s, %s, %s, %s, %s)''',
+                           (table, name, begin, end, kBegin, kEnd, nRows))
+            self._partitions.setdefault(table, []).append(
+                Partition(table, name, begin, end, kBegin, kEnd, nRows))
+        return True
+
+    def _exists(self, table, name):
+        return any(p.partitionName == name
+                   for p in self._partitions.get(table, ()))
+
+    @staticmethod
+    def _name(begin):
+        return 'p' + begin[:10].replace('-', '')
+
+
+def _toTime(t):
+    if isinstance(t, datetime):
+        return t.strftime('%Y-%m-%d %H:%M:%S')
+    return t
+
+# ----------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Roll, list and drop partitions of provenance tables.')
+    parser.add_argument('command', choices=('roll', 'list', 'drop'))
+    parser.add_argument('partition', nargs='?',
+                        help='partition to drop, e.g. p20211001')
+    parser.add_argument('--sqlite', metavar='FILE',
+                        help='SQLite database (default: MySQL, see '
+                        'testProvProto.py)')
+    parser.add_argument('--until', metavar='TIME',
+                        help="roll periods that ended by 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_argument('--days', type=int, default=30,
+                        help='length of a period in days (default: %(default)s)')
+    args = parser.parse_args()
+    if args.command == 'roll' and args.until is None:
+        parser.error('roll needs --until')
+    if args.command == 'drop' and args.partition is None:
+        parser.error('drop needs a partition')
+    if args.sqlite:
+        backend = SQLiteBackend(args.sqlite)
+    else:
+        from testProvProto import mysqlCredentials
+        backend = MySQLBackend(**mysqlCredentials)
+    conn = backend.connect()
+    cursor = conn.cursor()
+    manager = PartitionManager(backend, args.days)
+    manager.refresh(cursor)
+    if args.command == 'roll':
+        print 'rolled:', ' '.join(manager.roll(cursor, args.until)) or 'nothing'
+    elif args.command == 'drop':
+        try:
+            manager.drop(cursor, args.partition)
+        except ValueError as e:
+            parser.error(str(e))
+    conn.commit()
+    for p in manager.partitions():
+        print '%-35s %-10s %s - %s %10s rows, keys %s - %s' % (
+            p.tableName, p.partitionName, p.timeBegin, p.timeEnd, p.nRows,
+            p.keyBegin, p.keyEnd)
+    conn.close()
+
+if __name__ == "__main__":
+    main()
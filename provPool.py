@@ -0,0 +1,291 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ConnectionPool(object):
+    """
+    Shares connections of a storage backend (see provBackend) between the
+    components of one process: connections that are closed go back to the pool
+    and are handed out again, instead of each component, stream or short-lived
+    query connecting on its own. At most maxSize connections are open at a
+    time; when all of them are in use, connect() waits for one to be returned.
+
+    The pool has the interface of a backend, so it can be passed to all
+    components that take a backend (Orchestration, CalibPipe, ProvDetective,
+    CatalogBuilder...), and wrapped by or wrap InstrumentedBackend. Connections
+    it returns are used the same way, close() returns them to the pool, after
+    rolling back whatever was not committed. Each connection is used by one
+    thread at a time; session() gives the calling thread its own connection,
+    shared by nested sessions and transactions of that thread. Components use
+    the functions session() and transaction() of this module, which work with
+    any backend, to check out a connection for one unit of work only.
+
+    Connections that were idle for more than checkAfter seconds are checked
+    with a trivial query before being handed out, and replaced if the check
+    fails (e.g. the server closed them).
+
+    Like backends, the pool can be handed to other processes: each worker
+    process gets its own, empty pool with the same settings, whether the pool
+    is pickled or inherited through fork. Connections are never shared between
+    processes.
+    """
+    def __init__(self, backend, maxSize=10, timeout=60, checkAfter=30):
+        """
+        @param backend     Storage backend connections are made by
+        @param maxSize     Max number of open connections
+        @param timeout     How many seconds connect() waits for a connection to
+                           be returned when all are in use, before it raises
+                           RuntimeError
+        @param checkAfter  Idle time in seconds after which a connection is
+                           checked before it is handed out
+        """
+        self._backend = backend
+        self._maxSize = maxSize
+        self._timeout = timeout
+        self._checkAfter = checkAfter
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Condition()
+        self._idle = []        # (connection, time it was returned)
+        self._nOpen = 0        # idle and in use
+        self._local = threading.local()
+        self._stats = dict(opened=0, reused=0, replaced=0, waited=0)
+
+    def __getstate__(self):
+        return {'_backend': self._backend, '_maxSize': self._maxSize,
+                '_timeout': self._timeout, '_checkAfter': self._checkAfter}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._backend, name)
+
+    def connect(self):
+        """
+        Checks out a connection, waiting if maxSize connections are in use.
+        """
+        return _PooledConnection(self, self._checkOut())
+
+    def streamingCursor(self, conn):
+        return self._backend.streamingCursor(conn._conn)
+
+    def lastStatement(self, cursor):
+        return self._backend.lastStatement(cursor)
+
+    @contextmanager
+    def session(self):
+        """
+        Context manager giving the connection of the calling thread: it is
+        checked out by the outermost session of the thread, and returned when
+        that session ends.
+        """
+        local = self._threadLocal()
+        if getattr(local, 'depth', 0) == 0:
+            local.conn = self.connect()
+        local.depth = getattr(local, 'depth', 0) + 1
+        try:
+            yield local.conn
+        finally:
+            local.depth -= 1
+            if local.depth == 0:
+                (conn, local.conn) = (local.conn, None)
+                conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager giving a cursor of the connection of the calling thread
+        (see session), and committing when the block ends, or rolling back if it
+        raises. Transactions nested in the same thread are part of the outermost
+        one.
+        """
+        with self.session() as conn:
+            local = self._local
+            outermost = not getattr(local, 'inTransaction', False)
+            local.inTransaction = True
+            try:
+                yield conn.cursor()
+            except:
+                if outermost:
+                    conn.rollback()
+                raise
+            else:
+                if outermost:
+                    conn.commit()
+            finally:
+                if outermost:
+                    local.inTransaction = False
+
+    def stats(self):
+        """
+        Returns a dict: connections opened, reused (handed out again), replaced
+        (failed the check), waited (connect() calls that had to wait), and
+        currently open and idle.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(open=self._nOpen, idle=len(self._idle))
+            return stats
+
+    def close(self):
+        """
+        Closes idle connections. Connections in use are closed when they are
+        returned.
+        """
+        with self._lock:
+            (idle, self._idle) = (self._idle, [])
+            self._nOpen -= len(idle)
+            self._maxSize = 0
+        for (conn, returned) in idle:
+            _closeQuietly(conn)
+
+    def _threadLocal(self):
+        if self._pid != os.getpid():
+            self._reset()
+        return self._local
+
+    def _checkOut(self):
+        if self._pid != os.getpid():
+            # forked: connections of the parent stay with the parent
+            self._reset()
+        deadline = time.time() + self._timeout
+        with self._lock:
+            while not self._idle and self._nOpen >= self._maxSize:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise RuntimeError('no connection returned to the pool in %d s '
+                                       '(%d in use)' % (self._timeout, self._nOpen))
+                self._stats['waited'] += 1
+                self._lock.wait(remaining)
+            if self._idle:
+                (conn, returned) = self._idle.pop()
+                self._stats['reused'] += 1
+            else:
+                (conn, returned) = (None, None)
+                self._stats['opened'] += 1
+                self._nOpen += 1
+        if conn is not None and time.time() - returned > self._checkAfter \
+                and not self._isAlive(conn):
+            _closeQuietly(conn)
+            with self._lock:
+                self._stats['replaced'] += 1
+            conn = None
+        if conn is None:
+            try:
+                conn = self._backend.connect()
+            except:
+                self._release()
+                raise
+        return conn
+
+    def _checkIn(self, conn):
+        if self._pid != os.getpid():
+            return
+        try:
+            conn.rollback()
+        except self._backend.Error:
+            _closeQuietly(conn)
+            self._release()
+            return
+        with self._lock:
+            if self._nOpen > self._maxSize:
+                self._nOpen -= 1
+                _closeQuietly(conn)
+            else:
+                self._idle.append((conn, time.time()))
+            self._lock.notify()
+
+    def _release(self):
+        with self._lock:
+            self._nOpen -= 1
+            self._lock.notify()
+
+    def _isAlive(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchall()
+            conn.rollback()
+            return True
+        except self._backend.Error:
+            return False
+
+
+class _PooledConnection(object):
+    """
+    Connection checked out of a ConnectionPool; close() returns it.
+    """
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise RuntimeError('connection returned to the pool')
+        return getattr(self._conn, name)
+
+    def close(self):
+        (conn, self._conn) = (self._conn, None)
+        if conn is not None:
+            self._pool._checkIn(conn)
+
+    def __del__(self):
+        # returns connections of components that never close them
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+@contextmanager
+def session(backend):
+    """
+    Context manager giving a connection for one unit of work: with a
+    ConnectionPool, the connection of the calling thread (see
+    ConnectionPool.session), otherwise a new connection, closed when the block
+    ends.
+    """
+    if isinstance(backend, ConnectionPool):
+        with backend.session() as conn:
+            yield conn
+        return
+    conn = backend.connect()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+@contextmanager
+def transaction(backend):
+    """
+    Context manager giving a cursor of a connection for one transaction (see
+    session), committing when the block ends, or rolling back if it raises.
+    With a ConnectionPool, transactions nested in the same thread are part of
+    the outermost one.
+    """
+    if isinstance(backend, ConnectionPool):
+        with backend.transaction() as cursor:
+            yield cursor
+        return
+    with session(backend) as conn:
+        try:
+            yield conn.cursor()
+        except:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+def _closeQuietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
@@ -1,9 +1,67 @@
 
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
-import MySQLdb
+from provRecords import MembershipArray, TaskExecutionArray
+from provSnapshot import loadSnapshot, sharedValues
 
 
+# ----------------------------------------------------------------------------------
+
+class _LookupCache(object):
+    '''
+    A dictionary that loads missing values on demand and counts hits and misses.
+    Values that could not be loaded (None) are not remembered. With maxSize,
+    the least recently used values are evicted beyond that many; with maxSize
+    0, nothing is remembered.
+    '''
+    def __init__(self, maxSize=None):
+        self._values = {} if maxSize is None else OrderedDict()
+        self._maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        '''
+        Returns the value cached for key, calling loader() to get it on a miss.
+        '''
+        if key in self._values:
+            self.hits += 1
+            if self._maxSize is None:
+                return self._values[key]
+            value = self._values.pop(key)
+            self._values[key] = value
+            return value
+        self.misses += 1
+        value = loader()
+        if value is not None:
+            self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        if self._maxSize == 0:
+            return
+        if self._maxSize is not None:
+            self._values.pop(key, None)
+            while len(self._values) >= self._maxSize:
+                self._values.popitem(last=False)
+        self._values[key] = value
+
+    def invalidate(self, key=None):
+        '''
+        Forgets the value cached for key, or all values if key is None.
+        '''
+        if key is None:
+            self._values.clear()
+        else:
+            self._values.pop(key, None)
+
+    def values(self):
+        '''
+        Returns the list of cached values.
+        '''
+        return self._values.values()
+
 # ----------------------------------------------------------------------------------
 
 class ProvProto(object):
@@ -18,41 +76,165 @@ class ProvProto(object):
     uses this API. The reason is that we may want to combine multiple updates to
     provenance atomically in various combinations. Strong recommendation: disable
     autocommit: conn.autocommit(False)
+
+    The most frequent provenance writes (row-to-block membership, task executions
+    and their links to input data blocks) can be buffered in memory and written
+    with multi-row inserts. Buffered rows are kept in compact arrays (see
+    provRecords).
+
+    Row ids registered in a data block are coalesced into ranges of adjacent ids,
+    which are kept open in memory until a non-adjacent id arrives, the block is
+    closed, or flush() is called. Because of that, the code that manages
+    transactions must call flush() before committing, and clearBuffers() after
+    rolling back.
+
+    Ids of tasks and nodes, current task configurations and the current
+    procHistoryId are cached in memory. Methods of this class that change them
+    invalidate the cache. Changes made outside of this object (e.g. by another
+    process) are not visible until invalidateCaches() is called, and it should
+    also be called after rolling back.
+
+    With a notifier (see changeNotifier), configuration changes are announced
+    to other ProvProto objects, possibly in other processes, which then drop
+    their cached configurations and procHistoryId: the notifier is checked (a
+    memory read) instead of the database. Changes are announced by
+    publishChanges(), which must be called after committing them.
     '''
-    def __init__(self):
+
+    # max number of rows sent in one multi-row insert. MySQLdb splits longer
+    # executemany() calls into several statements, and then lastrowid only
+    # reflects the last one, so we keep task execution chunks below that.
+    _maxRowsPerInsert = 500
+
+    def __init__(self, bufferSize=0, notifier=None, maxSnapshots=16):
         '''
         Connects to the Prototype database using provided credentials.
         Note, the database should exist and schema should be loaded
+
+        @param bufferSize    Number of buffered rows that triggers a flush. Zero
+                             (the default) disables buffering: every row is
+                             written right away, except the pending range of
+                             row ids of each data block (see
+                             registerRowIdInBlock), so flush() must be called
+                             before committing either way.
+        @param notifier      Change notifier shared with other users of
+                             provenance, e.g. LocalNotifier or MmapNotifier, or
+                             None
+        @param maxSnapshots  Number of snapshots kept in memory (see snapshot),
+                             0 to keep none
         '''
         self._infinity = '2050-12-31 23:59:59'
+        self._currentTime = None
+        self._bufferSize = bufferSize
+        self._memberRows = MembershipArray()
+        self._openRanges = {}    # blockId --> [idBegin, idEnd]
+        self._taskExecRows = TaskExecutionArray()
+        self._nBuffered = 0      # rows in the two above
+        self._caches = {
+            'taskId': _LookupCache(),         # taskName --> taskId
+            'taskCnfId': _LookupCache(),      # taskName --> current taskCnfId
+            'taskCnfHash': _LookupCache(),    # taskName --> current cnfHash
+            'taskBodyId': _LookupCache(),     # cnfHash --> taskBodyId
+            'nodeIds': _LookupCache(),        # None --> list of all nodeIds
+            'nodeCapacity': _LookupCache(),   # nodeId --> (cores, ram)
+            'procHistoryId': _LookupCache(),  # None --> current procHistoryId
+            # ('procHistoryId', id) or ('time', t) --> ProvSnapshot
+            'snapshot': _LookupCache(maxSnapshots)}
+        # strings and cnfHash --> contents, shared by snapshots (see snapshot)
+        (self._strings, self._bodies) = sharedValues(())
+        self._notifier = notifier
+        self._seenVersion = notifier.read()[0] if notifier else None
+        self._unpublished = False        # there are changes to announce
+        self._unpublishedProcHistoryId = None
 
     def createProcHistoryId(self, cursor):
         '''
-        Creates a new procHistoryId.
+        Creates a new procHistoryId, valid from the current time.
 
         @param cursor  Open, valid database cursor
         '''
-        cursor.execute('INSERT INTO prv_ProcHistory(procHistoryId) VALUES (NULL)')
+        cursor.execute('''
+INSERT INTO prv_ProcHistory(procHistoryId, theTime) VALUES (NULL, %s)''',
+                       (self._currentTime,))
+        self._caches['procHistoryId'].put(None, cursor.lastrowid)
+        self._unpublished = True
+        self._unpublishedProcHistoryId = cursor.lastrowid
 
     def getProcHistoryId(self, cursor):
         '''
         @param cursor  Open, valid database cursor
 
-        Returns current procHistoryId.
+        Returns current procHistoryId. With a notifier, the database is only
+        queried when the notifier did not carry it.
+        '''
+        self._checkForChanges()
+        def load():
+            cursor.execute('SELECT MAX(procHistoryId) FROM prv_ProcHistory')
+            return cursor.fetchone()[0]
+        return self._caches['procHistoryId'].get(None, load)
+
+    def snapshot(self, cursor, procHistoryId=None, theTime=None):
+        '''
+        Returns a ProvSnapshot: an immutable record of which pipelines, tasks
+        (with their parameters, columns and files) and nodes were configured how
+        at the time a procHistoryId was created, or at theTime. Without either,
+        at the time the current procHistoryId was created. Raises ValueError if
+        procHistoryId does not exist.
+
+        Snapshots of times before the current time can't change anymore, the
+        most recently used ones are kept in memory. Strings and configuration
+        contents are shared with the snapshots kept and the last one returned,
+        and no others. Use ProvSnapshot.diff to compare two of them.
+
+        @param cursor         Open, valid database cursor
+        @param procHistoryId  procHistoryId
+        @param theTime        Time, 'YYYY-MM-DD HH:MM:SS'
         '''
-        cursor.execute('SELECT MAX(procHistoryId) FROM prv_ProcHistory')
-        row = cursor.fetchone()
-        return row[0]
+        if theTime is None:
+            if procHistoryId is None:
+                procHistoryId = self.getProcHistoryId(cursor)
+            key = ('procHistoryId', procHistoryId)
+        else:
+            key = ('time', theTime)
+        loaded = []
+        def load():
+            loaded.append(True)
+            if theTime is not None:
+                return loadSnapshot(cursor, theTime, None, self._strings,
+                                    self._bodies)
+            cursor.execute('''
+                SELECT theTime FROM prv_ProcHistory WHERE procHistoryId=%s''',
+                (procHistoryId,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return loadSnapshot(cursor, row[0], procHistoryId, self._strings,
+                                self._bodies)
+        cache = self._caches['snapshot']
+        snapshot = cache.get(key, load)
+        if snapshot is None:
+            raise ValueError('unknown procHistoryId: %s' % procHistoryId)
+        if self._currentTime is None or snapshot.theTime >= self._currentTime:
+            # configuration valid at that time may still change
+            cache.invalidate(key)
+        if loaded:
+            # forget the values of snapshots that were evicted, or not kept
+            (self._strings, self._bodies) = sharedValues(
+                cache.values() + [snapshot])
+        return snapshot
 
     def registerPipeline(self, cursor, name, tasks):
         '''
         Registers the pipeline and corresponding configuration in provenance.
         Registers the tasks if they are not registered and attaches them to the
-        pipeline configuration.
+        pipeline configuration. Configurations of tasks that are already
+        registered are updated only if they changed (see updateTaskConfig).
 
         @param name    name of the pipeline
         @param tasks   list of task object representing tasks that the pipeline
                        consists of. Order matters
+
+        Returns True if configuration of any already registered task changed.
         '''
         # register pipeline in prv_Pipeline
         cursor.execute('''
@@ -70,34 +252,23 @@ class ProvProto(object):
         # register tasks and their configurations, and attach them to the
         # pipeline
         taskPos = 1
+        changed = False
         for task in tasks:
-            cursor.execute('''
-                SELECT taskId FROM prv_Task WHERE taskName=%s''', (task.name,))
-            if cursor.rowcount == 1:
-                taskId = cursor.fetchone()[0]
-            else:
+            taskId = self._getTaskId(cursor, task.name)
+            if taskId is None:
                 cursor.execute('''
                     INSERT INTO prv_Task(taskName) VALUES (%s)''', (task.name,))
                 taskId = cursor.lastrowid
-            cursor.execute('''
-                INSERT INTO prv_cnf_Task(taskId, validityBegin, validityEnd,
-                gitSHA) VALUES (%s, %s, %s, %s)''',
-                (taskId, self._currentTime, self._infinity, task.gitSHA))
-            taskCnfId = cursor.lastrowid
-            for k in task.paramKVDict:
-                cursor.execute('''
-                    INSERT INTO prv_cnf_Task_KVParams(taskCnfId, theKey,
-                    theValue) VALUES (%s, %s, %s)''',
-                    (taskCnfId, k, task.paramKVDict[k]))
-            for c in task.tCols:
-                cursor.execute('''
-                    INSERT INTO prv_cnf_Task_Columns(taskCnfId, tcName)
-                    VALUES (%s, %s)''', (taskCnfId, c))
+                self._caches['taskId'].put(task.name, taskId)
+                self._insertTaskConfig(cursor, taskId, task)
+            elif self.updateTaskConfig(cursor, task):
+                changed = True
             cursor.execute('''
                 INSERT INTO prv_cnf_Pipeline_Tasks(pipelineCnfId, taskId,
                 taskPosition) VALUES (%s, %s, %s)''',
                 (pipeCnfId, taskId, taskPos))
             taskPos += 1
+        return changed
 
     def registerDataBlock(self, cursor, tableName):
         '''
@@ -109,20 +280,86 @@ class ProvProto(object):
         Returns the id of the newly registered block.
         '''
         cursor.execute('''
-INSERT INTO prv_DataBlock(tableName) VALUES ("%s")''' % tableName)
+INSERT INTO prv_DataBlock(tableName) VALUES (%s)''', (tableName,))
         return cursor.lastrowid
 
     def registerRowIdInBlock(self, cursor, blockId, theId):
         '''
-        Registers a new rowId in a data block identified by blockId.
+        Registers a new rowId in a data block identified by blockId. Adjacent
+        ids registered one after another are coalesced into one range, which is
+        written once it can't be extended anymore (see registerRowIdRangeInBlock),
+        when the block is closed, or by flush(), also without buffering.
 
         @param cursor  Open, valid database cursor
         @param blockId Data block id
         @param theId   Row id to be associated with a given block
         '''
-        cursor.execute('''
-INSERT INTO prv_RowIdToDataBlock(blockId, theId)
-VALUES (%s, %s)''' % (blockId, theId))
+        openRange = self._openRanges.get(blockId)
+        if openRange is not None:
+            if theId == openRange[1] + 1:
+                openRange[1] = theId
+                return
+            self._addRowIdRange(cursor, blockId, *openRange)
+            self._flushIfFull(cursor)
+        self._openRanges[blockId] = [theId, theId]
+
+    def registerRowIdRangeInBlock(self, cursor, blockId, idBegin, idEnd):
+        '''
+        Registers all row ids from idBegin to idEnd (inclusive) in a data block
+        identified by blockId. A range that consists of one id only is stored as
+        a single id in prv_RowIdToDataBlock, longer ranges go to
+        prv_RowIdRangeToDataBlock.
+
+        @param cursor  Open, valid database cursor
+        @param blockId Data block id
+        @param idBegin First row id of the range
+        @param idEnd   Last row id of the range
+        '''
+        self._addRowIdRange(cursor, blockId, idBegin, idEnd)
+        self._flushIfFull(cursor)
+
+    def closeDataBlock(self, cursor, blockId):
+        '''
+        Tells provenance that no more row ids will be added to a given data
+        block, so that its pending range of row ids can be registered.
+
+        @param cursor  Open, valid database cursor
+        @param blockId Data block id
+        '''
+        openRange = self._openRanges.pop(blockId, None)
+        if openRange is not None:
+            self._addRowIdRange(cursor, blockId, *openRange)
+            self._flushIfFull(cursor)
+
+    def registerExposureLineage(self, cursor, blockId):
+        '''
+        Materializes lineage of all science calibrated exposures of a data block
+        in prv_ExposureLineage: one row per exposure and task execution that
+        processes the block, with the task configuration valid at the time of
+        the execution. Should be called once the block is complete and its
+        task executions are registered, after flush if buffering is enabled.
+
+        @param cursor  Open, valid database cursor
+        @param blockId Data block id
+        '''
+        for membership in ('''
+FROM   prv_RowIdToDataBlock r
+JOIN   ScienceCalibratedExposure sce ON sce.scExposureId=r.theId''', '''
+FROM   prv_RowIdRangeToDataBlock r
+JOIN   ScienceCalibratedExposure sce
+  ON   sce.scExposureId BETWEEN r.idBegin AND r.idEnd'''):
+            cursor.execute('''
+INSERT INTO prv_ExposureLineage(scExposureId, blockId, taskExecId, taskId,
+                                nodeId, taskCnfId, theTime)
+SELECT sce.scExposureId, r.blockId, te.taskExecId, te.taskId, te.nodeId,
+       ct.taskCnfId, te.theTime %s
+JOIN   prv_DataBlock db ON db.blockId=r.blockId
+JOIN   prv_TaskExecutionToInputDataBlock teb ON teb.blockId=r.blockId
+JOIN   prv_TaskExecution te ON te.taskExecId=teb.taskExecId
+JOIN   prv_cnf_Task ct ON ct.taskId=te.taskId
+  AND  ct.validityBegin <= te.theTime AND ct.validityEnd > te.theTime
+WHERE  db.tableName='ScienceCalibratedExposure' AND r.blockId=%%s''' %
+                           membership, (blockId,))
 
     def registerNode(self, cursor, name, ip, os, cores, ram):
         '''
@@ -141,52 +378,127 @@ VALUES (%s, %s)''' % (blockId, theId))
             INSERT INTO prv_cnf_Node(nodeId, validityBegin, validityEnd, ip, os,
             cores, ram) VALUES (%s, %s, %s, %s, %s, %s, %s)''',
             (nodeId, self._currentTime, self._infinity, ip, os, cores, ram))
+        self._caches['nodeIds'].invalidate()
+        self._caches['nodeCapacity'].invalidate()
 
     def updateTaskConfig(self, cursor, task):
         '''
         Updates the configuration for a given task and updates its validity time:
         sets validity end for the existing configuration object to "now", and
         creates a new configuration with validity "now-->infinity", using values
-        passed via task parameter.
+        passed via task parameter. Nothing is done if the configuration did not
+        change (see taskConfigChanged).
 
         @param cursor     Open, valid database cursor
         @param task       Task object. The names should point to an existing task
                           The values provided will be used as the new values.
+
+        Returns True if the configuration changed, so that the caller knows
+        whether a new procHistoryId is needed.
         '''
+        if not self.taskConfigChanged(cursor, task):
+            return False
+        taskId = self._getTaskId(cursor, task.name)
+        oldTaskCnfId = self._getCurrentTaskCnfId(cursor, task.name)
         cursor.execute('''
-            SELECT t.taskId FROM prv_cnf_Task ct, prv_Task t
-            WHERE  ct.taskId = t.taskId
-              AND  t.taskName = %s
-              AND  validityEnd=%s''', (task.name, self._infinity))
-        taskId = cursor.fetchone()[0]
-        cursor.execute('''
-            UPDATE prv_cnf_Task SET validityEnd=%s WHERE taskId=%s''',
-            (self._currentTime, taskId))
+            UPDATE prv_cnf_Task SET validityEnd=%s WHERE taskCnfId=%s''',
+            (self._currentTime, oldTaskCnfId))
+        self._insertTaskConfig(cursor, taskId, task)
+        self._unpublished = True
+        return True
+
+    def taskConfigChanged(self, cursor, task):
+        '''
+        Tells whether configuration of a task differs from its current
+        configuration in provenance, by comparing their hashes (see
+        Task.cnfHash), which is cheap: the current hash is cached.
+
+        @param cursor     Open, valid database cursor
+        @param task       Task object
+        '''
+        def load():
+            cursor.execute('''
+                SELECT cnfHash
+                FROM   prv_cnf_Task
+                JOIN   prv_Task USING(taskId)
+                JOIN   prv_cnf_TaskBody USING(taskBodyId)
+                WHERE  taskName=%s AND validityEnd=%s''',
+                (task.name, self._infinity))
+            row = cursor.fetchone()
+            return row[0] if row else None
+        self._checkForChanges()
+        return self._caches['taskCnfHash'].get(task.name, load) != task.cnfHash()
+
+    def _insertTaskConfig(self, cursor, taskId, task):
+        '''
+        Inserts a new configuration of a task, valid from "now" to infinity,
+        sharing the contents with all configurations that have the same hash.
+        '''
+        cnfHash = task.cnfHash()
         cursor.execute('''
-            INSERT INTO prv_cnf_Task(taskId, validityBegin, validityEnd, gitSHA)
-            VALUES (%s, %s, %s, %s)''',
-            (taskId, self._currentTime, self._infinity, task.gitSHA))
-        taskCnfId = cursor.lastrowid
-        for k in task.paramKVDict:
+            INSERT INTO prv_cnf_Task(taskId, validityBegin, validityEnd, gitSHA,
+            taskBodyId) VALUES (%s, %s, %s, %s, %s)''',
+            (taskId, self._currentTime, self._infinity, task.gitSHA,
+             self._getTaskBodyId(cursor, task, cnfHash)))
+        self._caches['taskCnfId'].put(task.name, cursor.lastrowid)
+        self._caches['taskCnfHash'].put(task.name, cnfHash)
+
+    def _getTaskBodyId(self, cursor, task, cnfHash):
+        '''
+        Returns id of the configuration contents with a given hash, stores the
+        contents of task first if they are not stored yet.
+        '''
+        def load():
             cursor.execute('''
-                INSERT INTO prv_cnf_Task_KVParams(taskCnfId, theKey, theValue)
-                VALUES (%s, %s, %s)''', (taskCnfId, k, task.paramKVDict[k]))
+                SELECT taskBodyId FROM prv_cnf_TaskBody WHERE cnfHash=%s''',
+                (cnfHash,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+        bodyId = self._caches['taskBodyId'].get(cnfHash, load)
+        if bodyId is not None:
+            return bodyId
+        cursor.execute('''
+            INSERT INTO prv_cnf_TaskBody(cnfHash) VALUES (%s)''', (cnfHash,))
+        bodyId = cursor.lastrowid
+        (kvRows, columnRows, fileRows) = task.configRows(bodyId)
+        if kvRows:
+            cursor.executemany('''
+                INSERT INTO prv_cnf_Task_KVParams(taskBodyId, theKey, theValue)
+                VALUES (%s, %s, %s)''', kvRows)
+        if columnRows:
+            cursor.executemany('''
+                INSERT INTO prv_cnf_Task_Columns(taskBodyId, tcName)
+                VALUES (%s, %s)''', columnRows)
+        if fileRows:
+            cursor.executemany('''
+                INSERT INTO prv_cnf_Task_Files(taskBodyId, fileUrl)
+                VALUES (%s, %s)''', fileRows)
+        self._caches['taskBodyId'].put(cnfHash, bodyId)
+        return bodyId
 
-    def registerTaskExecution(self, cursor, taskName, nodeId, blockId):
+    def registerTaskExecution(self, cursor, taskName, nodeId, blockId,
+                              outputBlockId=None):
         '''
-        Registers a new task execution in provenance.
+        Registers a new task execution in provenance. If buffering is enabled,
+        the task execution is written during the next flush.
 
-        @param cursor     Open, valid database cursor
-        @param taskName   Name of task to register
-        @param nodeId     Id of the node where given task runs.
-        @param blockId    Id of data block processed by this taskExecution
+        @param cursor        Open, valid database cursor
+        @param taskName      Name of task to register
+        @param nodeId        Id of the node where given task runs.
+        @param blockId       Id of data block processed by this taskExecution
+        @param outputBlockId Id of data block produced by this taskExecution,
+                             if any
         '''
-        cursor.execute('SELECT taskId FROM prv_Task WHERE taskName=%s', (taskName,))
-        row = cursor.fetchone()
-        if row is None:
+        taskId = self._getTaskId(cursor, taskName)
+        if taskId is None:
             print "Can't find task '%s'" % taskName
-            raise MySQLdb.Error('Can not find task', taskName)
-        taskId = row[0]
+            raise cursor.connection.Error('Can not find task', taskName)
+        if self._bufferSize:
+            self._taskExecRows.append((None, taskId, nodeId, self._currentTime,
+                                       blockId, outputBlockId))
+            self._nBuffered += 1
+            self._flushIfFull(cursor)
+            return
         cursor.execute('''
             INSERT INTO prv_TaskExecution(taskId, nodeId, theTime)
             VALUES (%s, %s, %s)''', (taskId, nodeId, self._currentTime))
@@ -194,6 +506,123 @@ VALUES (%s, %s)''' % (blockId, theId))
         cursor.execute('''
             INSERT INTO prv_TaskExecutionToInputDataBlock(taskExecId, blockId)
             VALUES (%s, %s)''', (taskExecId, blockId))
+        if outputBlockId is not None:
+            cursor.execute('''
+                INSERT INTO prv_TaskExecutionToOutputDataBlock(taskExecId, blockId)
+                VALUES (%s, %s)''', (taskExecId, outputBlockId))
+
+    def flush(self, cursor):
+        '''
+        Registers pending ranges of row ids of all data blocks and writes all
+        buffered provenance rows using multi-row inserts. Must be called before
+        committing the transaction.
+
+        Ids of the task executions are derived from the first auto-increment id
+        generated by each multi-row insert, relying on InnoDB allocating
+        consecutive ids to all rows of a single multi-row ("simple") insert.
+
+        @param cursor     Open, valid database cursor
+        '''
+        for (blockId, openRange) in self._openRanges.items():
+            self._addRowIdRange(cursor, blockId, *openRange)
+        self._openRanges = {}
+        rowIdRows = []
+        rangeRows = []
+        for (blockId, idBegin, idEnd) in self._memberRows.rows():
+            if idBegin == idEnd:
+                rowIdRows.append((blockId, idBegin))
+            else:
+                rangeRows.append((blockId, idBegin, idEnd))
+        if rowIdRows:
+            cursor.executemany('''
+                INSERT INTO prv_RowIdToDataBlock(blockId, theId)
+                VALUES (%s, %s)''', rowIdRows)
+        if rangeRows:
+            cursor.executemany('''
+                INSERT INTO prv_RowIdRangeToDataBlock(blockId, idBegin, idEnd)
+                VALUES (%s, %s, %s)''', rangeRows)
+        self._memberRows.clear()
+        rows = self._taskExecRows
+        for i in range(0, len(rows), self._maxRowsPerInsert):
+            chunk = list(rows.rows(i, i+self._maxRowsPerInsert))
+            cursor.executemany('''
+                INSERT INTO prv_TaskExecution(taskId, nodeId, theTime)
+                VALUES (%s, %s, %s)''', [row[1:4] for row in chunk])
+            firstId = cursor.lastrowid
+            cursor.executemany('''
+                INSERT INTO prv_TaskExecutionToInputDataBlock(taskExecId, blockId)
+                VALUES (%s, %s)''',
+                [(firstId+n, row[4]) for (n, row) in enumerate(chunk)])
+            outputs = [(firstId+n, row[5]) for (n, row) in enumerate(chunk)
+                       if row[5] is not None]
+            if outputs:
+                cursor.executemany('''
+                    INSERT INTO prv_TaskExecutionToOutputDataBlock(taskExecId, blockId)
+                    VALUES (%s, %s)''', outputs)
+        self._taskExecRows.clear()
+        self._nBuffered = 0
+
+    def publishChanges(self):
+        '''
+        Announces configuration changes (new procHistoryId, task configuration
+        updates) made through this object through the notifier. Must be called
+        after they are committed, so that others don't reload configurations
+        before they can see them.
+        '''
+        if self._unpublished and self._notifier is not None:
+            self._notifier.publish(self._unpublishedProcHistoryId)
+        self._unpublished = False
+        self._unpublishedProcHistoryId = None
+
+    def getNotifier(self):
+        '''
+        Returns the change notifier given to this object, or None.
+        '''
+        return self._notifier
+
+    def _checkForChanges(self):
+        if self._notifier is None:
+            return
+        (version, procHistoryId) = self._notifier.read()
+        if version == self._seenVersion:
+            return
+        self._seenVersion = version
+        for name in ('taskCnfId', 'taskCnfHash', 'procHistoryId'):
+            self._caches[name].invalidate()
+        if procHistoryId is not None:
+            self._caches['procHistoryId'].put(None, procHistoryId)
+
+    def clearBuffers(self):
+        '''
+        Drops all buffered provenance rows and unpublished changes without
+        writing them. Should be called after the transaction they belong to has
+        been rolled back.
+        '''
+        self._unpublished = False
+        self._unpublishedProcHistoryId = None
+        self._memberRows.clear()
+        self._openRanges = {}
+        self._taskExecRows.clear()
+        self._nBuffered = 0
+
+    def _addRowIdRange(self, cursor, blockId, idBegin, idEnd):
+        if self._bufferSize:
+            self._memberRows.append((blockId, idBegin, idEnd))
+            self._nBuffered += 1
+        elif idBegin == idEnd:
+            cursor.execute('''
+                INSERT INTO prv_RowIdToDataBlock(blockId, theId)
+                VALUES (%s, %s)''', (blockId, idBegin))
+        else:
+            cursor.execute('''
+                INSERT INTO prv_RowIdRangeToDataBlock(blockId, idBegin, idEnd)
+                VALUES (%s, %s, %s)''', (blockId, idBegin, idEnd))
+
+    def _flushIfFull(self, cursor):
+        if not self._bufferSize:
+            return
+        if self._nBuffered >= self._bufferSize:
+            self.flush(cursor)
 
     def getNodeIds(self, cursor):
         '''
@@ -201,9 +630,61 @@ VALUES (%s, %s)''' % (blockId, theId))
 
         @param cursor     Open, valid database cursor
         '''
-        cursor.execute('SELECT nodeId FROM prv_Node')
-        rows = cursor.fetchall()
-        return list(row[0] for row in rows)
+        def load():
+            cursor.execute('SELECT nodeId FROM prv_Node')
+            rows = cursor.fetchall()
+            return list(row[0] for row in rows)
+        return list(self._caches['nodeIds'].get(None, load))
+
+    def getNodeCapacity(self, cursor, nodeId):
+        '''
+        Returns (cores, ram) of the current configuration of a node.
+
+        @param cursor     Open, valid database cursor
+        @param nodeId     Node id
+        '''
+        def load():
+            cursor.execute('''
+                SELECT cores, ram FROM prv_cnf_Node
+                WHERE  nodeId=%s AND validityEnd=%s''', (nodeId, self._infinity))
+            return cursor.fetchone()
+        return self._caches['nodeCapacity'].get(nodeId, load)
+
+    def cacheStats(self):
+        '''
+        Returns a dictionary with hit and miss counters of each lookup cache:
+        cacheName --> (hits, misses).
+        '''
+        return dict((name, (c.hits, c.misses))
+                    for (name, c) in self._caches.items())
+
+    def invalidateCaches(self):
+        '''
+        Forgets all cached ids and configurations. Should be called after
+        rolling back, or when provenance was changed outside of this object.
+        '''
+        for c in self._caches.values():
+            c.invalidate()
+        (self._strings, self._bodies) = sharedValues(())
+
+    def _getTaskId(self, cursor, taskName):
+        def load():
+            cursor.execute('SELECT taskId FROM prv_Task WHERE taskName=%s',
+                           (taskName,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+        return self._caches['taskId'].get(taskName, load)
+
+    def _getCurrentTaskCnfId(self, cursor, taskName):
+        self._checkForChanges()
+        def load():
+            cursor.execute('''
+                SELECT taskCnfId FROM prv_cnf_Task JOIN prv_Task USING(taskId)
+                WHERE  taskName=%s AND validityEnd=%s''',
+                (taskName, self._infinity))
+            row = cursor.fetchone()
+            return row[0] if row else None
+        return self._caches['taskCnfId'].get(taskName, load)
 
     # ------------------------------------------------------------------------------
     # -----       functions below are relately purely to this prototype        -----
@@ -216,6 +697,12 @@ VALUES (%s, %s)''' % (blockId, theId))
         '''
         self._currentTime = t
 
+    def getCurrentTime(self):
+        '''
+        Returns current time in a form 'YYYY-MM-DD HH:MM:SS'.
+        '''
+        return self._currentTime
+
     def forwardCurrentTime(self, nSeconds):
         '''
         Adds specified number of seconds to current time.
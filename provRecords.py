@@ -0,0 +1,272 @@
+from array import array
+from collections import namedtuple
+from itertools import chain, imap, izip
+import sys
+
+
+class TaskExecution(namedtuple('TaskExecution',
+                               'taskExecId taskId nodeId theTime blockId '
+                               'outputBlockId')):
+    """
+    A task execution with the data block it processed, and the one it produced
+    (None if none). taskExecId is None until the execution is written.
+    """
+    __slots__ = ()
+
+    # returns rows fromRow takes
+    query = '''
+SELECT te.taskExecId, te.taskId, te.nodeId, te.theTime, i.blockId, o.blockId
+FROM   prv_TaskExecution te
+JOIN   prv_TaskExecutionToInputDataBlock i ON i.taskExecId=te.taskExecId
+LEFT JOIN prv_TaskExecutionToOutputDataBlock o ON o.taskExecId=te.taskExecId'''
+
+    @classmethod
+    def fromRow(cls, row):
+        return cls._make(row)
+
+    def toRow(self):
+        return tuple(self)
+
+
+class BlockMembership(namedtuple('BlockMembership', 'blockId idBegin idEnd')):
+    """
+    Row ids from idBegin to idEnd (inclusive) that belong to a data block. A
+    single id (idBegin == idEnd) is stored in prv_RowIdToDataBlock, a longer
+    range in prv_RowIdRangeToDataBlock.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def fromRow(cls, row):
+        """
+        From a (blockId, theId) row of prv_RowIdToDataBlock, or a (blockId,
+        idBegin, idEnd) row of prv_RowIdRangeToDataBlock.
+        """
+        if len(row) == 2:
+            return cls(row[0], row[1], row[1])
+        return cls._make(row)
+
+    @property
+    def table(self):
+        if self.idBegin == self.idEnd:
+            return 'prv_RowIdToDataBlock'
+        return 'prv_RowIdRangeToDataBlock'
+
+    def toRow(self):
+        """
+        Returns the row of the table this membership is stored in.
+        """
+        if self.idBegin == self.idEnd:
+            return (self.blockId, self.idBegin)
+        return tuple(self)
+
+
+class SourceProvenance(namedtuple(
+        'SourceProvenance',
+        'sourceId objectId scExposureId blockId taskExecId theTime nodeName '
+        'taskCnfId gitSHA')):
+    """
+    Lineage of a source: which data block and task execution processed it, on
+    which node, and which configuration of the task was valid at that time (see
+    ProvDetective.taskVersionsForObjects, which runs the query of these rows).
+    """
+    __slots__ = ()
+
+    @classmethod
+    def fromRow(cls, row):
+        return cls._make(row)
+
+    def toRow(self):
+        return tuple(self)
+
+# ----------------------------------------------------------------------------------
+
+class RecordArray(object):
+    """
+    Compact container of many records of one type, stored as a struct of
+    arrays: one array of machine integers per field instead of a tuple, and
+    objects for its values, per record. Integer fields are stored as they are;
+    in nullableFields, None is stored as -1. Other fields (times, names,
+    hashes) are dictionary encoded: the array holds indexes into the list of
+    distinct values, so values repeated by many records (the time of a block,
+    the node, the gitSHA) are kept once.
+
+    Records are appended as tuples or records, and read back as records.
+    rows() gives plain tuples, e.g. for executemany. The last records appended
+    (up to _packSize) are kept as they are, and moved to the arrays together,
+    so that appending stays about as cheap as appending to a list. A record
+    with a value that can't be stored (e.g. None in a field that is not
+    nullable) makes the append that packs it raise, and is dropped.
+
+    Subclasses set record, a namedtuple type, and nullableFields and
+    encodedFields, names of integer fields that can be None and of fields that
+    are not integers.
+    """
+    record = None
+    nullableFields = ()
+    encodedFields = ()
+    _packSize = 1024
+
+    def __init__(self, records=()):
+        """
+        @param records  Iterable of records or rows to start with
+        """
+        self.clear()
+        self.extend(records)
+
+    def clear(self):
+        """
+        Drops all records.
+        """
+        self._columns = []
+        self._encoders = []  # None for integers stored as they are
+        self._decoders = []
+        self._values = {}    # field --> list of distinct values
+        self._tail = []      # records not packed into the arrays yet
+        self._nPacked = 0
+        for field in self.record._fields:
+            self._columns.append(array('l'))
+            if field in self.encodedFields:
+                values = self._values[field] = []
+                self._encoders.append(_Dictionary(values).encode)
+                self._decoders.append(values.__getitem__)
+            elif field in self.nullableFields:
+                self._encoders.append(_encodeInt)
+                self._decoders.append(_decodeInt)
+            else:
+                self._encoders.append(None)
+                self._decoders.append(None)
+
+    def append(self, record):
+        if len(record) != len(self._columns):
+            raise ValueError('%d fields instead of %d in %r' %
+                             (len(record), len(self._columns), record))
+        self._tail.append(record)
+        if len(self._tail) >= self._packSize:
+            self._pack()
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def _pack(self):
+        if not self._tail:
+            return
+        (tail, self._tail) = (self._tail, [])
+        try:
+            self._packRecords(tail)
+        except (TypeError, ValueError, OverflowError):
+            # pack the good records one by one, and drop the bad ones, which
+            # would fail every later pack otherwise
+            error = sys.exc_info()
+            for record in tail:
+                try:
+                    self._packRecords((record,))
+                except (TypeError, ValueError, OverflowError):
+                    pass
+            raise error[0], error[1], error[2]
+
+    def _packRecords(self, records):
+        # encode all fields first, so that a bad value leaves the arrays as
+        # they were
+        packed = [array('l', values if encode is None else imap(encode, values))
+                  for (encode, values) in izip(self._encoders, izip(*records))]
+        for (column, values) in izip(self._columns, packed):
+            column.extend(values)
+        self._nPacked += len(records)
+
+    def __len__(self):
+        return self._nPacked + len(self._tail)
+
+    def __getitem__(self, i):
+        n = len(self)
+        if not -n <= i < n:
+            raise IndexError('record index out of range')
+        return self.record._make(next(self.rows(i, i+1 or None)))
+
+    def __iter__(self):
+        return self.records()
+
+    def records(self, begin=0, end=None):
+        """
+        Yields records from index begin to end (exclusive, None for all).
+        """
+        make = self.record._make
+        for row in self.rows(begin, end):
+            yield make(row)
+
+    def rows(self, begin=0, end=None):
+        """
+        Returns an iterator of tuples from index begin to end (exclusive, None
+        for all).
+        """
+        (begin, end, step) = slice(begin, end).indices(len(self))
+        nPacked = self._nPacked
+        packed = izip(*[column[begin:end] if decode is None
+                        else imap(decode, column[begin:end])
+                        for (column, decode) in izip(self._columns,
+                                                     self._decoders)])
+        tail = self._tail[max(begin - nPacked, 0):max(end - nPacked, 0)]
+        return chain(packed if begin < nPacked else (), imap(tuple, tail))
+
+    def column(self, field):
+        """
+        Returns the array of a field: its values, or for an encoded field,
+        indexes into distinct(field). The array can be handed to numpy (e.g.
+        numpy.frombuffer) without copying.
+        """
+        self._pack()
+        return self._columns[self.record._fields.index(field)]
+
+    def distinct(self, field):
+        """
+        Returns the list of distinct values of an encoded field.
+        """
+        self._pack()
+        return self._values[field]
+
+    def nbytes(self):
+        """
+        Returns the number of bytes taken by the arrays, not counting distinct
+        values of encoded fields.
+        """
+        self._pack()
+        return sum(column.itemsize * len(column) for column in self._columns)
+
+
+class TaskExecutionArray(RecordArray):
+    record = TaskExecution
+    nullableFields = ('taskExecId', 'blockId', 'outputBlockId')
+    encodedFields = ('theTime',)
+
+
+class MembershipArray(RecordArray):
+    record = BlockMembership
+
+
+class LineageArray(RecordArray):
+    """
+    RecordArray of SourceProvenance, e.g.
+    LineageArray(detective.taskVersionsForSourceRange(...)).
+    """
+    record = SourceProvenance
+    encodedFields = ('theTime', 'nodeName', 'gitSHA')
+
+
+class _Dictionary(object):
+    def __init__(self, values):
+        self._values = values
+        self._codes = {}
+
+    def encode(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self._values)
+            self._values.append(value)
+        return code
+
+def _encodeInt(value):
+    return -1 if value is None else value
+
+def _decodeInt(value):
+    return None if value == -1 else value
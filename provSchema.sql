@@ -89,11 +89,28 @@ CREATE TABLE prv_cnf_Pipeline_Tasks
         REFERENCES prv_cnf_Pipeline(pipelineCnfId)
 ) ENGINE=InnoDB;
 
+CREATE TABLE prv_cnf_TaskBody
+    -- <descr>This table defines contents of task configurations (parameters,
+    -- columns and files), identified by a hash, so that each distinct content is
+    -- stored once, no matter how many configurations (validity intervals) of
+    -- how many tasks refer to it.</descr>
+(
+    taskBodyId INT NOT NULL AUTO_INCREMENT,
+        -- <descr>Unique id</descr>
+        -- <ucd>meta.id;src</ucd>
+    cnfHash CHAR(40) NOT NULL,
+        -- <descr>SHA-1 of the canonical form of the configuration: gitSHA,
+        -- sorted parameters, columns and files (see Task.cnfHash).</descr>
+    PRIMARY KEY PK_cnfTaskBody_taskBodyId(taskBodyId),
+    UNIQUE INDEX IDX_cnfTaskBody_cnfHash(cnfHash)
+) ENGINE=InnoDB;
+
 CREATE TABLE prv_cnf_Task
     -- <descr>This table defines all configurations for all tasks. Note that
     -- occasionally manual patching will be required, leading to more than one
     -- configuration (the default one, and the patch). This is achieved through
-    -- taskCnfVersion column.</descr>
+    -- taskCnfVersion column. Contents of configurations are kept in
+    -- prv_cnf_TaskBody and shared.</descr>
 (
     taskCnfId INT NOT NULL AUTO_INCREMENT,
         -- <descr>Unique id</descr>
@@ -112,27 +129,33 @@ CREATE TABLE prv_cnf_Task
      -- For now we are assuming it is just one SHA of one commit in git.
      -- In practice this can be more complicated, it can span multiple repos etc.
      -- </descr>
+    taskBodyId INT NOT NULL,
+        -- <descr>Id of the contents of this configuration.</descr>
     PRIMARY KEY PK_cnfTask_prvCnfTaskId(taskCnfId),
     INDEX IDX_cnfTask_taskId(taskId),
     INDEX IDX_cnfTask_cnfVer(taskCnfVersion),
+    INDEX IDX_cnfTask_taskBodyId(taskBodyId),
     CONSTRAINT FK_cnfTask_taskId
         FOREIGN KEY(taskId)
-        REFERENCES prv_Task(taskId)
+        REFERENCES prv_Task(taskId),
+    CONSTRAINT FK_cnfTask_taskBodyId
+        FOREIGN KEY(taskBodyId)
+        REFERENCES prv_cnf_TaskBody(taskBodyId)
 ) ENGINE=InnoDB;
 
 CREATE TABLE prv_cnf_Task_Columns
     -- <descr>This table defines which tables+columns are altered by a given task.
     -- One row per table+column.</descr>
 (
-    taskCnfId INT,
-        -- <descr>If of the corresponding task configuration.</descr>
+    taskBodyId INT,
+        -- <descr>Id of the corresponding task configuration contents.</descr>
     tcName TEXT,
         -- <descr>Table and column pair. Format: "<table>.<column>".
         -- "<table>.*" is allowed to indicate all columns in a table.</descr>
-    INDEX IDX_cnfTaskColumns_taskCnfId(taskCnfId),
-    CONSTRAINT FK_cnfTaskCols_taskCnfId
-        FOREIGN KEY(taskCnfId)
-        REFERENCES prv_cnf_Task(taskCnfId)
+    INDEX IDX_cnfTaskColumns_taskBodyId(taskBodyId),
+    CONSTRAINT FK_cnfTaskCols_taskBodyId
+        FOREIGN KEY(taskBodyId)
+        REFERENCES prv_cnf_TaskBody(taskBodyId)
 ) ENGINE=InnoDB;
 
 CREATE TABLE prv_cnf_Task_Files
@@ -140,30 +163,30 @@ CREATE TABLE prv_cnf_Task_Files
     -- One row per file. This table can be trivially extended should we capture
     -- which sections of files are altered.</descr>
 (
-    taskCnfId INT,
-        -- <descr>If of the corresponding task configuration.</descr>
+    taskBodyId INT,
+        -- <descr>Id of the corresponding task configuration contents.</descr>
     fileUrl TEXT,
         -- <descr>url that uniquely locates the file.</descr>
-    INDEX IDX_cnfTaskFiles_taskCnfId(taskCnfId),
-    CONSTRAINT FK_cnfTaskFiles_taskCnfId
-        FOREIGN KEY(taskCnfId)
-        REFERENCES prv_cnf_Task(taskCnfId)
+    INDEX IDX_cnfTaskFiles_taskBodyId(taskBodyId),
+    CONSTRAINT FK_cnfTaskFiles_taskBodyId
+        FOREIGN KEY(taskBodyId)
+        REFERENCES prv_cnf_TaskBody(taskBodyId)
 ) ENGINE=InnoDB;
 
 CREATE TABLE prv_cnf_Task_KVParams
     -- <descr>This table keeps parameter values for tasks. One row per parameter.
     -- For now everything is kept as strings (not efficient).</descr>
 (
-    taskCnfId INT,
-        -- <descr>If of the corresponding task configuration.</descr>
+    taskBodyId INT,
+        -- <descr>Id of the corresponding task configuration contents.</descr>
     theKey VARCHAR(255),
         -- <descr>Unique key.</descr>
     theValue VARCHAR(255),
         -- <descr>Value for the given key.</descr>
-    INDEX IDX_cnfTaskKVParams_taskCnfId(taskCnfId),
-    CONSTRAINT FK_cnfTaskKVParams_tcId
-        FOREIGN KEY(taskCnfId)
-        REFERENCES prv_cnf_Task(taskCnfId)
+    INDEX IDX_cnfTaskKVParams_taskBodyId(taskBodyId),
+    CONSTRAINT FK_cnfTaskKVParams_tbId
+        FOREIGN KEY(taskBodyId)
+        REFERENCES prv_cnf_TaskBody(taskBodyId)
 ) ENGINE=InnoDB;
 
 CREATE TABLE prv_Node
@@ -214,7 +237,9 @@ CREATE TABLE prv_DataBlock
 ) ENGINE=InnoDB;
 
 CREATE TABLE prv_RowIdToDataBlock
-    -- <descr>This table defines which rows belong to a given data block.</descr>
+    -- <descr>This table defines which rows belong to a given data block. Only ids
+    -- that are not adjacent to any other id of the same block are kept here, runs
+    -- of adjacent ids are kept in prv_RowIdRangeToDataBlock.</descr>
 (
     theId BIGINT NOT NULL,
         -- <descr>The id of one data element. Note that we are not enforcing strict
@@ -229,6 +254,58 @@ CREATE TABLE prv_RowIdToDataBlock
         REFERENCES prv_DataBlock(blockId)
 ) ENGINE=InnoDB;
 
+CREATE TABLE prv_RowIdRangeToDataBlock
+    -- <descr>This table defines which ranges of rows belong to a given data block.
+    -- Ids of rows processed together are typically contiguous, so one row here
+    -- replaces many rows in prv_RowIdToDataBlock.</descr>
+(
+    idBegin BIGINT NOT NULL,
+        -- <descr>The first id of the range.</descr>
+    idEnd BIGINT NOT NULL,
+        -- <descr>The last id of the range (inclusive).</descr>
+    blockId BIGINT NOT NULL,
+        -- <descr>Id of the block a given range of row ids corresponds to.</descr>
+    INDEX IDX_rowIdRangeToDataBlock_idBegin(idBegin, idEnd),
+    INDEX IDX_rowIdRangeToDataBlock_blockId(blockId),
+    CONSTRAINT FK_rowIdRangeToDataBlock_blockId
+        FOREIGN KEY(blockId)
+        REFERENCES prv_DataBlock(blockId)
+) ENGINE=InnoDB;
+
+CREATE TABLE prv_HighWaterMark
+    -- <descr>This table keeps track of how far processing of a given stream of
+    -- rows got, so that a restarted run can continue where it stopped. One row
+    -- per stream.</descr>
+(
+    streamName VARCHAR(64) NOT NULL,
+        -- <descr>Name of the stream, e.g. name of the pipeline.</descr>
+    lastId BIGINT NOT NULL,
+        -- <descr>Id of the last row that was processed and committed.</descr>
+    PRIMARY KEY PK_highWaterMark_streamName(streamName)
+) ENGINE=InnoDB;
+
+CREATE TABLE prv_JournalLoad
+    -- <descr>This table keeps track of how far provenance journals of worker
+    -- nodes (see provJournal.py) were loaded. It is updated in the transaction
+    -- that loads each group of journaled events, so that no group is loaded
+    -- twice. One row per journal.</descr>
+(
+    journalName VARCHAR(255) NOT NULL,
+        -- <descr>Name of the journal, e.g. node and directory.</descr>
+    journalId BIGINT NOT NULL,
+        -- <descr>Id of the journal bound to this database under that name;
+        -- segments of other journals are not loaded.</descr>
+    markName VARCHAR(64),
+        -- <descr>Name of the mark in prv_HighWaterMark that limits loading of
+        -- the journal, NULL if none.</descr>
+    segmentNo INT NOT NULL,
+        -- <descr>Number of the segment file loading continues in.</descr>
+    segmentOffset BIGINT NOT NULL,
+        -- <descr>Offset in that segment of the first event not loaded yet.
+        -- </descr>
+    PRIMARY KEY PK_journalLoad_journalName(journalName)
+) ENGINE=InnoDB;
+
 CREATE TABLE prv_TaskExecution
     -- <descr>This table keeps information about all tasks ever executed. Since the
     -- configuration of the system is not allowed to change while a tasks is
@@ -261,6 +338,7 @@ CREATE TABLE prv_TaskExecution
     INDEX IDX_taskExec_taskId(taskId),
     INDEX IDX_taskExec_nodeId(nodeId),
     INDEX IDX_taskExec_cnfVer(taskCnfVersion),
+    INDEX IDX_taskExec_theTime(theTime),
     CONSTRAINT FK_taskExec_taskId
         FOREIGN KEY(taskId)
         REFERENCES prv_Task(taskId),
@@ -311,3 +389,58 @@ CREATE TABLE prv_TaskExecutionToOutputDataBlock
         FOREIGN KEY(blockId)
         REFERENCES prv_DataBlock(blockId)
 ) ENGINE=InnoDB;
+
+CREATE TABLE prv_ExposureLineage
+    -- <descr>Materialized lineage of science calibrated exposures: one row per
+    -- exposure and task execution that processed it, with the configuration of
+    -- the task valid at the time of execution. It is derived from the data block
+    -- and task execution tables above, and maintained incrementally, each time a
+    -- data block is closed, so that "who processed this" questions are answered
+    -- without joining through data block membership.</descr>
+(
+    scExposureId BIGINT NOT NULL,
+        -- <descr>Id of the science calibrated exposure.</descr>
+    blockId BIGINT NOT NULL,
+        -- <descr>Id of the data block the exposure was processed in.</descr>
+    taskExecId BIGINT NOT NULL,
+        -- <descr>Id of the task execution that processed the block.</descr>
+    taskId INT NOT NULL,
+        -- <descr>Id of the executed task.</descr>
+    nodeId INT NOT NULL,
+        -- <descr>Id of the node where the task was executed.</descr>
+    taskCnfId INT NOT NULL,
+        -- <descr>Id of the task configuration valid at the time of execution.
+        -- </descr>
+    theTime DATETIME NOT NULL,
+        -- <descr>The time when the task execution was started.</descr>
+    PRIMARY KEY PK_exposureLineage(scExposureId, taskExecId),
+    INDEX IDX_exposureLineage_blockId(blockId),
+    CONSTRAINT FK_exposureLineage_taskExecId
+        FOREIGN KEY(taskExecId)
+        REFERENCES prv_TaskExecution(taskExecId)
+) ENGINE=InnoDB;
+
+CREATE TABLE prv_Partition
+    -- <descr>Catalog of partitions of time-partitioned provenance tables (see
+    -- provPartitions.py). Rows of task executions of a time period, with the
+    -- data blocks, links and lineage that go with them, are moved out of the
+    -- live tables into tables named "<table>_<partitionName>", which can be
+    -- queried selectively, archived and dropped as a whole. One row per
+    -- partitioned table and partition.</descr>
+(
+    tableName VARCHAR(64) NOT NULL,
+        -- <descr>Name of the partitioned (live) table.</descr>
+    partitionName VARCHAR(64) NOT NULL,
+        -- <descr>Name of the partition, e.g. "p20211001".</descr>
+    timeBegin DATETIME NOT NULL,
+        -- <descr>Beginning of the time period of the partition.</descr>
+    timeEnd DATETIME NOT NULL,
+        -- <descr>End of the time period of the partition (exclusive).</descr>
+    keyBegin BIGINT,
+        -- <descr>Lowest key (id) in the partition, NULL if it is empty.</descr>
+    keyEnd BIGINT,
+        -- <descr>Highest key (id) in the partition, NULL if it is empty.</descr>
+    nRows BIGINT NOT NULL,
+        -- <descr>Number of rows in the partition.</descr>
+    PRIMARY KEY PK_partition(tableName, partitionName)
+) ENGINE=InnoDB;
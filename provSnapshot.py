@@ -0,0 +1,217 @@
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import datetime
+
+# Configuration of a task valid at the time of a snapshot. params is a tuple of
+# sorted (key, value) pairs, columns and files are sorted tuples.
+SnapshotTask = namedtuple(
+    'SnapshotTask', 'name taskCnfId gitSHA cnfHash params columns files')
+
+# Configuration of a pipeline: tasks is a tuple of task names, in order.
+SnapshotPipeline = namedtuple('SnapshotPipeline', 'name pipelineCnfId notes tasks')
+
+SnapshotNode = namedtuple('SnapshotNode', 'name ip os cores ram')
+
+# Names of entities that were added, removed, or configured differently.
+Changes = namedtuple('Changes', 'added removed changed')
+
+SnapshotDiff = namedtuple('SnapshotDiff', 'pipelines tasks nodes')
+
+
+class ProvSnapshot(namedtuple('ProvSnapshot',
+                              'procHistoryId theTime pipelines tasks nodes')):
+    """
+    Immutable state of provenance configuration at a point in time: which
+    pipelines, tasks (with parameters, columns and files) and nodes were
+    configured how. pipelines, tasks and nodes are tuples of records sorted by
+    name. Strings, and parameters, columns and files of configuration contents
+    (prv_cnf_TaskBody) are shared between snapshots loaded by the same
+    ProvProto, so snapshots take little memory and compare fast.
+
+    procHistoryId is the one the snapshot was taken at, or the latest one at
+    theTime (None if there was none). See ProvProto.snapshot.
+    """
+    __slots__ = ()
+
+    def pipeline(self, name):
+        """
+        Returns the SnapshotPipeline called name, or None.
+        """
+        return _find(self.pipelines, name)
+
+    def task(self, name):
+        """
+        Returns the SnapshotTask called name, or None.
+        """
+        return _find(self.tasks, name)
+
+    def node(self, name):
+        """
+        Returns the SnapshotNode called name, or None.
+        """
+        return _find(self.nodes, name)
+
+    def diff(self, other):
+        """
+        Returns a SnapshotDiff: Changes of pipelines, tasks and nodes from this
+        snapshot to other. Records are merged by name.
+        """
+        return SnapshotDiff(_diff(self.pipelines, other.pipelines),
+                            _diff(self.tasks, other.tasks),
+                            _diff(self.nodes, other.nodes))
+
+
+def _find(records, name):
+    i = bisect_left(records, (name,))
+    if i < len(records) and records[i][0] == name:
+        return records[i]
+    return None
+
+def _diff(old, new):
+    (added, removed, changed) = ([], [], [])
+    (i, j) = (0, 0)
+    while i < len(old) or j < len(new):
+        if j == len(new) or (i < len(old) and old[i][0] < new[j][0]):
+            removed.append(old[i][0])
+            i += 1
+        elif i == len(old) or new[j][0] < old[i][0]:
+            added.append(new[j][0])
+            j += 1
+        else:
+            if old[i] != new[j]:
+                changed.append(new[j][0])
+            i += 1
+            j += 1
+    return Changes(tuple(added), tuple(removed), tuple(changed))
+
+# ----------------------------------------------------------------------------------
+
+def loadSnapshot(cursor, theTime, procHistoryId=None, strings=None, bodies=None):
+    """
+    Loads the ProvSnapshot of configuration valid at theTime with five queries:
+    the procHistoryId (unless given), tasks, contents of their configurations
+    (unless all are known already), pipelines and nodes.
+
+    @param cursor         Open, valid database cursor
+    @param theTime        Time, 'YYYY-MM-DD HH:MM:SS'
+    @param procHistoryId  procHistoryId of the snapshot, or None for the latest
+                          one at theTime
+    @param strings        Dictionary used to share equal strings, e.g. between
+                          snapshots, or None
+    @param bodies         Dictionary of configuration contents known already,
+                          cnfHash --> (params, columns, files), extended with
+                          the ones loaded, or None
+    """
+    if strings is None:
+        strings = {}
+    if bodies is None:
+        bodies = {}
+    def s(value):
+        if value is None:
+            return None
+        return strings.setdefault(value, value)
+    valid = 'validityBegin <= %s AND validityEnd > %s'
+
+    if procHistoryId is None:
+        cursor.execute('''
+SELECT MAX(procHistoryId) FROM prv_ProcHistory WHERE theTime <= %s''',
+                       (theTime,))
+        procHistoryId = cursor.fetchone()[0]
+
+    cursor.execute('''
+SELECT taskName, taskCnfId, gitSHA, taskBodyId, cnfHash
+FROM   prv_cnf_Task
+JOIN   prv_Task USING(taskId)
+JOIN   prv_cnf_TaskBody USING(taskBodyId)
+WHERE  ''' + valid, (theTime, theTime))
+    taskRows = cursor.fetchall()
+
+    # contents of configurations not known yet, in one pass: parameters,
+    # columns, files
+    missing = dict((bodyId, cnfHash)
+                   for (name, cnfId, gitSHA, bodyId, cnfHash) in taskRows
+                   if cnfHash not in bodies)   # taskBodyId --> cnfHash
+    if missing:
+        ids = ', '.join(['%s'] * len(missing))
+        cursor.execute('''
+SELECT taskBodyId, 'p', theKey, theValue FROM prv_cnf_Task_KVParams
+WHERE  taskBodyId IN (%(ids)s)
+UNION ALL
+SELECT taskBodyId, 'c', tcName, NULL FROM prv_cnf_Task_Columns
+WHERE  taskBodyId IN (%(ids)s)
+UNION ALL
+SELECT taskBodyId, 'f', fileUrl, NULL FROM prv_cnf_Task_Files
+WHERE  taskBodyId IN (%(ids)s)''' % {'ids': ids}, sorted(missing) * 3)
+        contents = dict((bodyId, {'p': [], 'c': [], 'f': []})
+                        for bodyId in missing)
+        for (bodyId, kind, name, value) in cursor.fetchall():
+            contents[bodyId][kind].append(
+                (s(name), s(value)) if kind == 'p' else s(name))
+        for (bodyId, lists) in contents.items():
+            bodies[missing[bodyId]] = (tuple(sorted(lists['p'])),
+                              tuple(sorted(lists['c'])),
+                              tuple(sorted(lists['f'])))
+    tasks = tuple(sorted(
+        SnapshotTask(s(name), cnfId, s(gitSHA), s(cnfHash), *bodies[cnfHash])
+        for (name, cnfId, gitSHA, bodyId, cnfHash) in taskRows))
+
+    cursor.execute('''
+SELECT pipelineName, pipelineCnfId, notes, taskName
+FROM   prv_cnf_Pipeline
+JOIN   prv_Pipeline USING(pipelineId)
+JOIN   prv_cnf_Pipeline_Tasks USING(pipelineCnfId)
+JOIN   prv_Task USING(taskId)
+WHERE  ''' + valid + '''
+ORDER  BY pipelineCnfId, taskPosition''', (theTime, theTime))
+    pipelines = {}
+    for (name, cnfId, notes, taskName) in cursor.fetchall():
+        pipelines.setdefault((s(name), cnfId, s(notes)), []).append(s(taskName))
+    pipelines = tuple(sorted(SnapshotPipeline(name, cnfId, notes, tuple(taskNames))
+                             for ((name, cnfId, notes), taskNames)
+                             in pipelines.items()))
+
+    cursor.execute('''
+SELECT nodeName, ip, os, cores, ram
+FROM   prv_cnf_Node
+JOIN   prv_Node USING(nodeId)
+WHERE  ''' + valid, (theTime, theTime))
+    nodes = tuple(sorted(SnapshotNode(s(name), s(ip), s(os), cores, ram)
+                         for (name, ip, os, cores, ram) in cursor.fetchall()))
+
+    return ProvSnapshot(procHistoryId, s(_toTime(theTime)), pipelines, tasks,
+                        nodes)
+
+def sharedValues(snapshots):
+    """
+    Returns (strings, bodies): the dictionaries loadSnapshot shares strings and
+    configuration contents with, holding those of snapshots only. Loading with
+    them shares values with these snapshots, without keeping the values of
+    others alive.
+
+    @param snapshots  Iterable of ProvSnapshot
+    """
+    strings = {}
+    bodies = {}
+    def s(*values):
+        for value in values:
+            if value is not None:
+                strings.setdefault(value, value)
+    for snapshot in snapshots:
+        s(snapshot.theTime)
+        for task in snapshot.tasks:
+            s(task.name, task.gitSHA, task.cnfHash)
+            for (key, value) in task.params:
+                s(key, value)
+            s(*task.columns)
+            s(*task.files)
+            bodies[task.cnfHash] = (task.params, task.columns, task.files)
+        for pipeline in snapshot.pipelines:
+            s(pipeline.name, pipeline.notes, *pipeline.tasks)
+        for node in snapshot.nodes:
+            s(node.name, node.ip, node.os)
+    return (strings, bodies)
+
+def _toTime(t):
+    if isinstance(t, datetime):
+        return t.strftime('%Y-%m-%d %H:%M:%S')
+    return t
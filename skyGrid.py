@@ -0,0 +1,124 @@
+import math
+
+import numpy
+
+
+class SkyGrid(object):
+    """
+    Spatial index of Object positions. The sky is divided into a grid of cells,
+    cellSize x cellSize degrees in ra/decl, and each object keeps the id of the
+    cell it falls into (Object.pixelId, indexed). Box and cone queries first
+    select the cells that overlap the searched area through the index, and then
+    check exact positions of objects from these cells only, so their cost
+    depends on the searched area and not on the size of the Object table.
+
+    The index is maintained incrementally: whoever inserts objects computes
+    their pixelIds (see pixelIds). All writers must use the same cellSize.
+    """
+    def __init__(self, cellSize=1.0):
+        """
+        @param cellSize  Size of the cells in degrees
+        """
+        self.cellSize = cellSize
+        self._nRa = int(math.ceil(360.0 / cellSize))
+        self._nDecl = int(math.ceil(180.0 / cellSize))
+
+    def pixelIds(self, ra, decl):
+        """
+        Returns a numpy array of pixelIds for arrays (or sequences) of ra and
+        decl, in degrees.
+        """
+        (raCol, declRow) = self._cell(numpy.asarray(ra, dtype=float),
+                                      numpy.asarray(decl, dtype=float))
+        return declRow * self._nRa + raCol
+
+    def pixelId(self, ra, decl):
+        """
+        Returns pixelId of one position.
+        """
+        return int(self.pixelIds([ra], [decl])[0])
+
+    def boxPixels(self, raMin, raMax, declMin, declMax):
+        """
+        Returns a sorted list of pixelIds of all cells that overlap a box. The
+        box may cross ra=0 (raMin > raMax after wrapping, or raMin < 0).
+        """
+        declMin = max(declMin, -90.0)
+        declMax = min(declMax, 90.0)
+        if raMax - raMin >= 360:
+            cols = range(self._nRa)
+        else:
+            (colMin, colMax) = self._cell(numpy.array([raMin, raMax]),
+                                          numpy.zeros(2))[0].tolist()
+            if colMin <= colMax:
+                cols = range(colMin, colMax+1)
+            else:
+                cols = range(colMin, self._nRa) + range(0, colMax+1)
+        (rowMin, rowMax) = self._cell(numpy.zeros(2),
+                                      numpy.array([declMin, declMax]))[1].tolist()
+        return sorted(row * self._nRa + col
+                      for row in range(rowMin, rowMax+1) for col in cols)
+
+    def conePixels(self, ra, decl, radius):
+        """
+        Returns a sorted list of pixelIds of all cells that overlap a cone
+        (a circle of a given radius around ra/decl, all in degrees).
+        """
+        (declMin, declMax) = (decl - radius, decl + radius)
+        if declMin <= -90 or declMax >= 90:
+            return self.boxPixels(0, 360, declMin, declMax)
+        raRadius = radius / min(math.cos(math.radians(declMin)),
+                                math.cos(math.radians(declMax)))
+        return self.boxPixels(ra - raRadius, ra + raRadius, declMin, declMax)
+
+    def queryBox(self, cursor, raMin, raMax, declMin, declMax):
+        """
+        Returns (objectId, ra, decl, flux) of all objects inside a box. A box
+        spanning 360 degrees or more in ra covers all of it.
+        """
+        pixels = self.boxPixels(raMin, raMax, declMin, declMax)
+        if raMax - raMin >= 360:
+            (raCond, raArgs) = ('', [])
+        else:
+            (raMin, raMax) = (raMin % 360, raMax % 360)
+            if raMin <= raMax:
+                raCond = '\n  AND  ra BETWEEN %s AND %s'
+            else:
+                raCond = '\n  AND  (ra >= %s OR ra <= %s)'
+            raArgs = [raMin, raMax]
+        cursor.execute('''
+SELECT objectId, ra, decl, flux
+FROM   Object
+WHERE  pixelId IN (%s)%s
+  AND  decl BETWEEN %%s AND %%s''' % (', '.join(['%s'] * len(pixels)), raCond),
+                       pixels + raArgs + [declMin, declMax])
+        return cursor.fetchall()
+
+    def queryCone(self, cursor, ra, decl, radius):
+        """
+        Returns (objectId, ra, decl, flux) of all objects within radius degrees
+        from ra/decl.
+        """
+        pixels = self.conePixels(ra, decl, radius)
+        cursor.execute('''
+SELECT objectId, ra, decl, flux
+FROM   Object
+WHERE  pixelId IN (%s)''' % ', '.join(['%s'] * len(pixels)), pixels)
+        rows = cursor.fetchall()
+        if not rows:
+            return []
+        (objRa, objDecl) = (numpy.radians([row[1] for row in rows]),
+                            numpy.radians([row[2] for row in rows]))
+        (ra, decl) = (math.radians(ra), math.radians(decl))
+        # haversine formula
+        h = numpy.sin((objDecl - decl) / 2) ** 2 + \
+            numpy.cos(objDecl) * math.cos(decl) * numpy.sin((objRa - ra) / 2) ** 2
+        inside = 2 * numpy.arcsin(numpy.sqrt(numpy.minimum(h, 1))) <= \
+            math.radians(radius)
+        return [row for (row, isIn) in zip(rows, inside.tolist()) if isIn]
+
+    def _cell(self, ra, decl):
+        raCol = numpy.floor((ra % 360) / self.cellSize).astype(numpy.int64)
+        declRow = numpy.floor((decl + 90) / self.cellSize).astype(numpy.int64)
+        return (numpy.minimum(raCol, self._nRa - 1),
+                numpy.clip(declRow, 0, self._nDecl - 1))
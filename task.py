@@ -1,8 +1,52 @@
+import hashlib
+import json
+
 
 class Task(object):
-    def __init__(self, name, gitSHA, paramKVDict={}, tCols=(), files=()):
+    """
+    Name and configuration of a task: gitSHA of its code, parameters, columns
+    it writes ("<table>.<column>") and files it reads.
+    """
+    __slots__ = ('name', 'gitSHA', 'paramKVDict', 'tCols', 'files')
+
+    def __init__(self, name, gitSHA, paramKVDict=None, tCols=(), files=()):
         self.name = name
         self.gitSHA = gitSHA
-        self.paramKVDict = paramKVDict
-        self.tCols = tCols
-        self.files = files
+        self.paramKVDict = dict(paramKVDict) if paramKVDict else {}
+        self.tCols = tuple(tCols)
+        self.files = tuple(files)
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for (name, value) in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    @classmethod
+    def fromSnapshot(cls, rec):
+        """
+        Returns the Task configured as a SnapshotTask record (see provSnapshot).
+        """
+        return cls(rec.name, rec.gitSHA, dict(rec.params), rec.columns, rec.files)
+
+    def configRows(self, taskBodyId):
+        """
+        Returns rows of the configuration contents taskBodyId of this task:
+        (prv_cnf_Task_KVParams, prv_cnf_Task_Columns, prv_cnf_Task_Files) rows.
+        """
+        return ([(taskBodyId, k, v) for (k, v) in sorted(self.paramKVDict.items())],
+                [(taskBodyId, c) for c in self.tCols],
+                [(taskBodyId, f) for f in self.files])
+
+    def cnfHash(self):
+        """
+        Returns SHA-1 (hex) of the canonical form of the configuration of this
+        task: gitSHA, sorted parameters, columns and files. Two tasks configured
+        the same way have the same hash, regardless of their names.
+        """
+        canonical = json.dumps([self.gitSHA,
+                                sorted(self.paramKVDict.items()),
+                                sorted(self.tCols),
+                                sorted(self.files)], separators=(',', ':'))
+        return hashlib.sha1(canonical).hexdigest()
@@ -1,13 +1,19 @@
 #!/usr/bin/env python
 
+import argparse
 from datetime import datetime, timedelta
+import os
 import random
+import tempfile
 
-import MySQLdb
-
+from blockPolicy import makeBlockPolicy
 from calibPipe import CalibPipe
+from changeNotifier import LocalNotifier, MmapNotifier
 from orchestration import Orchestration
+from provBackend import MySQLBackend, SQLiteBackend
 from provDetective import ProvDetective
+from provMetrics import InstrumentedBackend, Metrics, instrument
+from provPool import ConnectionPool, transaction
 from provProto import ProvProto
 from task import Task
 
@@ -15,27 +21,39 @@ from task import Task
 class CatalogBuilder(object):
     """
     This class is here to help build a dummy environment that is used for testing
-    provenance prototype.
+    provenance prototype. It writes through the cursor of the transaction it is
+    given (see provPool.transaction), flush() before it ends.
     """
-    def __init__(self, host, port, user, password, db):
-        self._conn = MySQLdb.connect(host=host, port=port, user=user,
-                                     passwd=password, db=db)
-        self._cursor = self._conn.cursor()
-
-    def __del__(self):
-        self._conn.close()
+    def __init__(self, cursor, batchSize=10000):
+        """
+        @param cursor     Open, valid database cursor
+        @param batchSize  Number of raw exposures inserted with one statement
+        """
+        self._cursor = cursor
+        self._batchSize = batchSize
+        self._rawExposures = []
 
     def addRawExposure(self, filter, ra, decl, obsStart):
         flux = random.uniform(0.01, 1.5)
-        self._cursor.execute('''
+        self._rawExposures.append((filter, ra, decl, obsStart, flux))
+        if len(self._rawExposures) >= self._batchSize:
+            self._flushRawExposures()
+
+    def _flushRawExposures(self):
+        if self._rawExposures:
+            self._cursor.executemany('''
 INSERT INTO RawExposure(filter, ra, decl, obsStart, flux)
-VALUES ("%c", %f, %f, "%s", %f)''' % (filter, ra, decl, obsStart, flux))
+VALUES (%s, %s, %s, %s, %s)''', self._rawExposures)
+            self._rawExposures = []
 
     def addRawCalibExposure(self, filter, ra, decl):
         v = random.randint(1, 10)
         self._cursor.execute('''
 INSERT INTO RawCalibExposure(filter, ra, decl, v)
-VALUES ("%c", %f, %f, "%s")''' % (filter, ra, decl, v))
+VALUES (%s, %s, %s, %s)''', (filter, ra, decl, v))
+
+    def flush(self):
+        self._flushRawExposures()
 
 # ----------------------------------------------------------------------------------
 
@@ -47,21 +65,78 @@ mysqlCredentials = {
     "db":'provProto'
 }
 
+def makeBackend(sqlitePath=None):
+    """
+    Returns the MySQL backend using mysqlCredentials, or, if sqlitePath is given,
+    an SQLite backend with a freshly created database in that file.
+    """
+    if sqlitePath is None:
+        return MySQLBackend(**mysqlCredentials)
+    backend = SQLiteBackend(sqlitePath)
+    backend.createSchema()
+    return backend
+
 # ----------------------------------------------------------------------------------
 
-def prepareIt():
+def prepareIt(backend, nExposures=100, metrics=None, nNodes=None,
+              notifier=None):
+    """
+    Registers pipelines and nodes, loads nExposures raw exposures and calibrates
+    them. Returns the ProvProto object used. Each step is one transaction (see
+    provPool.transaction).
+
+    @param nNodes    Number of processing nodes to register (see
+                     registerEnvironment)
+    @param notifier  Change notifier of the ProvProto, defaults to a
+                     LocalNotifier
+    """
     # I guess we don't want true random because we want to be able to reproduce,
     # so seed with the same number.
     random.seed(123)
 
-    cr = mysqlCredentials.copy()
-    cr['passwd'] = cr['password']
-    del cr['password']
-    conn = MySQLdb.connect(**cr)
-    conn.autocommit(False)
-    cursor = conn.cursor()
-    pp = ProvProto()
+    pp = ProvProto(bufferSize=1000, notifier=notifier or LocalNotifier())
+    with transaction(backend) as cursor:
+        registerEnvironment(pp, cursor, nNodes)
+    pp.publishChanges()
+
+    # Let's say we have 100 different rawExposures. Each exposure have
+    # a randomly generated flux. The exposures were taken in one of
+    # the 6 filters, in one of the 4 different points of the sky
+    with transaction(backend) as cursor:
+        cb = CatalogBuilder(cursor)
+        t = '2021-10-01 00:00:00'
+        for i in range(0, nExposures):
+            f = random.choice(['u','g', 'r', 'i', 'z', 'y'])
+            p = random.choice([(10,12), (15,30), (20,29), (75,44)])
+            theTime = datetime.strptime(t, "%Y-%m-%d %H:%M:%S")
+            theTime += timedelta(seconds=15)
+            t = theTime.strftime("%Y-%m-%d %H:%M:%S")
+            cb.addRawExposure(f, p[0], p[1], t)
+
+        # And a rawCalibration exposures for each of these parts of the sky
+        # for each filter. Each has a randomly generated INT value 1-10
+        for f in ('u', 'g', 'r', 'i', 'z', 'y'):
+            cb.addRawCalibExposure(f, 10, 12)
+            cb.addRawCalibExposure(f, 15, 30)
+            cb.addRawCalibExposure(f, 20, 29)
+            cb.addRawCalibExposure(f, 75, 44)
+        cb.flush()
+
+    # Now run the calibration pipeline. It is nothing fancy, just one query for
+    # all raw exposures, registered in provenance as one task execution
+    calibPipe = CalibPipe(backend)
+    if metrics is not None:
+        calibPipe = instrument(calibPipe, metrics, 'calibpipe')
+    calibPipe.runBulk(pp)
+    return pp
 
+def registerEnvironment(pp, cursor, nNodes=None):
+    """
+    Registers pipelines and nodes, see prepareIt.
+
+    @param nNodes  Number of processing nodes to register, defaults to the 6
+                   nodes below; more are made up
+    """
     # pretend we are just starting construction, it is Oct of 2021
     pp.setCurrentTime('2021-10-01 00:00:00')
 
@@ -102,56 +177,113 @@ def prepareIt():
              ('lsst8',       '34.56.59.8',  'CentOS 6.7',  8,  32),
              ('lsst9',       '34.56.59.9',  'CentOS 6.7',  8,  32)]
 
+    if nNodes is not None:
+        nodes = nodes[:nNodes]
+        for i in xrange(len(nodes), nNodes):
+            nodes.append(('lsst-node%04d' % i,
+                          '34.57.%d.%d' % (i / 250, i % 250 + 1),
+                          'CentOS 6.7', 8, 32))
+
     for node in nodes:
         pp.registerNode(cursor, *node)
 
-    cursor.close()
-    conn.commit()
-
-    # Let's say we have 100 different rawExposures. Each exposure have
-    # a randomly generated flux. The exposures were taken in one of
-    # the 6 filters, in one of the 4 different points of the sky
-    cb = CatalogBuilder(**mysqlCredentials)
-    t = '2021-10-01 00:00:00'
-    for i in range(0, 100):
-        f = random.choice(['u','g', 'r', 'i', 'z', 'y'])
-        p = random.choice([(10,12), (15,30), (20,29), (75,44)])
-        theTime = datetime.strptime(t, "%Y-%m-%d %H:%M:%S")
-        theTime += timedelta(seconds=15)
-        t = theTime.strftime("%Y-%m-%d %H:%M:%S")
-        cb.addRawExposure(f, p[0], p[1], t)
-
-    # And a rawCalibration exposures for each of these parts of the sky
-    # for each filter. Each has a randomly generated INT value 1-10
-    for f in ('u', 'g', 'r', 'i', 'z', 'y'):
-        cb.addRawCalibExposure(f, 10, 12)
-        cb.addRawCalibExposure(f, 15, 30)
-        cb.addRawCalibExposure(f, 20, 29)
-        cb.addRawCalibExposure(f, 75, 44)
-
-    # Now run the calibration pipeline. It is nothing fancy, just one mysql query
-    calibPipe = CalibPipe(**mysqlCredentials)
-    calibPipe.run()
+# ----------------------------------------------------------------------------------
 
+def runIt(backend, pp, nWorkers=None, metrics=None, blockPolicy=None,
+          asyncProv=False, journal=None):
     # Then we run DRP. This one is more advanced. We run it through orchestration
     # layer, different tasks are run on different nodes etc. This pipeline produces
-    # objects and sources.
-    orch = Orchestration(pp, **mysqlCredentials)
-    orch.runDRP()
+    # objects and sources. With nWorkers, data blocks are processed in parallel.
+    # blockPolicy decides how many exposures go to one data block. With asyncProv,
+    # provenance is written while the next data block is processed. With journal,
+    # provenance goes to a local journal first, and is loaded from there.
+    orch = Orchestration(pp, backend, metrics, blockPolicy=blockPolicy,
+                         asyncProv=asyncProv, journal=journal)
+    if nWorkers is None:
+        orch.runDRP()
+    else:
+        orch.runDRPParallel(nWorkers)
+    print 'provenance lookup caches (hits, misses):', pp.cacheStats()
 
 # ----------------------------------------------------------------------------------
 
-def queryIt():
+def queryIt(backend):
     # And finally we do some queries on the provenance
-    provDet = ProvDetective(**mysqlCredentials)
+    provDet = ProvDetective(backend)
+    provDet.printProvenanceVolume()
     provDet.nodesThatProcessedObject()
     provDet.taskVersionForAllSources('WCS Determination', 10)
+    for rec in provDet.taskVersionsForObjects('WCS Determination', range(1, 6)):
+        print rec
 
 # ----------------------------------------------------------------------------------
 
 def main():
-    prepareIt()
-    queryIt()
+    # Runs against MySQL (see runIt.sh), or against an embedded SQLite database
+    # when a database file name is given: ./testProvProto.py --sqlite provProto.db
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sqlite', metavar='FILE',
+                        help='run against a new SQLite database in FILE')
+    parser.add_argument('--workers', type=int, metavar='N',
+                        help='process data blocks in parallel, using N workers')
+    parser.add_argument('--block-policy', metavar='SPEC', type=makeBlockPolicy,
+                        help='how exposures are grouped into data blocks, e.g. '
+                        'fixed:100, time:3600, capacity:2:1, adaptive:10:1000 '
+                        '(see blockPolicy.makeBlockPolicy)')
+    parser.add_argument('--async-prov', action='store_true',
+                        help='write provenance asynchronously (serial run only)')
+    parser.add_argument('--journal', metavar='DIR',
+                        help='write provenance to a journal in DIR, loaded in '
+                        'the background (serial run only, see provJournal)')
+    parser.add_argument('--pool', type=int, metavar='N',
+                        help='share at most N connections between components, '
+                        'per process (see provPool.ConnectionPool); at least 2, '
+                        '3 with --async-prov or --journal')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='record metrics and write them to FILE (JSON if it '
+                        'ends with .json, Prometheus text format otherwise)')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='save a cProfile trace of each data block in DIR')
+    args = parser.parse_args()
+    if args.workers and (args.async_prov or args.journal):
+        parser.error('--async-prov and --journal apply to serial runs only, '
+                     'not with --workers')
+    if args.async_prov and args.journal:
+        parser.error('--async-prov and --journal are exclusive')
+    # pipelines and their exposure streams hold a connection each, and so does
+    # the provenance writer or journal loader
+    minPool = 3 if args.async_prov or args.journal else 2
+    if args.pool is not None and args.pool < minPool:
+        parser.error('--pool needs at least %d connections here' % minPool)
+    backend = makeBackend(args.sqlite)
+    metrics = None
+    if args.metrics or args.profile:
+        metrics = Metrics(args.profile)
+        backend = InstrumentedBackend(backend, metrics)
+    if args.pool:
+        backend = ConnectionPool(backend, maxSize=args.pool)
+    notifier = None
+    if args.workers:
+        # shared with the worker processes
+        (fd, notifierPath) = tempfile.mkstemp(prefix='provProto-',
+                                              suffix='.notifier')
+        os.close(fd)
+        notifier = MmapNotifier(notifierPath)
+    try:
+        pp = prepareIt(backend, metrics=metrics, notifier=notifier)
+        runIt(backend, pp, args.workers, metrics, args.block_policy,
+              args.async_prov, args.journal)
+    finally:
+        if notifier is not None:
+            notifier.close()
+            os.remove(notifierPath)
+    queryIt(backend)
+    if args.pool:
+        print 'connection pool:', backend.stats()
+    if metrics is not None:
+        print metrics.summary()
+        if args.metrics:
+            metrics.write(args.metrics)
 
 # ----------------------------------------------------------------------------------
 